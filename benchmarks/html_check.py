@@ -0,0 +1,63 @@
+"""
+Times Note._find_invalid_html_tags_in_field on inputs that make Note._INVALID_HTML_TAG_RE backtrack quadratically.
+
+Each input is timed at doubling sizes. Run time should roughly double along with the size; the last column shows the
+ratio to the previous size. Pass --regex to also time the regex on the smaller sizes, for comparison.
+
+  python benchmarks/html_check.py
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from genanki import Note  # noqa: E402
+
+# name -> (repeated piece, suffix)
+PATHOLOGICAL_INPUTS = {
+  'many_lt': ('<', ''),
+  'many_lt_then_gt': ('<', '>'),
+  'unclosed_tags': ('<a ', ''),
+  'unclosed_tags_then_gt': ('<a ', '>'),
+  'unclosed_tags_multiline': ('<x y\n', '>'),
+  'invalid_tags': ('<@>', ''),
+  'math': ('a < b && c <= d; ', '>'),
+  'valid_html': ('<div class="x">text <b>bold</b></div>', ''),
+}
+
+
+def _best_of(func, repeat=3):
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--max-size', type=int, default=1 << 22, help='largest input size, in characters')
+  parser.add_argument('--regex', action='store_true', help='also time the regex (only up to 16k characters)')
+  args = parser.parse_args()
+
+  print('{:<26} {:>10} {:>12} {:>8} {:>12}'.format('input', 'size', 'scanner (s)', 'ratio', 'regex (s)'))
+  for name, (piece, suffix) in PATHOLOGICAL_INPUTS.items():
+    prev = None
+    size = 1 << 14
+    while size <= args.max_size:
+      field = piece * (size // len(piece)) + suffix
+      elapsed = _best_of(lambda: Note._find_invalid_html_tags_in_field(field))
+      regex_elapsed = ''
+      if args.regex and size <= 1 << 14:
+        regex_elapsed = '{:.6f}'.format(_best_of(lambda: Note._INVALID_HTML_TAG_RE.findall(field), repeat=1))
+      ratio = '' if prev is None else '{:.2f}'.format(elapsed / prev)
+      print('{:<26} {:>10} {:>12.6f} {:>8} {:>12}'.format(name, size, elapsed, ratio, regex_elapsed))
+      prev = elapsed
+      size *= 2
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,426 @@
+"""
+Times genanki's build hot paths on synthetic corpora, and compares the results against a baseline.
+
+Each benchmark is run on each corpus it applies to, and the best of --repeat runs is reported. Results are written as
+JSON (to stdout, or to --output), so that they can be saved as a baseline and compared against later:
+
+  python benchmarks/run.py --output baseline.json
+  # ... change genanki ...
+  python benchmarks/run.py --compare baseline.json
+
+--compare exits with status 1 if any benchmark got slower by more than --threshold. See also `make bench` and
+`make bench-compare`.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import genanki  # noqa: E402
+from genanki.apkg_schema import APKG_BUILD_PRAGMAS, APKG_INDEXES, APKG_SCHEMA, APKG_TABLES  # noqa: E402
+from genanki.batch_writer import BatchWriter  # noqa: E402
+from genanki.compression import NO_COMPRESSION  # noqa: E402
+from genanki.package import _write_media_files  # noqa: E402
+
+RESULTS_VERSION = 1
+TIMESTAMP = 1600000000
+NUM_DECKS_IN_MANY_DECKS = 1000
+
+
+def _parse_size(size):
+  """'10k' -> 10000, '1m' -> 1000000."""
+  multipliers = {'k': 10 ** 3, 'm': 10 ** 6}
+  size = size.strip().lower()
+  if size[-1:] in multipliers:
+    return int(size[:-1]) * multipliers[size[-1]]
+  return int(size)
+
+
+def _front_back_notes(n, rng):
+  for i in range(n):
+    yield genanki.Note(genanki.BASIC_AND_REVERSED_CARD_MODEL, [
+      'Question <b>{}</b> about {}'.format(i, rng.random()),
+      '<div class="answer">Answer {}<br>{}</div>'.format(i, 'lorem ipsum ' * rng.randrange(1, 10)),
+    ], tags=['tag{}'.format(i % 50)])
+
+
+def _cloze_notes(n, rng):
+  for i in range(n):
+    yield genanki.Note(genanki.CLOZE_MODEL, [
+      'The {{{{c1::capital}}}} of {{{{c2::country {}}}}} is {{{{c3::city {}}}}}.'.format(i, rng.random()),
+      'Extra <i>{}</i>'.format(i),
+    ])
+
+
+def _make_corpus(kind, size):
+  """
+  Returns a list of Decks. Notes are generated from a fixed seed, so that each run times the same data.
+  """
+  rng = random.Random(size)
+  if kind == 'front_back':
+    deck = genanki.Deck(1800000000, 'front_back')
+    deck.notes = list(_front_back_notes(size, rng))
+    return [deck]
+  if kind == 'cloze':
+    deck = genanki.Deck(1800000001, 'cloze')
+    deck.notes = list(_cloze_notes(size, rng))
+    return [deck]
+  if kind == 'many_decks':
+    notes = _front_back_notes(size, rng)
+    decks = []
+    per_deck = max(1, size // NUM_DECKS_IN_MANY_DECKS)
+    for deck_idx in range(NUM_DECKS_IN_MANY_DECKS):
+      deck = genanki.Deck(1800001000 + deck_idx, 'many::deck {}'.format(deck_idx))
+      deck.notes = list(itertools.islice(notes, per_deck))
+      decks.append(deck)
+    return decks
+  raise ValueError('Unknown corpus kind {!r}'.format(kind))
+
+
+def _make_media(directory, num_files, file_size):
+  """
+  Writes `num_files` files of `file_size` bytes into `directory`: half "JPEGs" of random (incompressible) bytes and
+  half text files (compressible).
+  """
+  rng = random.Random(num_files)
+  paths = []
+  for i in range(num_files):
+    if i % 2:
+      path = os.path.join(directory, 'image{}.jpg'.format(i))
+      data = b'\xff\xd8\xff' + rng.getrandbits(8 * file_size).to_bytes(file_size, 'little')[3:]
+    else:
+      path = os.path.join(directory, 'text{}.txt'.format(i))
+      data = (b'lorem ipsum dolor sit amet ' * (file_size // 27 + 1))[:file_size]
+    with open(path, 'wb') as h:
+      h.write(data)
+    paths.append(path)
+  return paths
+
+
+def _notes(decks):
+  return [note for deck in decks for note in deck.notes]
+
+
+# Each benchmark takes the corpus kind, size and the shared context, and returns (setup, func): setup() builds fresh
+# input outside the timed region, and func(input) is timed. If func returns a number, that is used as its time instead.
+
+def bench_import(kind, size, ctx):
+  def run(_):
+    # -X importtime reports the cumulative import time of each module, in microseconds
+    output = subprocess.run(
+      [sys.executable, '-X', 'importtime', '-c', 'import genanki'], cwd=ctx['repo_dir'], check=True,
+      stderr=subprocess.PIPE, universal_newlines=True).stderr
+    for line in output.splitlines():
+      if line.endswith('| genanki'):
+        return int(line.split('|')[1]) / 1e6
+    raise RuntimeError('Unexpected -X importtime output: {}'.format(output))
+  return lambda: None, run
+
+
+def bench_note_cards(kind, size, ctx):
+  cards = genanki.Note.cards.func  # the uncached computation behind the cached_property
+  def run(notes):
+    for note in notes:
+      cards(note)
+  return lambda: _notes(_make_corpus(kind, size)), run
+
+
+def bench_model_req(kind, size, ctx):
+  models = [genanki.BASIC_MODEL, genanki.BASIC_AND_REVERSED_CARD_MODEL, genanki.BASIC_OPTIONAL_REVERSED_CARD_MODEL,
+            genanki.BASIC_TYPE_IN_THE_ANSWER_MODEL]
+  def run(_):
+    for _ in range(100):
+      for model in models:
+        model.__dict__.pop('_req', None)
+        model._req
+  return lambda: None, run
+
+
+def bench_guid_for(kind, size, ctx):
+  def run(field_lists):
+    guid_for = genanki.guid_for
+    for fields in field_lists:
+      guid_for(*fields)
+  return lambda: [note.fields for note in _notes(_make_corpus(kind, size))], run
+
+
+def bench_html_check(kind, size, ctx):
+  def run(notes):
+    for note in notes:
+      note._check_invalid_html_tags_in_fields()
+  return lambda: _notes(_make_corpus(kind, size)), run
+
+
+def bench_write_to_db(kind, size, ctx):
+  def run(decks):
+    conn = sqlite3.connect(':memory:')
+    genanki.Package(decks).write_to_db(conn.cursor(), TIMESTAMP, itertools.count(TIMESTAMP * 1000))
+    conn.commit()
+    conn.close()
+  return lambda: _make_corpus(kind, size), run
+
+
+def bench_write_to_file(kind, size, ctx, workers=None):
+  """
+  Writes an .apkg with Package.write_to_file, on one process or on ctx['workers'] processes (see --workers).
+  """
+  out_path = os.path.join(ctx['tmpdir'], 'write_to_file.apkg')
+  def run(decks):
+    genanki.Package(decks).write_to_file(out_path, timestamp=TIMESTAMP, workers=workers)
+  return lambda: _make_corpus(kind, size), run
+
+
+def bench_write_to_file_workers(kind, size, ctx):
+  return bench_write_to_file(kind, size, ctx, workers=ctx['workers'])
+
+
+def _front_back_columns(size):
+  rng = random.Random(size)
+  notes = list(_front_back_notes(size, rng))
+  return [note.fields[0] for note in notes], [note.fields[1] for note in notes], [list(note.tags) for note in notes]
+
+
+def bench_ingest_notes(kind, size, ctx, columnar=False):
+  """
+  Builds a deck from column data (as from a database query) and writes it with write_to_db: one Note per row, or with
+  Deck.add_notes_from_columns if `columnar`.
+  """
+  model = genanki.BASIC_AND_REVERSED_CARD_MODEL
+  def run(columns):
+    fronts, backs, tags = columns
+    deck = genanki.Deck(1800000000, 'ingest')
+    if columnar:
+      deck.add_notes_from_columns(model, [fronts, backs], tags=tags)
+    else:
+      for front, back, note_tags in zip(fronts, backs, tags):
+        deck.add_note(genanki.Note(model, [front, back], tags=note_tags))
+    conn = sqlite3.connect(':memory:')
+    genanki.Package(deck).write_to_db(conn.cursor(), TIMESTAMP, itertools.count(TIMESTAMP * 1000))
+    conn.commit()
+    conn.close()
+  return lambda: _front_back_columns(size), run
+
+
+def bench_ingest_columns(kind, size, ctx):
+  return bench_ingest_notes(kind, size, ctx, columnar=True)
+
+
+def bench_insert(kind, size, ctx, tuned=False):
+  """
+  Inserts notes into an on-disk database, with either SQLite's default settings and the indexes created up front, or
+  with APKG_BUILD_PRAGMAS and the indexes created afterwards (as Package.write_to_file does). Cards are generated in
+  setup, so that mostly SQLite is timed.
+  """
+  dbfilename = os.path.join(ctx['tmpdir'], 'insert.anki2')
+  def setup():
+    if os.path.exists(dbfilename):
+      os.remove(dbfilename)
+    decks = _make_corpus(kind, size)
+    for note in _notes(decks):
+      note.cards
+    return decks
+  def run(decks):
+    conn = sqlite3.connect(dbfilename)
+    cursor = conn.cursor()
+    if tuned:
+      cursor.executescript(APKG_BUILD_PRAGMAS)
+      cursor.executescript(APKG_TABLES)
+    else:
+      cursor.executescript(APKG_SCHEMA)
+    batch_writer = BatchWriter(cursor, html_validation=BatchWriter.HTML_VALIDATION_OFF)
+    id_gen = itertools.count(TIMESTAMP * 1000)
+    for deck in decks:
+      for note in deck.notes:
+        batch_writer.add_note(note, TIMESTAMP, deck.deck_id, id_gen)
+    batch_writer.flush()
+    if tuned:
+      cursor.executescript(APKG_INDEXES)
+    conn.commit()
+    conn.close()
+  return setup, run
+
+
+def bench_insert_tuned(kind, size, ctx):
+  return bench_insert(kind, size, ctx, tuned=True)
+
+
+def bench_zip(kind, size, ctx, compression=None):
+  dbfilename = os.path.join(ctx['tmpdir'], '{}_{}.anki2'.format(kind, size))
+  if not os.path.exists(dbfilename):
+    conn = sqlite3.connect(dbfilename)
+    genanki.Package(_make_corpus(kind, size)).write_to_db(conn.cursor(), TIMESTAMP, itertools.count(TIMESTAMP * 1000))
+    conn.commit()
+    conn.close()
+  compression = compression or NO_COMPRESSION
+  out_path = os.path.join(ctx['tmpdir'], 'out.apkg')
+  def run(_):
+    with zipfile.ZipFile(out_path, 'w') as outzip:
+      outzip.write(dbfilename, 'collection.anki2', compress_type=compression.compress_type_for_collection(),
+                   compresslevel=compression.level)
+      _write_media_files(outzip, ctx['media_files'], compression)
+  return lambda: None, run
+
+
+def bench_zip_deflate(kind, size, ctx):
+  return bench_zip(kind, size, ctx, genanki.CompressionPolicy())
+
+
+# name -> (function, corpus kinds it runs on)
+BENCHMARKS = {
+  'import': (bench_import, [None]),
+  'note_cards': (bench_note_cards, ['front_back', 'cloze']),
+  'model_req': (bench_model_req, [None]),
+  'guid_for': (bench_guid_for, ['front_back']),
+  'html_check': (bench_html_check, ['front_back', 'cloze']),
+  'write_to_db': (bench_write_to_db, ['front_back', 'cloze', 'many_decks']),
+  'write_to_file': (bench_write_to_file, ['front_back']),
+  'write_to_file_workers': (bench_write_to_file_workers, ['front_back']),
+  'ingest_notes': (bench_ingest_notes, ['front_back']),
+  'ingest_columns': (bench_ingest_columns, ['front_back']),
+  'insert': (bench_insert, ['front_back']),
+  'insert_tuned': (bench_insert_tuned, ['front_back']),
+  'zip': (bench_zip, ['front_back']),
+  'zip_deflate': (bench_zip_deflate, ['front_back']),
+}
+
+
+def _best_of(setup, func, repeat):
+  best = float('inf')
+  for _ in range(repeat):
+    arg = setup()
+    start = time.perf_counter()
+    elapsed = func(arg)
+    if elapsed is None:
+      elapsed = time.perf_counter() - start
+    best = min(best, elapsed)
+  return best
+
+
+def run_benchmarks(sizes, repeat, only=None, num_media_files=200, media_file_size=256 * 1024, workers=None,
+                   log=sys.stderr):
+  """
+  :param workers: Number of processes for the write_to_file_workers benchmark. Defaults to the number of CPUs, and
+      is at least 2.
+  :return: Results dict, as written to the JSON output.
+  """
+  if workers is None:
+    workers = max(2, os.cpu_count() or 1)
+  # the on-disk "req" cache would make model_req measure a file read
+  os.environ.pop('GENANKI_CACHE_DIR', None)
+
+  results = {}
+  tmpdir = tempfile.mkdtemp(prefix='genanki-bench-')
+  try:
+    media_dir = os.path.join(tmpdir, 'media')
+    os.mkdir(media_dir)
+    ctx = {
+      'repo_dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'),
+      'tmpdir': tmpdir,
+      'media_files': _make_media(media_dir, num_media_files, media_file_size),
+      'workers': workers,
+    }
+    for name, (bench, kinds) in BENCHMARKS.items():
+      if only and not re.search(only, name):
+        continue
+      for kind in kinds:
+        for size in (sizes if kind is not None else [None]):
+          key = '/'.join(str(part) for part in (name, kind, size) if part is not None)
+          setup, func = bench(kind, size, ctx)
+          seconds = _best_of(setup, func, repeat)
+          results[key] = {'seconds': seconds}
+          if size:
+            results[key]['us_per_note'] = seconds / size * 1e6
+          print('{:<36} {:>10.4f} s'.format(key, seconds), file=log)
+  finally:
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+  return {
+    'version': RESULTS_VERSION,
+    'meta': {
+      'genanki_version': genanki.__version__,
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'repeat': repeat,
+      'num_media_files': num_media_files,
+      'media_file_size': media_file_size,
+      'workers': workers,
+      'cpu_count': os.cpu_count(),
+    },
+    'results': results,
+  }
+
+
+def compare(results, baseline, threshold):
+  """
+  Prints a comparison table and returns the keys of the benchmarks that are slower than the baseline by more than
+  `threshold` (a fraction, e.g. 0.1 for 10%).
+  """
+  regressions = []
+  print('{:<36} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline (s)', 'current (s)', 'ratio'))
+  for key, result in results['results'].items():
+    base = baseline['results'].get(key)
+    if base is None:
+      print('{:<36} {:>12} {:>12.4f} {:>8}'.format(key, '-', result['seconds'], 'new'))
+      continue
+    ratio = result['seconds'] / base['seconds'] if base['seconds'] else float('inf')
+    flag = ''
+    if ratio > 1 + threshold:
+      flag = '  REGRESSION'
+      regressions.append(key)
+    print('{:<36} {:>12.4f} {:>12.4f} {:>8.2f}{}'.format(key, base['seconds'], result['seconds'], ratio, flag))
+  return regressions
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--sizes', default='10k',
+                      help='comma-separated corpus sizes in notes, e.g. "10k,100k,1m" (default: %(default)s)')
+  parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark; the best is reported')
+  parser.add_argument('--only', help='only run benchmarks whose name matches this regex')
+  parser.add_argument('--media-files', type=int, default=200, help='number of media files for the zip benchmarks')
+  parser.add_argument('--media-size', type=int, default=256 * 1024, help='size of each media file, in bytes')
+  parser.add_argument('--workers', type=int,
+                      help='processes for the write_to_file_workers benchmark (default: the number of CPUs, at least 2)')
+  parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+  parser.add_argument('--compare', metavar='BASELINE', help='compare against the JSON results in this file')
+  parser.add_argument('--threshold', type=float, default=0.1,
+                      help='with --compare, fail if a benchmark is slower by more than this fraction (default: '
+                           '%(default)s)')
+  args = parser.parse_args(argv)
+
+  results = run_benchmarks(
+    [_parse_size(size) for size in args.sizes.split(',')], args.repeat, args.only, args.media_files, args.media_size,
+    args.workers)
+
+  if args.output:
+    with open(args.output, 'w') as h:
+      json.dump(results, h, indent=2)
+  elif not args.compare:
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+  if args.compare:
+    with open(args.compare) as h:
+      baseline = json.load(h)
+    if baseline.get('version') != RESULTS_VERSION:
+      parser.error('{} was written by an incompatible version of this script'.format(args.compare))
+    if compare(results, baseline, args.threshold):
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -1,16 +1,61 @@
-
 from .version import __version__
 
 from .card import Card
 from .deck import Deck
 from .model import Model
 from .note import Note
-from .package import Package
 
 from .util import guid_for
+from .util import guid_for_many
+
+# Everything else is imported on first use (see __getattr__ below), so that `import genanki` stays fast: these pull in
+# sqlite3, zipfile, tempfile etc., and the builtin models are built when genanki.builtin_models is imported.
+_LAZY_ATTRIBUTES = {
+  'ChangeSet': 'diff',
+  'CompressionPolicy': 'compression',
+  'NoteColumns': 'note_columns',
+  'Package': 'package',
+  'PackageDiff': 'diff',
+  'PackageReader': 'package_reader',
+  'PackageUpdater': 'package_updater',
+  'PackageWriter': 'package_writer',
+  'ProgressEvent': 'progress',
+  'ProgressReporter': 'progress',
+  'SummaryTracer': 'tracing',
+  'TagRegistry': 'tags',
+  'Tracer': 'tracing',
+  'diff_packages': 'diff',
+  'reset_interned_tags': 'tags',
+  'BASIC_MODEL': 'builtin_models',
+  'BASIC_AND_REVERSED_CARD_MODEL': 'builtin_models',
+  'BASIC_OPTIONAL_REVERSED_CARD_MODEL': 'builtin_models',
+  'BASIC_TYPE_IN_THE_ANSWER_MODEL': 'builtin_models',
+  'CLOZE_MODEL': 'builtin_models',
+}
+
+
+# Submodules that used to be imported by `import genanki`, and so could be used as e.g. genanki.package without
+# importing them first. Accessing one of these imports it.
+_LAZY_SUBMODULES = frozenset([
+  'apkg_col', 'apkg_schema', 'batch_writer', 'build_cache', 'builtin_models', 'compression', 'diff', 'media',
+  'note_columns', 'package', 'package_reader', 'package_updater', 'package_writer', 'progress', 'required_fields',
+  'sharded_build', 'tabular', 'tags', 'tracing'])
+
+# `from genanki import *` resolves the lazy names through __getattr__
+__all__ = ['Card', 'Deck', 'Model', 'Note', 'guid_for', 'guid_for_many'] + list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+  import importlib
+  if name in _LAZY_SUBMODULES:
+    return importlib.import_module('.' + name, __name__)
+  module_name = _LAZY_ATTRIBUTES.get(name)
+  if module_name is None:
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+  value = getattr(importlib.import_module('.' + module_name, __name__), name)
+  globals()[name] = value
+  return value
+
 
-from .builtin_models import BASIC_MODEL
-from .builtin_models import BASIC_AND_REVERSED_CARD_MODEL
-from .builtin_models import BASIC_OPTIONAL_REVERSED_CARD_MODEL
-from .builtin_models import BASIC_TYPE_IN_THE_ANSWER_MODEL
-from .builtin_models import CLOZE_MODEL
+def __dir__():
+  return sorted(set(globals()) | set(_LAZY_ATTRIBUTES) | _LAZY_SUBMODULES)
@@ -0,0 +1,124 @@
+"""
+Command-line interface: python -m genanki <command> ...
+
+  build INPUT --model MODEL --deck NAME -o OUTPUT.apkg [--field FIELD=COLUMN ...] [--workers N] ...
+      Writes a note for each row of a CSV, TSV or JSON Lines file. See genanki/tabular.py.
+
+  diff OLD.apkg NEW.apkg [--json]
+      Prints the notes (by guid), media files and models that were added (+), removed (-) or modified (~). Exits with
+      status 1 if the packages differ, like diff(1).
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+
+
+def _build(args):
+  from . import tabular
+
+  # report mistakes such as a missing column, an unknown model or an unreadable file in one line, not a traceback
+  try:
+    return _build_table(args, tabular)
+  except (ValueError, OSError, csv.Error) as e:
+    raise SystemExit('genanki build: error: {}'.format(e))
+
+
+def _build_table(args, tabular):
+  from .compression import CompressionPolicy
+
+  model = tabular.load_model(args.model)
+  field_columns = _field_columns(model, args.field)
+  input_format = args.format or (tabular.guess_format(args.input) if args.input != '-' else 'csv')
+  compression = CompressionPolicy() if args.compress else None
+  output = sys.stdout.buffer if args.output == '-' else args.output
+
+  if args.input == '-':
+    input_file = io.TextIOWrapper(sys.stdin.buffer, encoding=args.encoding, newline='')
+  else:
+    input_file = open(args.input, encoding=args.encoding, newline='')
+  with input_file:
+    num_notes = tabular.write_table_to_package(
+      tabular.iter_records(input_file, input_format), output, model, args.deck, field_columns, deck_id=args.deck_id,
+      deck_column=args.deck_column, tags_column=args.tags_column, guid_column=args.guid_column, workers=args.workers,
+      html_validation=args.html_validation, compression=compression)
+  print('Wrote {} notes to {}'.format(num_notes, args.output), file=sys.stderr)
+  return 0
+
+
+def _field_columns(model, mappings):
+  """
+  Returns the input column for each field of `model`, given FIELD=COLUMN mappings. Unmapped fields are read from the
+  column with the field's name.
+  """
+  field_names = [field['name'] for field in model.fields]
+  columns = dict(zip(field_names, field_names))
+  for mapping in mappings:
+    field_name, sep, column = mapping.partition('=')
+    if not sep or field_name not in columns:
+      raise SystemExit('--field {!r}: expected FIELD=COLUMN, where FIELD is one of {}'.format(
+        mapping, ', '.join(field_names)))
+    columns[field_name] = column
+  return [columns[field_name] for field_name in field_names]
+
+
+def _diff(args):
+  from .diff import diff_packages
+
+  package_diff = diff_packages(args.old, args.new)
+  if args.json:
+    json.dump(package_diff.to_json(), sys.stdout, indent=2, ensure_ascii=False)
+    sys.stdout.write('\n')
+  else:
+    for kind in ('notes', 'media', 'models'):
+      change_set = getattr(package_diff, kind)
+      for marker, keys in (('+', change_set.added), ('-', change_set.removed), ('~', change_set.modified)):
+        for key in keys:
+          print('{} {} {}'.format(marker, kind, key))
+    if args.stat:
+      for kind in ('notes', 'media', 'models'):
+        change_set = getattr(package_diff, kind)
+        print('{}: {} added, {} removed, {} modified'.format(
+          kind, len(change_set.added), len(change_set.removed), len(change_set.modified)), file=sys.stderr)
+  return 1 if package_diff else 0
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog='python -m genanki')
+  subparsers = parser.add_subparsers(dest='command', required=True)
+
+  build_parser = subparsers.add_parser('build', help='build a .apkg from a CSV, TSV or JSON Lines file')
+  build_parser.add_argument('input', help='the input file, or - for stdin')
+  build_parser.add_argument('-o', '--output', required=True, help='the .apkg to write, or - for stdout')
+  build_parser.add_argument('--model', required=True,
+                            help='a builtin model (e.g. BASIC_MODEL, CLOZE_MODEL) or a YAML file describing one')
+  build_parser.add_argument('--deck', required=True, help='name of the deck to put the notes in')
+  build_parser.add_argument('--deck-id', type=int, help='id of the deck (default: derived from its name)')
+  build_parser.add_argument('--format', choices=['csv', 'tsv', 'jsonl'],
+                            help='input format (default: guessed from the file extension)')
+  build_parser.add_argument('--encoding', default='utf-8', help='input encoding (default: %(default)s)')
+  build_parser.add_argument('--field', action='append', default=[], metavar='FIELD=COLUMN',
+                            help='read the model field FIELD from COLUMN (default: the column named FIELD); repeatable')
+  build_parser.add_argument('--deck-column', help='column naming a subdeck of --deck for each note')
+  build_parser.add_argument('--tags-column', help='column holding space-separated tags')
+  build_parser.add_argument('--guid-column', help='column holding note guids (default: computed from the fields)')
+  build_parser.add_argument('--workers', type=int, help='number of processes to prepare rows on')
+  build_parser.add_argument('--html-validation', choices=['full', 'sampled', 'off'], default='full',
+                            help='how thoroughly to check fields for invalid HTML tags (default: %(default)s)')
+  build_parser.add_argument('--compress', action='store_true', help='deflate the collection database')
+  build_parser.set_defaults(func=_build)
+
+  diff_parser = subparsers.add_parser('diff', help='show what changed between two .apkg files')
+  diff_parser.add_argument('old', help='the old .apkg')
+  diff_parser.add_argument('new', help='the new .apkg')
+  diff_parser.add_argument('--json', action='store_true', help='print the changes as JSON')
+  diff_parser.add_argument('--stat', action='store_true', help='also print a count of changes to stderr')
+  diff_parser.set_defaults(func=_diff)
+
+  args = parser.parse_args(argv)
+  return args.func(args)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -1,4 +1,4 @@
-APKG_SCHEMA = '''
+APKG_TABLES = '''
 CREATE TABLE col (
     id              integer primary key,
     crt             integer not null,
@@ -63,6 +63,11 @@ CREATE TABLE graves (
     oid             integer not null,
     type            integer not null
 );
+'''
+
+# Created after the notes and cards have been inserted when building a collection (see Package.write_to_db): building
+# each index once from the finished table is faster than updating it on every insert.
+APKG_INDEXES = '''
 CREATE INDEX ix_notes_usn on notes (usn);
 CREATE INDEX ix_cards_usn on cards (usn);
 CREATE INDEX ix_revlog_usn on revlog (usn);
@@ -71,3 +76,17 @@ CREATE INDEX ix_cards_sched on cards (did, queue, due);
 CREATE INDEX ix_revlog_cid on revlog (cid);
 CREATE INDEX ix_notes_csum on notes (csum);
 '''
+
+APKG_SCHEMA = APKG_TABLES + APKG_INDEXES
+
+# Settings for a connection that builds a new collection which is then zipped up and thrown away: no rollback journal
+# and no fsyncs, since a failed build deletes the file anyway, plus a 64 MiB page cache and in-memory temporary storage
+# for sorting while creating the indexes. Must be run before APKG_TABLES, because page_size has no effect once the
+# database has tables.
+APKG_BUILD_PRAGMAS = '''
+PRAGMA page_size = 8192;
+PRAGMA journal_mode = OFF;
+PRAGMA synchronous = OFF;
+PRAGMA cache_size = -65536;
+PRAGMA temp_store = MEMORY;
+'''
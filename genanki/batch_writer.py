@@ -0,0 +1,121 @@
+import time
+
+from .card import Card
+from .note import Note
+from .tags import TagRegistry
+
+
+class BatchWriter:
+  """
+  Collects note and card rows and inserts them into the collection with executemany(), in chunks.
+
+  This is much faster than Note.write_to_db / Card.write_to_db, which run one INSERT per row. Call flush() after the
+  last note has been added.
+  """
+  DEFAULT_CHUNK_SIZE = 1000
+
+  # How thoroughly fields are checked for invalid HTML tags (see Note._check_invalid_html_tags_in_fields):
+  HTML_VALIDATION_FULL = 'full'  # check every note
+  HTML_VALIDATION_SAMPLED = 'sampled'  # check one note in every HTML_VALIDATION_SAMPLE_INTERVAL
+  HTML_VALIDATION_OFF = 'off'  # don't check; for trusted pipelines
+  HTML_VALIDATION_SAMPLE_INTERVAL = 100
+
+  def __init__(self, cursor, chunk_size: int = DEFAULT_CHUNK_SIZE, html_validation: str = HTML_VALIDATION_FULL):
+    if html_validation not in (self.HTML_VALIDATION_FULL, self.HTML_VALIDATION_SAMPLED, self.HTML_VALIDATION_OFF):
+      raise ValueError('html_validation must be "full", "sampled" or "off", not {!r}.'.format(html_validation))
+
+    self.cursor = cursor
+    self.chunk_size = chunk_size
+    self.html_validation = html_validation
+    self._note_rows = []
+    self._card_rows = []
+    self._num_notes = 0
+    self.num_cards = 0
+    # the tags of the notes added, for col.tags (see write_col_tags)
+    self.tags = TagRegistry()
+    # Set time_cards to add up the time spent in Note.cards in card_seconds (used for tracing).
+    self.time_cards = False
+    self.card_seconds = 0.0
+
+  def _should_check_html(self):
+    if self.html_validation == self.HTML_VALIDATION_FULL:
+      return True
+    if self.html_validation == self.HTML_VALIDATION_OFF:
+      return False
+    return self._num_notes % self.HTML_VALIDATION_SAMPLE_INTERVAL == 0
+
+  def add_note(self, note, timestamp: float, deck_id, id_gen):
+    self.prepare_note(note)
+    self.add_prepared_note(note, timestamp, deck_id, id_gen)
+
+  def prepare_note(self, note):
+    """
+    Fixes up and validates `note` (see Note._prepare_for_write), following this writer's html_validation setting.
+    """
+    note._prepare_for_write(check_html=self._should_check_html())
+    self._num_notes += 1
+
+  def add_prepared_note(self, note, timestamp: float, deck_id, id_gen):
+    """
+    Like add_note, for a note that has already been passed to prepare_note. Returns the new note's id.
+    """
+    if self.time_cards:
+      start = time.perf_counter()
+      cards = note.cards
+      self.card_seconds += time.perf_counter() - start
+    else:
+      cards = note.cards
+
+    note_id = next(id_gen)
+    self._note_rows.append(note._to_row(timestamp, note_id, self.tags))
+    for card in cards:
+      self._card_rows.append(card._to_row(timestamp, deck_id, note_id, next(id_gen), note.due))
+    self.num_cards += len(cards)
+
+    if len(self._note_rows) >= self.chunk_size or len(self._card_rows) >= self.chunk_size:
+      self.flush()
+    return note_id
+
+  def add_rows(self, model_id, rows, timestamp: float, deck_id, id_gen):
+    """
+    Adds notes of the model with id `model_id` that are already in the form they are stored in, as yielded by
+    NoteColumns.rows(): (guid, flds, sort_field, tags, due, card_ords) tuples. No Note or Card objects are created.
+
+    :return: The number of notes added.
+    """
+    mod = int(timestamp)
+    note_rows = self._note_rows
+    card_rows = self._card_rows
+    chunk_size = self.chunk_size
+    num_notes = 0
+    add_tags = self.tags.add_formatted
+    for guid, flds, sort_field, tags, due, card_ords in rows:
+      add_tags(tags)
+      note_id = next(id_gen)
+      note_rows.append((note_id, guid, model_id, mod, -1, tags, flds, sort_field, 0, 0, ''))
+      for card_ord in card_ords:
+        # as Card._to_row, for a card that isn't suspended
+        card_rows.append((next(id_gen), note_id, deck_id, card_ord, mod, -1, 0, 0, due, 0, 0, 0, 0, 0, 0, 0, 0, ''))
+      self.num_cards += len(card_ords)
+      num_notes += 1
+      if len(note_rows) >= chunk_size or len(card_rows) >= chunk_size:
+        self.flush()
+        note_rows = self._note_rows
+        card_rows = self._card_rows
+    # these rows count towards sampled HTML validation, so that it checks the same Notes however they're interleaved
+    self._num_notes += num_notes
+    return num_notes
+
+  def flush(self):
+    if self._note_rows:
+      self.cursor.executemany(Note._INSERT_SQL, self._note_rows)
+      self._note_rows = []
+    if self._card_rows:
+      self.cursor.executemany(Card._INSERT_SQL, self._card_rows)
+      self._card_rows = []
+
+  def write_col_tags(self):
+    """
+    Lists the tags of every note added so far in col.tags.
+    """
+    self.tags.write_col_tags(self.cursor)
@@ -0,0 +1,181 @@
+"""
+Incremental builds: Package.write_to_file(..., cache_dir=...) keeps the last built collection database in `cache_dir`,
+along with a fingerprint of each note, and on the next build only writes the notes whose fingerprint changed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import uuid
+
+from .apkg_col import APKG_COL
+from .apkg_schema import APKG_SCHEMA
+from .note import Note
+from .package_updater import CollectionUpdater
+
+# Bump this if the collection layout or the fingerprint format changes; older caches are then discarded.
+_CACHE_VERSION = 3
+
+
+class BuildCache:
+  """
+  The cached collection and note fingerprints for one set of decks, stored under `cache_dir`/build/.
+
+  Each build works on a copy of the cached database; the cache is only replaced once the build succeeds. Every cached
+  database gets a new name, which the fingerprint file records, so replacing the fingerprint file switches to the new
+  database and fingerprints at once.
+  """
+  def __init__(self, cache_dir, decks):
+    # Different packages can share a cache_dir; they're told apart by their deck ids.
+    key = hashlib.sha256(json.dumps(sorted(deck.deck_id for deck in decks)).encode('utf-8')).hexdigest()[:16]
+    self.dir = os.path.join(cache_dir, 'build', key)
+    self.fingerprints_path = os.path.join(self.dir, 'fingerprints.json')
+
+  def _load(self):
+    """
+    Returns (path of the cached collection, its guid -> fingerprint dict), or None if there is no usable cache.
+    """
+    try:
+      with open(self.fingerprints_path) as h:
+        data = json.load(h)
+    except (OSError, ValueError):
+      return None
+    if not isinstance(data, dict) or data.get('version') != _CACHE_VERSION:
+      return None
+    db_name = data.get('db')
+    if not isinstance(db_name, str) or os.path.basename(db_name) != db_name:
+      return None
+    db_path = os.path.join(self.dir, db_name)
+    if not os.path.exists(db_path):
+      return None
+    return db_path, data['notes']
+
+  def load_fingerprints(self):
+    """
+    Returns the guid -> fingerprint dict of the cached collection, or None if there is no usable cache.
+    """
+    cached = self._load()
+    return None if cached is None else cached[1]
+
+  def build(self, decks, timestamp: float, html_validation, progress=None):
+    """
+    Updates a copy of the cached collection to contain exactly the notes of `decks`.
+
+    :param progress: Optional ProgressReporter, told about every note checked.
+    :return: Path of the updated database. Pass it to commit() once it has been written out, or remove it.
+    """
+    os.makedirs(self.dir, exist_ok=True)
+    cached = self._load()
+
+    dbfile, dbfilename = tempfile.mkstemp(dir=self.dir, suffix='.tmp')
+    os.close(dbfile)
+    try:
+      if cached is not None:
+        try:
+          shutil.copyfile(cached[0], dbfilename)
+        except FileNotFoundError:
+          # removed by a build sharing this cache_dir since it was loaded
+          cached = None
+
+      if cached is None:
+        old_fingerprints = {}
+        conn = sqlite3.connect(dbfilename)
+        conn.executescript(APKG_SCHEMA)
+      else:
+        old_fingerprints = cached[1]
+        conn = sqlite3.connect(dbfilename)
+
+      try:
+        cursor = conn.cursor()
+        # start from fresh deck/model JSON, so that decks and models which are no longer used don't linger
+        cursor.execute('DELETE FROM col')
+        cursor.executescript(APKG_COL)
+        self.fingerprints = self._update_collection(
+          CollectionUpdater(cursor, timestamp, html_validation), decks, old_fingerprints, progress)
+        conn.commit()
+      finally:
+        conn.close()
+    except BaseException:
+      os.remove(dbfilename)
+      raise
+    return dbfilename
+
+  @staticmethod
+  def _update_collection(updater, decks, old_fingerprints, progress=None):
+    model_fingerprints = {}
+    fingerprints = {}
+    if progress is not None:
+      progress.notes_total = sum(deck._num_notes() for deck in decks)
+    for deck in decks:
+      updater.add_deck(deck)
+      # notes added with add_notes_from_columns become Notes here, since they're fingerprinted and upserted one by one
+      for note in deck._all_notes():
+        model = note.model
+        model_fingerprint = model_fingerprints.get(id(model))
+        if model_fingerprint is None:
+          model_fingerprint = model_fingerprints[id(model)] = _model_fingerprint(model)
+
+        fingerprint = _note_fingerprint(note, model_fingerprint, deck.deck_id)
+        guid = note.guid
+        fingerprints[guid] = fingerprint
+        if old_fingerprints.get(guid) != fingerprint or guid not in updater:
+          updater.upsert_note(deck, note)
+        if progress is not None:
+          progress.add_notes(1)
+
+    for guid in list(updater.guids()):
+      if guid not in fingerprints:
+        updater.delete_note(guid)
+
+    updater.finish()
+    return fingerprints
+
+  def commit(self, dbfilename):
+    """
+    Makes `dbfilename`, as returned by build(), the new cached collection.
+    """
+    db_name = 'collection-{}.anki2'.format(uuid.uuid4().hex)
+    os.replace(dbfilename, os.path.join(self.dir, db_name))
+    fd, tmp_path = tempfile.mkstemp(dir=self.dir, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'w') as h:
+        json.dump({'version': _CACHE_VERSION, 'db': db_name, 'notes': self.fingerprints}, h)
+      # until this replace, the fingerprints still name the previous collection, which is still there
+      os.replace(tmp_path, self.fingerprints_path)
+    except BaseException:
+      os.remove(tmp_path)
+      os.remove(os.path.join(self.dir, db_name))
+      raise
+
+    # Remove the collections the fingerprints no longer name. If another build sharing this cache_dir commits at the
+    # same time, the collection its fingerprints name may be removed too; the next build then starts from scratch.
+    for name in os.listdir(self.dir):
+      if name != db_name and name.startswith('collection') and name.endswith('.anki2'):
+        try:
+          os.remove(os.path.join(self.dir, name))
+        except FileNotFoundError:
+          pass
+
+
+def _model_fingerprint(model):
+  return hashlib.sha256(json.dumps(
+    [model.model_id, model.model_type, model.sort_field_index, model.fields, model.templates],
+    sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _note_fingerprint(note, model_fingerprint, deck_id):
+  return hashlib.sha256(json.dumps(
+    [model_fingerprint, deck_id, note.fields, note._sort_field, list(note.tags), note.due, _suspended_card_ords(note)],
+    ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _suspended_card_ords(note):
+  """
+  Cards can be changed after they're generated (e.g. note.cards[1].suspend = True). Unless that has happened, or a
+  subclass overrides cards, they follow from the fields and model, so they aren't generated here just to be checked.
+  """
+  if type(note).cards is Note.cards and 'cards' not in note.__dict__:
+    return []
+  return sorted(card.ord for card in note.cards if card.suspend)
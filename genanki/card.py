@@ -1,12 +1,17 @@
 class Card:
+  _INSERT_SQL = 'INSERT INTO cards VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);'
+
   def __init__(self, ord, suspend=False):
     self.ord = ord
     self.suspend = suspend
 
   def write_to_db(self, cursor, timestamp: float, deck_id, note_id, id_gen, due=0):
+    cursor.execute(self._INSERT_SQL, self._to_row(timestamp, deck_id, note_id, next(id_gen), due))
+
+  def _to_row(self, timestamp: float, deck_id, note_id, card_id, due=0):
     queue = -1 if self.suspend else 0
-    cursor.execute('INSERT INTO cards VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);', (
-        next(id_gen),    # id
+    return (
+        card_id,         # id
         note_id,         # nid
         deck_id,         # did
         self.ord,        # ord
@@ -24,4 +29,4 @@ class Card:
         0,               # odid
         0,               # flags
         "",              # data
-    ))
+    )
@@ -0,0 +1,92 @@
+import os
+import zipfile
+
+
+class CompressionPolicy:
+  """
+  Decides which entries of a .apkg are deflated and which are stored as-is.
+
+  The collection database and text-like media (HTML, CSS, SVG, ...) compress well and are deflated at `level`. Media in
+  formats that are already compressed (JPEG, PNG, MP3, OGG, MP4, ...) are stored, because deflating them costs CPU for
+  no real gain. Files whose extension isn't recognized are identified by their first bytes.
+
+  Pass a policy as `compression=` to Package.write_to_file or PackageWriter.
+  """
+  STORED_EXTENSIONS = frozenset([
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.heic',
+    '.mp3', '.ogg', '.oga', '.opus', '.m4a', '.aac', '.flac', '.spx',
+    '.mp4', '.m4v', '.webm', '.mkv', '.mov', '.avi', '.mpg', '.mpeg',
+    '.zip', '.gz', '.bz2', '.xz', '.7z', '.woff', '.woff2',
+  ])
+  DEFLATED_EXTENSIONS = frozenset([
+    '.txt', '.html', '.htm', '.css', '.js', '.json', '.svg', '.xml', '.csv', '.tsv', '.md', '.tex', '.ttf', '.otf',
+    '.wav', '.bmp', '.tif', '.tiff',
+  ])
+
+  # prefixes of already-compressed formats, used when the extension doesn't tell us anything
+  _COMPRESSED_MAGIC = (
+    b'\xff\xd8\xff',      # JPEG
+    b'\x89PNG\r\n\x1a\n',  # PNG
+    b'GIF8',              # GIF
+    b'ID3',               # MP3 with ID3 tag
+    b'OggS',              # Ogg
+    b'fLaC',              # FLAC
+    b'\x1aE\xdf\xa3',      # Matroska / WebM
+    b'PK\x03\x04',         # zip
+    b'\x1f\x8b',           # gzip
+  )
+
+  def __init__(self, level: int = 6, overrides=None):
+    """
+    :param level: Deflate level, 1 (fastest) to 9 (smallest).
+    :param overrides: Dict mapping a media file path (or its basename) to zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED,
+        for files where the default choice is wrong.
+    """
+    self.level = level
+    self.overrides = dict(overrides or {})
+
+  def compress_type_for_collection(self):
+    return zipfile.ZIP_DEFLATED
+
+  def compress_type_for_media(self, path):
+    if path in self.overrides:
+      return self.overrides[path]
+    basename = os.path.basename(path)
+    if basename in self.overrides:
+      return self.overrides[basename]
+
+    ext = os.path.splitext(basename)[1].lower()
+    if ext in self.STORED_EXTENSIONS:
+      return zipfile.ZIP_STORED
+    if ext in self.DEFLATED_EXTENSIONS:
+      return zipfile.ZIP_DEFLATED
+
+    with open(path, 'rb') as h:
+      head = h.read(12)
+    if self._is_compressed_format(head):
+      return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+  @classmethod
+  def _is_compressed_format(cls, head):
+    if head.startswith(cls._COMPRESSED_MAGIC):
+      return True
+    if len(head) >= 2 and head[0] == 0xff and head[1] & 0xe0 == 0xe0:
+      return True  # MPEG audio frame sync (MP3 without ID3 tag)
+    if head[4:8] == b'ftyp':
+      return True  # MP4 / M4A / MOV
+    if head[:4] == b'RIFF' and head[8:12] in (b'WEBP', b'AVI '):
+      return True
+    return False
+
+
+class _NoCompression(CompressionPolicy):
+  def compress_type_for_collection(self):
+    return zipfile.ZIP_STORED
+
+  def compress_type_for_media(self, path):
+    return zipfile.ZIP_STORED
+
+
+# Stores every entry uncompressed. This is what genanki has always done, so it is the default.
+NO_COMPRESSION = _NoCompression()
@@ -0,0 +1,111 @@
+"""
+Compares two .apkg files: which notes (by guid), media files (by name) and models (by id) were added, removed or
+modified.
+
+Notes are compared inside SQLite: the new collection is ATTACHed to the old one and the notes tables are joined on
+guid, so no Python objects are created for unchanged notes. Media files are compared by the size and CRC-32 recorded in
+the zip, without decompressing them.
+"""
+from .package_reader import PackageReader
+
+
+class ChangeSet:
+  """
+  The keys (guids, media file names or model ids) that were added, removed or modified, each as a sorted list.
+  """
+  def __init__(self, added=(), removed=(), modified=()):
+    self.added = sorted(added)
+    self.removed = sorted(removed)
+    self.modified = sorted(modified)
+
+  def __bool__(self):
+    return bool(self.added or self.removed or self.modified)
+
+  def __eq__(self, other):
+    return isinstance(other, ChangeSet) and self.to_json() == other.to_json()
+
+  def to_json(self):
+    return {'added': self.added, 'removed': self.removed, 'modified': self.modified}
+
+  def __repr__(self):
+    return 'ChangeSet(added={!r}, removed={!r}, modified={!r})'.format(self.added, self.removed, self.modified)
+
+
+class PackageDiff:
+  """
+  The differences between two packages: `notes`, `media` and `models`, each a ChangeSet.
+
+  A note is modified if its fields, tags or model changed. A model is modified if anything in its JSON other than its
+  modification time and default deck changed.
+  """
+  def __init__(self, notes, media, models):
+    self.notes = notes
+    self.media = media
+    self.models = models
+
+  def __bool__(self):
+    return bool(self.notes or self.media or self.models)
+
+  def to_json(self):
+    return {'notes': self.notes.to_json(), 'media': self.media.to_json(), 'models': self.models.to_json()}
+
+  def __repr__(self):
+    return 'PackageDiff(notes={!r}, media={!r}, models={!r})'.format(self.notes, self.media, self.models)
+
+
+def diff_packages(old, new):
+  """
+  :param old: Path (or seekable file object) of the old .apkg.
+  :param new: Path (or seekable file object) of the new .apkg.
+  :return: PackageDiff
+  """
+  with PackageReader(old) as old_reader, PackageReader(new) as new_reader:
+    return PackageDiff(
+      notes=_diff_notes(old_reader, new_reader),
+      media=_diff_media(old_reader, new_reader),
+      models=_diff_models(old_reader, new_reader),
+    )
+
+
+_ADDED_NOTES_SQL = '''
+SELECT DISTINCT guid FROM {new}.notes WHERE guid NOT IN (SELECT guid FROM {old}.notes)
+'''
+_MODIFIED_NOTES_SQL = '''
+SELECT DISTINCT new_notes.guid
+FROM new.notes AS new_notes JOIN main.notes AS old_notes ON old_notes.guid = new_notes.guid
+WHERE old_notes.mid != new_notes.mid OR old_notes.tags != new_notes.tags OR old_notes.flds != new_notes.flds
+'''
+
+
+def _diff_notes(old_reader, new_reader):
+  # both collections are temporary copies, so it's fine to add indexes to them
+  cursor = old_reader._conn.cursor()
+  cursor.execute('ATTACH DATABASE ? AS new', (new_reader._dbfilename,))
+  try:
+    for schema in ('main', 'new'):
+      cursor.execute('CREATE INDEX IF NOT EXISTS {}.ix_notes_guid ON notes (guid)'.format(schema))
+    added = [guid for guid, in cursor.execute(_ADDED_NOTES_SQL.format(new='new', old='main'))]
+    removed = [guid for guid, in cursor.execute(_ADDED_NOTES_SQL.format(new='main', old='new'))]
+    modified = [guid for guid, in cursor.execute(_MODIFIED_NOTES_SQL)]
+    old_reader._conn.commit()
+  finally:
+    cursor.execute('DETACH DATABASE new')
+  return ChangeSet(added, removed, modified)
+
+
+def _diff_media(old_reader, new_reader):
+  old_media = set(old_reader.media)
+  new_media = set(new_reader.media)
+  modified = [
+    name for name in old_media & new_media
+    if old_reader._media_fingerprint(name) != new_reader._media_fingerprint(name)]
+  return ChangeSet(new_media - old_media, old_media - new_media, modified)
+
+
+def _diff_models(old_reader, new_reader):
+  old_models = set(old_reader.models)
+  new_models = set(new_reader.models)
+  modified = [
+    model_id for model_id in old_models & new_models
+    if old_reader.models[model_id].to_json(0, None) != new_reader.models[model_id].to_json(0, None)]
+  return ChangeSet(new_models - old_models, old_models - new_models, modified)
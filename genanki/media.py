@@ -0,0 +1,50 @@
+import concurrent.futures
+import hashlib
+import os
+
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+def _hash_file(path):
+  m = hashlib.sha256()
+  with open(path, 'rb') as h:
+    for chunk in iter(lambda: h.read(_HASH_CHUNK_SIZE), b''):
+      m.update(chunk)
+  return m.digest()
+
+
+def dedupe_media_files(media_files, max_workers=None):
+  """
+  Returns `media_files` with duplicate files removed, so that each one is stored in the .apkg only once.
+
+  Anki's media manifest is keyed by basename, so two paths are duplicates when they have the same basename and the same
+  contents (e.g. the same image reached via different directories or a symlink). Only paths whose basenames collide
+  are hashed; they are hashed in chunks, on a thread pool.
+
+  :raises ValueError: if two files have the same basename but different contents, since one would silently replace the
+      other when the package is imported.
+  """
+  paths_by_basename = {}
+  for path in media_files:
+    paths_by_basename.setdefault(os.path.basename(path), []).append(path)
+
+  to_hash = set()
+  for paths in paths_by_basename.values():
+    if len(paths) > 1 and len({os.path.realpath(path) for path in paths}) > 1:
+      to_hash.update(paths)
+
+  digests = {}
+  if to_hash:
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+      digests = dict(zip(to_hash, executor.map(_hash_file, to_hash)))
+
+  rv = []
+  for basename, paths in paths_by_basename.items():
+    first = paths[0]
+    for path in paths[1:]:
+      if path in digests and digests[path] != digests[first]:
+        raise ValueError(
+          'Media files {!r} and {!r} have the same name {!r} but different contents; only one of them can be stored in'
+          ' the package.'.format(first, path, basename))
+    rv.append(first)
+  return rv
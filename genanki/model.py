@@ -1,7 +1,6 @@
-from copy import copy
-from cached_property import cached_property
-import chevron
-import yaml
+from copy import copy, deepcopy
+from functools import cached_property
+import re
 
 class Model:
 
@@ -24,16 +23,56 @@ class Model:
     self.latex_post = latex_post
     self.sort_field_index = sort_field_index
 
+  # cached_property attributes -> the attributes they are derived from. Assigning to one of those attributes clears the
+  # cached value. Changes made to .fields or .templates in place are caught by to_json (see _check_cache_source).
+  _CACHED_PROPERTIES = {
+    '_req': ('fields', 'templates'),
+    '_cloze_field_indexes': ('fields', 'templates'),
+    '_static_json': (
+      'model_id', 'name', 'fields', 'templates', 'css', 'model_type', 'latex_pre', 'latex_post', 'sort_field_index'),
+  }
+
+  # keys added to each field/template dict in the JSON, unless the dict already has them
+  _FIELD_JSON_DEFAULTS = (
+    ('font', 'Liberation Sans'),
+    ('media', []),
+    ('rtl', False),
+    ('size', 20),
+    ('sticky', False),
+  )
+  _TEMPLATE_JSON_DEFAULTS = (
+    ('bafmt', ''),
+    ('bqfmt', ''),
+    ('bfont', ''),
+    ('bsize', 0),
+    ('did', None),  # TODO None works just fine here, but should it be deck_id?
+  )
+
+  _CLOZE_REPLACEMENT_RES = (
+    re.compile(r"{{[^}]*?cloze:(?:[^}]?:)*(.+?)}}"),
+    re.compile("<%cloze:(.+?)%>"),
+  )
+
+  def __setattr__(self, name, value):
+    super().__setattr__(name, value)
+    if name in ('fields', 'templates'):
+      self.__dict__.pop('_cache_source', None)
+    for prop, dependencies in self._CACHED_PROPERTIES.items():
+      if name in dependencies:
+        self.__dict__.pop(prop, None)
+
   def set_fields(self, fields):
     if isinstance(fields, list):
       self.fields = fields
     elif isinstance(fields, str):
+      import yaml  # imported here because it's slow to import and only needed for YAML strings
       self.fields = yaml.full_load(fields)
 
   def set_templates(self, templates):
     if isinstance(templates, list):
       self.templates = templates
     elif isinstance(templates, str):
+      import yaml
       self.templates = yaml.full_load(templates)
 
   @cached_property
@@ -41,89 +80,100 @@ class Model:
     """
     List of required fields for each template. Format is [tmpl_idx, "all"|"any", [req_field_1, req_field_2, ...]].
 
-    Partial reimplementation of req computing logic from Anki. We use chevron instead of Anki's custom mustache
-    implementation.
-
-    The goal is to figure out which fields are "required", i.e. if they are missing then the front side of the note
-    doesn't contain any meaningful content.
+    Partial reimplementation of req computing logic from Anki. The goal is to figure out which fields are "required",
+    i.e. if they are missing then the front side of the note doesn't contain any meaningful content. See
+    required_fields.py for how this is computed and cached.
     """
-    sentinel = 'SeNtInEl'
-    field_names = [field['name'] for field in self.fields]
-
-    req = []
-    for template_ord, template in enumerate(self.templates):
-      required_fields = []
-      for field_ord, field in enumerate(field_names):
-        field_values = {field: sentinel for field in field_names}
-        field_values[field] = ''
-
-        rendered = chevron.render(template['qfmt'], field_values)
-
-        if sentinel not in rendered:
-          # when this field is missing, there is no meaningful content (no field values) in the question, so this field
-          # is required
-          required_fields.append(field_ord)
-
-      if required_fields:
-        req.append([template_ord, 'all', required_fields])
-        continue
+    from .required_fields import compute_req_cached  # imports chevron, which most imports of genanki don't need
 
-      # there are no required fields, so an "all" is not appropriate, switch to checking for "any"
-      for field_ord, field in enumerate(field_names):
-        field_values = {field: '' for field in field_names}
-        field_values[field] = sentinel
+    self._record_cache_source()
+    return compute_req_cached([field['name'] for field in self.fields], self.templates)
 
-        rendered = chevron.render(template['qfmt'], field_values)
-
-        if sentinel in rendered:
-          # when this field is present, there is meaningful content in the question
-          required_fields.append(field_ord)
+  @cached_property
+  def _cloze_field_indexes(self):
+    """
+    Indexes of the fields that are cloze-replaced in the first template's qfmt, e.g. "{{cloze::Text}}".
 
-      if not required_fields:
-        raise Exception(
-          'Could not compute required fields for this template; please check the formatting of "qfmt": {}'.format(
-            template))
+    Cached so that notes don't re-parse the template; it is recomputed when .fields or .templates is reassigned.
+    """
+    self._record_cache_source()
+    qfmt = self.templates[0]['qfmt']
+    field_names = set()
+    for regex in self._CLOZE_REPLACEMENT_RES:
+      field_names.update(regex.findall(qfmt))
+
+    field_indexes = []
+    for field_index, field in enumerate(self.fields):
+      if field['name'] in field_names:
+        field_indexes.append(field_index)
+        field_names.discard(field['name'])
+    return field_indexes
 
-      req.append([template_ord, 'any', required_fields])
+  def to_json(self, timestamp: float, deck_id):
+    """
+    Returns the JSON for this model in the collection's "models" table. Doesn't modify the model or its fields and
+    templates, and the caller may modify the returned dict.
+    """
+    self._check_cache_source()
+    rv = deepcopy(self._static_json)
+    rv['did'] = deck_id
+    rv['mod'] = int(timestamp)
+    return rv
 
-    return req
+  def _record_cache_source(self):
+    """
+    Keeps a copy of .fields and .templates, for _check_cache_source, when the first value derived from them is cached.
+    """
+    if '_cache_source' not in self.__dict__:
+      self.__dict__['_cache_source'] = deepcopy((self.fields, self.templates))
 
-  def to_json(self, timestamp: float, deck_id):
-    for ord_, tmpl in enumerate(self.templates):
-      tmpl['ord'] = ord_
-      tmpl.setdefault('bafmt', '')
-      tmpl.setdefault('bqfmt', '')
-      tmpl.setdefault('bfont', '')
-      tmpl.setdefault('bsize', 0)
-      tmpl.setdefault('did', None)  # TODO None works just fine here, but should it be deck_id?
-
-    for ord_, field in enumerate(self.fields):
-      field['ord'] = ord_
-      field.setdefault('font', 'Liberation Sans')
-      field.setdefault('media', [])
-      field.setdefault('rtl', False)
-      field.setdefault('size', 20)
-      field.setdefault('sticky', False)
+  def _check_cache_source(self):
+    """
+    Clears the values cached from .fields and .templates if they have been changed in place (e.g.
+    `model.fields.append(...)` or `model.templates[0]['qfmt'] = ...`) since the first of them was computed. Comparing
+    them with the copy kept in _cache_source is cheap next to rebuilding the JSON.
+    """
+    if '_cache_source' in self.__dict__ and self.__dict__['_cache_source'] != (self.fields, self.templates):
+      del self.__dict__['_cache_source']
+      for prop, dependencies in self._CACHED_PROPERTIES.items():
+        if 'fields' in dependencies:
+          self.__dict__.pop(prop, None)
 
+  @cached_property
+  def _static_json(self):
+    """
+    The parts of to_json that don't depend on its arguments, built once from copies of the fields and templates.
+    """
+    self._record_cache_source()
     return {
       "css": self.css,
-      "did": deck_id,
-      "flds": self.fields,
+      "did": None,  # set by to_json
+      "flds": [self._with_json_defaults(field, ord_, self._FIELD_JSON_DEFAULTS)
+               for ord_, field in enumerate(self.fields)],
       "id": str(self.model_id),
       "latexPost": self.latex_post,
       "latexPre": self.latex_pre,
       "latexsvg": False,
-      "mod": int(timestamp),
+      "mod": 0,  # set by to_json
       "name": self.name,
       "req": self._req,
       "sortf": self.sort_field_index,
       "tags": [],
-      "tmpls": self.templates,
+      "tmpls": [self._with_json_defaults(template, ord_, self._TEMPLATE_JSON_DEFAULTS)
+                for ord_, template in enumerate(self.templates)],
       "type": self.model_type,
       "usn": -1,
       "vers": []
     }
 
+  @staticmethod
+  def _with_json_defaults(item, ord_, defaults):
+    rv = dict(item)
+    rv['ord'] = ord_
+    for key, value in defaults:
+      rv.setdefault(key, copy(value))
+    return rv
+
   def __repr__(self):
     attrs = ['model_id', 'name', 'fields', 'templates', 'css', 'model_type']
     pieces = ['{}={}'.format(attr, repr(getattr(self, attr))) for attr in attrs]
@@ -1,17 +1,18 @@
 import re
 import warnings
-from cached_property import cached_property
+from functools import cached_property
 
-from .builtin_models import _fix_deprecated_builtin_models_and_warn
 from .card import Card
+from .tags import _NOTE_TAGS, validate_tag
 from .util import guid_for
 
 
 class _TagList(list):
-  @staticmethod
-  def _validate_tag(tag):
-    if ' ' in tag:
-      raise ValueError('Tag "{}" contains a space; this is not allowed!'.format(tag))
+  """
+  A list of tags that validates the tags added to it. Tags are interned in a registry shared by all notes, so each
+  distinct tag is only validated once, and notes with the same tags share the tag strings.
+  """
+  _validate_tag = staticmethod(validate_tag)
 
   def __init__(self, tags=()):
     super().__init__()
@@ -23,32 +24,34 @@ class _TagList(list):
   def __setitem__(self, key, val):
     if isinstance(key, slice):
       # val may be an iterator, convert to a list so we can iterate multiple times
-      val = list(val)
-      for tag in val:
-        self._validate_tag(tag)
+      val = [_NOTE_TAGS.intern(tag) for tag in val]
     else:
-      self._validate_tag(val)
+      val = _NOTE_TAGS.intern(val)
 
     super().__setitem__(key, val)
 
   def append(self, tag):
-    self._validate_tag(tag)
-    super().append(tag)
+    super().append(_NOTE_TAGS.intern(tag))
 
   def extend(self, tags):
-    # tags may be an iterator, convert to list so we can iterate multiple times
-    tags = list(tags)
-    for tag in tags:
-      self._validate_tag(tag)
-    super().extend(tags)
+    # looks up tags that have been seen before directly, without a method call
+    seen = _NOTE_TAGS._tags.get
+    intern = _NOTE_TAGS.intern
+    super().extend([seen(tag) or intern(tag) for tag in tags])
 
   def insert(self, i, tag):
-    self._validate_tag(tag)
-    super().insert(i, tag)
+    super().insert(i, _NOTE_TAGS.intern(tag))
 
 
 class Note:
+  # Matches invalid HTML tags. This is the specification of _find_invalid_html_tags_in_field, which implements it in
+  # linear time; running the regex itself backtracks quadratically on fields with many stray '<'s.
   _INVALID_HTML_TAG_RE = re.compile(r'<(?!/?[a-zA-Z0-9]+(?: .*|/?)>|!--|!\[CDATA\[)(?:.|\n)*?>')
+  _HTML_TAG_NAME_RE = re.compile(r'/?[a-zA-Z0-9]+')
+  # A run of text and valid tags. Attributes may not contain '<', so a failed attempt never scans past the next '<'.
+  _HTML_VALID_RUN_RE = re.compile(r'(?:[^<]+|<(?:/?[a-zA-Z0-9]+(?:/?>| [^\n<>]*>)|!--|!\[CDATA\[))*')
+  _INSERT_SQL = 'INSERT INTO notes VALUES(?,?,?,?,?,?,?,?,?,?,?);'
+  _CLOZE_DELETION_RE = re.compile(r'{{c(\d+)::.+?}}', re.DOTALL)
 
   def __init__(self, model=None, fields=None, sort_field=None, tags=None, guid=None, due=0):
     self.model = model
@@ -56,6 +59,7 @@ class Note:
     self.sort_field = sort_field
     self.tags = tags or []
     self.due = due
+    self._guid_memo = None  # (fields, guid) for the guid computed from the fields
     try:
       self.guid = guid
     except AttributeError:
@@ -92,18 +96,13 @@ class Note:
   def _cloze_cards(self):
     """Returns a Card with unique ord for each unique cloze reference."""
     card_ords = set()
-    # find cloze replacements in first template's qfmt, e.g "{{cloze::Text}}"
-    cloze_replacements = set(
-      re.findall(r"{{[^}]*?cloze:(?:[^}]?:)*(.+?)}}", self.model.templates[0]['qfmt']) +
-      re.findall("<%cloze:(.+?)%>", self.model.templates[0]['qfmt']))
-    for field_name in cloze_replacements:
-      field_index = next((i for i, f in enumerate(self.model.fields) if f['name'] == field_name), -1)
-      field_value = self.fields[field_index] if field_index >= 0 else ""
+    for field_index in self.model._cloze_field_indexes:
       # update card_ords with each cloze reference N, e.g. "{{cN::...}}"
-      card_ords.update(int(m)-1 for m in re.findall(r"{{c(\d+)::.+?}}", field_value, re.DOTALL) if int(m) > 0)
+      card_ords.update(int(m) - 1 for m in self._CLOZE_DELETION_RE.findall(self.fields[field_index]))
+    card_ords.discard(-1)  # "{{c0::...}}" doesn't make a card
     if not card_ords:
       card_ords = {0}
-    return([Card(ord) for ord in card_ords])
+    return [Card(ord) for ord in card_ords]
 
   def _front_back_cards(self):
     """Create Front/Back cards"""
@@ -117,7 +116,12 @@ class Note:
   @property
   def guid(self):
     if self._guid is None:
-      return guid_for(*self.fields)
+      # memoized until the fields change; tuple comparison is much cheaper than hashing the fields again
+      fields = tuple(self.fields)
+      memo = self._guid_memo
+      if memo is None or memo[0] != fields:
+        memo = self._guid_memo = (fields, guid_for(*fields))
+      return memo[1]
     return self._guid
 
   @guid.setter
@@ -133,42 +137,112 @@ class Note:
 
   @classmethod
   def _find_invalid_html_tags_in_field(cls, field):
-    return cls._INVALID_HTML_TAG_RE.findall(field)
+    """
+    Returns the same list as cls._INVALID_HTML_TAG_RE.findall(field), in time linear in len(field).
+    """
+    # Skip (in C) text and tags that are obviously valid; this stops at a '<' that needs a closer look. Most fields
+    # are entirely skipped.
+    skip_valid_run = cls._HTML_VALID_RUN_RE.match
+    field_len = len(field)
+    pos = skip_valid_run(field).end()
+    if pos == field_len:
+      return []
+
+    invalid_tags = []
+    find = field.find
+    match_tag_name = cls._HTML_TAG_NAME_RE.match
+    # Positions of the next '>' and '\n' found so far. They are only searched for again once the scan passes them,
+    # so each character is looked at a bounded number of times.
+    next_gt = next_nl = -1
+
+    while pos != field_len:
+      valid = False
+      m = match_tag_name(field, pos + 1)
+      if m:
+        end = m.end()
+        if field.startswith('>', end) or field.startswith('/>', end):
+          valid = True
+        elif field.startswith(' ', end):
+          # "<tag ...>": valid if there is a '>' before the end of the line
+          if next_gt < end:
+            next_gt = find('>', end)
+            if next_gt == -1:
+              next_gt = field_len
+          if next_nl < end:
+            next_nl = find('\n', end)
+            if next_nl == -1:
+              next_nl = field_len
+          valid = next_gt < next_nl
+      if not valid:
+        valid = field.startswith('!--', pos + 1) or field.startswith('![CDATA[', pos + 1)
+
+      if valid:
+        pos = skip_valid_run(field, pos + 1).end()
+        continue
+
+      # an invalid tag extends to the next '>'
+      if next_gt <= pos:
+        next_gt = find('>', pos + 1)
+        if next_gt == -1:
+          next_gt = field_len
+      if next_gt == field_len:
+        break
+      invalid_tags.append(field[pos:next_gt + 1])
+      pos = skip_valid_run(field, next_gt + 1).end()
+
+    return invalid_tags
 
   def _check_invalid_html_tags_in_fields(self):
     for idx, field in enumerate(self.fields):
       invalid_tags = self._find_invalid_html_tags_in_field(field)
       if invalid_tags:
-        # You can disable the below warning by calling warnings.filterwarnings:
-        #
-        # warnings.filterwarnings('ignore', module='genanki', message='^Field contained the following invalid HTML tags')
-        #
-        # If you think you're getting a false positive for this warning, please file an issue at
-        # https://github.com/kerrickstaley/genanki/issues
-        warnings.warn("Field contained the following invalid HTML tags. Make sure you are calling html.escape() if"
-                      " your field data isn't already HTML-encoded: {}".format(' '.join(invalid_tags)))
+        self._warn_invalid_html_tags(invalid_tags)
+
+  @staticmethod
+  def _warn_invalid_html_tags(invalid_tags):
+    # You can disable the below warning by calling warnings.filterwarnings:
+    #
+    # warnings.filterwarnings('ignore', module='genanki', message='^Field contained the following invalid HTML tags')
+    #
+    # If you think you're getting a false positive for this warning, please file an issue at
+    # https://github.com/kerrickstaley/genanki/issues
+    warnings.warn("Field contained the following invalid HTML tags. Make sure you are calling html.escape() if"
+                  " your field data isn't already HTML-encoded: {}".format(' '.join(invalid_tags)))
 
   def write_to_db(self, cursor, timestamp: float, deck_id, id_gen):
-    self.fields = _fix_deprecated_builtin_models_and_warn(self.model, self.fields)
+    self._prepare_for_write()
+    note_id = next(id_gen)
+    cursor.execute(self._INSERT_SQL, self._to_row(timestamp, note_id))
+
+    for card in self.cards:
+      card.write_to_db(cursor, timestamp, deck_id, note_id, id_gen, self.due)
+
+  def _prepare_for_write(self, check_html=True):
+    if self.model.model_type == self.model.CLOZE and len(self.fields) == 1:
+      # only then can this be the deprecated single-field use of CLOZE_MODEL; this avoids importing builtin_models
+      from .builtin_models import _fix_deprecated_builtin_models_and_warn
+      self.fields = _fix_deprecated_builtin_models_and_warn(self.model, self.fields)
     self._check_number_model_fields_matches_num_fields()
-    self._check_invalid_html_tags_in_fields()
-    cursor.execute('INSERT INTO notes VALUES(?,?,?,?,?,?,?,?,?,?,?);', (
-        next(id_gen),                 # id
+    if check_html:
+      self._check_invalid_html_tags_in_fields()
+
+  def _to_row(self, timestamp: float, note_id, tag_registry=None):
+    """
+    :param tag_registry: Optional TagRegistry to format the tags with (and collect them in).
+    """
+    return (
+        note_id,                      # id
         self.guid,                    # guid
         self.model.model_id,          # mid
         int(timestamp),               # mod
         -1,                           # usn
-        self._format_tags(),          # TODO tags
+        self._format_tags() if tag_registry is None else tag_registry.format(self.tags),  # tags
         self._format_fields(),        # flds
         self.sort_field,              # sfld
         0,                            # csum, can be ignored
         0,                            # flags
         '',                           # data
-    ))
-
-    note_id = cursor.lastrowid
-    for card in self.cards:
-      card.write_to_db(cursor, timestamp, deck_id, note_id, id_gen, self.due)
+    )
 
   def _format_fields(self):
     return '\x1f'.join(self.fields)
@@ -0,0 +1,171 @@
+"""
+Column-oriented storage for many notes of one model, added with Deck.add_notes_from_columns.
+
+Building a Note per row runs the tags setter, the sort_field and guid properties and Note.cards for every row. A
+NoteColumns instead checks and converts whole columns at once, and keeps only what is written to the collection: the
+joined fields, sort field, guid, formatted tags, due and card ords of each row. Package.write_to_file writes these rows
+directly, without creating Note objects.
+"""
+import array
+
+from .batch_writer import BatchWriter
+from .note import Note
+from .tags import TagRegistry
+from .util import guid_for_many
+
+# HTML validation checks this many fields of a column at a time
+_HTML_CHECK_CHUNK_SIZE = 1000
+
+
+class NoteColumns:
+  """
+  The notes added by one call to Deck.add_notes_from_columns. See there for the parameters.
+  """
+  def __init__(self, model, fields, tags=None, guids=None, due=None, sort_fields=None,
+               html_validation: str = BatchWriter.HTML_VALIDATION_FULL):
+    if html_validation not in (
+        BatchWriter.HTML_VALIDATION_FULL, BatchWriter.HTML_VALIDATION_SAMPLED, BatchWriter.HTML_VALIDATION_OFF):
+      raise ValueError('html_validation must be "full", "sampled" or "off", not {!r}.'.format(html_validation))
+
+    fields = [column if isinstance(column, (list, tuple)) else list(column) for column in fields]
+    if len(fields) != len(model.fields):
+      raise ValueError(
+        'Number of fields in Model does not match number of field columns: {} has {} fields, but {} columns were '
+        'given.'.format(model, len(model.fields), len(fields)))
+    num_notes = len(fields[0]) if fields else 0
+    for column in fields:
+      _check_length(column, num_notes, 'field column')
+
+    self.model = model
+    if html_validation == BatchWriter.HTML_VALIDATION_FULL:
+      for column in fields:
+        _check_invalid_html_tags_in_column(column)
+    elif html_validation == BatchWriter.HTML_VALIDATION_SAMPLED:
+      # the rows BatchWriter would check: one in every HTML_VALIDATION_SAMPLE_INTERVAL, starting with the first
+      for column in fields:
+        _check_invalid_html_tags_in_column(column[::BatchWriter.HTML_VALIDATION_SAMPLE_INTERVAL])
+
+    self.flds = ['\x1f'.join(row) for row in zip(*fields)]
+
+    default_sort_fields = fields[model.sort_field_index]
+    if sort_fields is None:
+      self.sort_fields = list(default_sort_fields)
+    else:
+      _check_length(sort_fields, num_notes, 'sort_fields')
+      self.sort_fields = [
+        sort_field or default for sort_field, default in zip(sort_fields, default_sort_fields)]
+
+    if guids is None:
+      self.guids = guid_for_many(zip(*fields))
+    else:
+      _check_length(guids, num_notes, 'guids')
+      self.guids = list(guids)
+
+    if tags is None:
+      self.tags = ['  '] * num_notes
+    else:
+      _check_length(tags, num_notes, 'tags')
+      self.tags = _format_tags_column(tags)
+
+    if due is None:
+      self.due = array.array('q', bytes(8 * num_notes))
+    else:
+      _check_length(due, num_notes, 'due')
+      self.due = array.array('q', due)
+
+    self.card_ords = _card_ords_column(model, fields, num_notes)
+
+  def __len__(self):
+    return len(self.flds)
+
+  def rows(self):
+    """
+    Yields (guid, flds, sort_field, tags, due, card_ords) for each note, with flds and tags formatted as they are
+    stored in the notes table.
+    """
+    return zip(self.guids, self.flds, self.sort_fields, self.tags, self.due, self.card_ords)
+
+  def to_notes(self):
+    """
+    Yields a Note for each row, for code paths that need Note objects (such as incremental builds with cache_dir).
+    """
+    for guid, flds, sort_field, tags, due, _ in self.rows():
+      yield Note(self.model, flds.split('\x1f'), sort_field, tags.split(), guid, due)
+
+  def __repr__(self):
+    return '{}(model={!r}, notes={})'.format(self.__class__.__name__, self.model, len(self))
+
+
+def _check_length(column, num_notes, what):
+  if len(column) != num_notes:
+    raise ValueError('Expected {} {} entries, got {}.'.format(num_notes, what, len(column)))
+
+
+def _check_invalid_html_tags_in_column(column):
+  """
+  Warns about invalid HTML tags in the fields of `column`, like Note._check_invalid_html_tags_in_fields.
+
+  Fields are joined with newlines and checked a chunk at a time. A tag can't span a newline, so a chunk that is one
+  valid run contains no invalid tags; only chunks that aren't are checked field by field.
+  """
+  match_valid_run = Note._HTML_VALID_RUN_RE.match
+  for start in range(0, len(column), _HTML_CHECK_CHUNK_SIZE):
+    chunk = column[start:start + _HTML_CHECK_CHUNK_SIZE]
+    joined = '\n'.join(chunk)
+    if match_valid_run(joined).end() == len(joined):
+      continue
+    for field in chunk:
+      invalid_tags = Note._find_invalid_html_tags_in_field(field)
+      if invalid_tags:
+        Note._warn_invalid_html_tags(invalid_tags)
+
+
+def _format_tags_column(tags):
+  """
+  Returns the tags of each row formatted as in the notes table (' tag1 tag2 '). Each distinct tag is validated once,
+  and rows with the same tags share one string.
+  """
+  registry = TagRegistry(collect=False)
+  return [registry.format(row_tags) for row_tags in tags]
+
+
+def _card_ords_column(model, fields, num_notes):
+  """
+  Returns the card ords of each row, as Note.cards would generate them. Rows with the same ords share one tuple.
+  """
+  if model.model_type == model.FRONT_BACK:
+    if not model._req:
+      return [()] * num_notes
+    # one column of booleans per template: does the row have the fields that template needs?
+    card_ords = []
+    has_fields_columns = []
+    for card_ord, any_or_all, required_field_ords in model._req:
+      op = {'any': any, 'all': all}[any_or_all]
+      card_ords.append(card_ord)
+      if required_field_ords:
+        has_fields_columns.append([op(row) for row in zip(*(fields[ord_] for ord_ in required_field_ords))])
+      else:
+        has_fields_columns.append([op(())] * num_notes)
+    ords_rows = (
+      tuple(card_ord for card_ord, has_fields in zip(card_ords, row) if has_fields)
+      for row in zip(*has_fields_columns))
+  elif model.model_type == model.CLOZE:
+    if not model._cloze_field_indexes:
+      return [(0,)] * num_notes
+    ords_rows = (_cloze_card_ords(row) for row in zip(*(fields[idx] for idx in model._cloze_field_indexes)))
+  else:
+    raise ValueError('Expected model_type CLOZE or FRONT_BACK')
+
+  interned = {}
+  return [interned.setdefault(ords, ords) for ords in ords_rows]
+
+
+def _cloze_card_ords(cloze_fields):
+  # the same ords, in the same order, as Note._cloze_cards
+  card_ords = set()
+  for field in cloze_fields:
+    card_ords.update(int(m) - 1 for m in Note._CLOZE_DELETION_RE.findall(field))
+  card_ords.discard(-1)
+  if not card_ords:
+    card_ords = {0}
+  return tuple(card_ords)
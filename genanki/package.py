@@ -1,3 +1,4 @@
+import io
 import itertools
 import json
 import os
@@ -7,8 +8,14 @@ import time
 import zipfile
 
 from .apkg_col import APKG_COL
-from .apkg_schema import APKG_SCHEMA
+from .apkg_schema import APKG_BUILD_PRAGMAS, APKG_INDEXES, APKG_TABLES
+from .batch_writer import BatchWriter
+from .compression import NO_COMPRESSION
 from .deck import Deck
+from .media import dedupe_media_files
+from .sharded_build import plan_shards, write_notes_sharded
+from .progress import ProgressReporter, _ByteCountingFile
+from .tracing import trace
 
 from typing import Optional
 
@@ -21,43 +28,256 @@ class Package:
 
     self.media_files = list(set(media_files or []))
 
-  def write_to_file(self, file, timestamp: Optional[float] = None):
+  @classmethod
+  def read(cls, file, media_dir=None):
     """
-    :param file: File path to write to.
+    Reads a .apkg file into a Package. Each note is put in the deck of its first card (notes without cards are
+    skipped), and decks without notes, such as Anki's "Default" deck, are left out. Use PackageReader to read large
+    packages note by note instead.
+
+    :param file: Path (or seekable file object) of the .apkg to read.
+    :param media_dir: If given, media files are extracted into this directory and listed in media_files.
+    """
+    from .package_reader import PackageReader
+
+    with PackageReader(file) as reader:
+      decks = reader.decks
+      for read_note in reader.iter_notes():
+        if read_note.deck_id in decks:
+          decks[read_note.deck_id].add_note(read_note.to_note())
+      media_files = [] if media_dir is None else reader.extract_media(media_dir)
+    return cls([deck for deck in decks.values() if deck.notes], media_files)
+
+  def write_to_file(self, file, timestamp: Optional[float] = None, in_memory: bool = False, compression=None,
+                    html_validation: str = BatchWriter.HTML_VALIDATION_FULL, cache_dir=None,
+                    workers: Optional[int] = None, tracer=None, progress=None):
+    """
+    :param file: File path or binary file object to write to. The file object doesn't have to be seekable (e.g. a
+        socket, pipe or HTTP response body); it only needs write(). Combined with in_memory=True, nothing is written
+        to the filesystem.
     :param timestamp: Timestamp (float seconds since Unix epoch) to assign to generated notes/cards. Can be used to
         make build hermetic. Defaults to time.time().
+    :param in_memory: If True, build the collection database in memory and write its bytes straight into the .apkg,
+        instead of building it in a temporary file. Faster, but the whole database has to fit in memory.
+    :param compression: CompressionPolicy deciding which entries of the .apkg are deflated. Defaults to storing
+        everything uncompressed.
+    :param html_validation: How thoroughly note fields are checked for invalid HTML tags: "full" (every note, the
+        default), "sampled" (one note in 100) or "off".
+    :param cache_dir: If set, keep the built collection in this directory, and on later builds only write the notes
+        that were added, changed or removed since. Notes that didn't change keep the ids and timestamp they were first
+        written with. Can't be combined with in_memory, or with more than one worker.
+    :param workers: Number of processes to prepare and insert notes on. The output is the same as with a single
+        process. Only large packages are split up; smaller ones are always written by this process. This only helps
+        when that many CPU cores are free: sending the notes to the workers and merging their results costs time, so
+        on a single core it is slower than workers=None. On platforms that start processes with "spawn" (Windows, and
+        macOS by default), the worker processes import your main module, so the code that calls this must be under an
+        `if __name__ == '__main__':` guard. More than one worker can't be combined with cache_dir.
+    :param tracer: Optional Tracer (see genanki.tracing), which is told how long each phase of the build takes.
+    :param progress: Optional callback, called with a ProgressEvent every 1000 notes, after each media file, and every
+        MiB written to the .apkg. Pass a ProgressReporter to change these intervals. See genanki.progress.
     """
-    dbfile, dbfilename = tempfile.mkstemp()
-    os.close(dbfile)
-
-    conn = sqlite3.connect(dbfilename)
-    cursor = conn.cursor()
+    if compression is None:
+      compression = NO_COMPRESSION
 
     if timestamp is None:
       timestamp = time.time()
 
+    if cache_dir is not None and in_memory:
+      raise ValueError('in_memory and cache_dir cannot be used together.')
+    if cache_dir is not None and workers is not None and workers > 1:
+      # incremental builds update the cached collection in place, one note at a time
+      raise ValueError('workers and cache_dir cannot be used together.')
+
+    progress = ProgressReporter.wrap(progress)
+    if progress is not None:
+      progress.start(media_files_total=len(self.media_files))
+
+    with trace(tracer, 'write_to_file'):
+      self._write_to_file(file, timestamp, in_memory, compression, html_validation, cache_dir, workers, tracer, progress)
+    if progress is not None:
+      progress.finish()
+
+  def write_to_bytes(self, timestamp: Optional[float] = None, in_memory: bool = True, compression=None,
+                     html_validation: str = BatchWriter.HTML_VALIDATION_FULL, workers: Optional[int] = None,
+                     tracer=None, progress=None):
+    """
+    Returns the .apkg as bytes. By default the collection is built in memory, so nothing is written to the filesystem.
+
+    The collection database is closed before it is zipped, and the returned bytes are the output buffer itself rather
+    than a copy of it. To send a package without holding it in memory at all, pass the stream to write_to_file instead.
+
+    The parameters are as for write_to_file, except that in_memory defaults to True.
+    """
+    output = io.BytesIO()
+    self.write_to_file(output, timestamp, in_memory, compression, html_validation, workers=workers, tracer=tracer,
+                       progress=progress)
+    # BytesIO hands over its buffer without copying when nothing else refers to it
+    return output.getvalue()
+
+  def _write_to_file(self, file, timestamp: float, in_memory, compression, html_validation, cache_dir, workers, tracer,
+                     progress):
+    if cache_dir is not None:
+      self._write_to_file_cached(file, timestamp, compression, html_validation, cache_dir, tracer, progress)
+      return
+
     id_gen = itertools.count(int(timestamp * 1000))
-    self.write_to_db(cursor, timestamp, id_gen)
 
-    conn.commit()
-    conn.close()
+    if in_memory:
+      conn = sqlite3.connect(':memory:')
+      try:
+        conn.executescript(APKG_BUILD_PRAGMAS)
+        with trace(tracer, 'build'):
+          self.write_to_db(conn.cursor(), timestamp, id_gen, html_validation, workers, tracer, progress)
+          conn.commit()
+        with trace(tracer, 'serialize') as info:
+          collection_bytes = _serialize_db(conn)
+          info['bytes'] = len(collection_bytes)
+      finally:
+        conn.close()
+
+      self._write_zip(file, collection_bytes, compression, tracer, progress)
+      return
+
+    dbfile, dbfilename = tempfile.mkstemp()
+    os.close(dbfile)
+    try:
+      conn = sqlite3.connect(dbfilename)
+      try:
+        conn.executescript(APKG_BUILD_PRAGMAS)
+        with trace(tracer, 'build'):
+          self.write_to_db(conn.cursor(), timestamp, id_gen, html_validation, workers, tracer, progress)
+          conn.commit()
+      finally:
+        conn.close()
+
+      self._write_zip(file, dbfilename, compression, tracer, progress)
+    finally:
+      os.remove(dbfilename)
+
+  def _write_to_file_cached(self, file, timestamp: float, compression, html_validation, cache_dir, tracer=None,
+                            progress=None):
+    from .build_cache import BuildCache  # build_cache imports this module
+
+    cache = BuildCache(cache_dir, self.decks)
+    with trace(tracer, 'build'):
+      dbfilename = cache.build(self.decks, timestamp, html_validation, progress)
+    try:
+      self._write_zip(file, dbfilename, compression, tracer, progress)
+    except BaseException:
+      os.remove(dbfilename)
+      raise
+    cache.commit(dbfilename)
+
+  def _write_zip(self, file, collection, compression, tracer=None, progress=None):
+    """
+    :param collection: The collection database, as a file path or as bytes.
+    """
+    if isinstance(collection, bytes):
+      collection_size = len(collection)
+    else:
+      collection_size = os.path.getsize(collection)
+
+    if not isinstance(file, (str, os.PathLike)):
+      file = _zip_output(file)
+
+    if progress is None:
+      self._write_zip_to(file, collection, collection_size, compression, tracer, progress)
+      return
+
+    progress.phase = 'zip'
+    progress.bytes_total = collection_size + sum(os.path.getsize(path) for path in self.media_files)
+    if isinstance(file, (str, os.PathLike)):
+      with open(file, 'wb') as fp:
+        self._write_zip_to(_ByteCountingFile(fp, progress), collection, collection_size, compression, tracer, progress)
+    else:
+      self._write_zip_to(_ByteCountingFile(file, progress), collection, collection_size, compression, tracer, progress)
 
+  def _write_zip_to(self, file, collection, collection_size, compression, tracer, progress):
     with zipfile.ZipFile(file, 'w') as outzip:
-      outzip.write(dbfilename, 'collection.anki2')
+      with trace(tracer, 'zip_collection', bytes=collection_size):
+        if isinstance(collection, bytes):
+          outzip.writestr('collection.anki2', collection, compress_type=compression.compress_type_for_collection(),
+                          compresslevel=compression.level)
+        else:
+          outzip.write(collection, 'collection.anki2', compress_type=compression.compress_type_for_collection(),
+                       compresslevel=compression.level)
+      _write_media_files(outzip, self.media_files, compression, tracer, progress)
 
-      media_file_idx_to_path = dict(enumerate(self.media_files))
-      media_json = {idx: os.path.basename(path) for idx, path in media_file_idx_to_path.items()}
-      outzip.writestr('media', json.dumps(media_json))
+  def write_to_db(self, cursor, timestamp: float, id_gen, html_validation: str = BatchWriter.HTML_VALIDATION_FULL,
+                  workers: Optional[int] = None, tracer=None, progress=None):
+    """
+    The indexes are created after the notes and cards have been inserted. For a faster build on a connection that
+    writes a new, throwaway database, run genanki.apkg_schema.APKG_BUILD_PRAGMAS on it first.
+
+    :param workers: See write_to_file. When more than one worker is used, `id_gen` must yield consecutive integers.
+    :param tracer: See write_to_file.
+    :param progress: See write_to_file.
+    """
+    progress = ProgressReporter.wrap(progress)
+
+    with trace(tracer, 'schema'):
+      cursor.executescript(APKG_TABLES)
+      cursor.executescript(APKG_COL)
 
-      for idx, path in media_file_idx_to_path.items():
-        outzip.write(path, str(idx))
+    with trace(tracer, 'col_json') as info:
+      col_json = _ColJson()
+      for deck in self.decks:
+        col_json.add_deck(deck)
+        deck._add_note_models()
+        for model in deck.models.values():
+          col_json.use_model(model, deck.deck_id)
+      col_json.write(cursor, timestamp)
+      info.update(decks=len(col_json.decks), models=len(col_json.deck_id_for_model))
 
-  def write_to_db(self, cursor, timestamp: float, id_gen):
-    cursor.executescript(APKG_SCHEMA)
-    cursor.executescript(APKG_COL)
+    num_notes = sum(deck._num_notes() for deck in self.decks)
+    if progress is not None:
+      progress.notes_total = num_notes
 
-    for deck in self.decks:
-      deck.write_to_db(cursor, timestamp, id_gen)
+    shard_size = plan_shards(num_notes, workers)
+    if shard_size is not None:
+      with trace(tracer, 'notes') as info:
+        info['notes'], info['cards'] = write_notes_sharded(
+          cursor, self.decks, timestamp, id_gen, html_validation, workers, shard_size,
+          None if progress is None else progress.add_notes)
+    else:
+      self._write_notes(cursor, timestamp, id_gen, html_validation, num_notes, tracer, progress)
+
+    with trace(tracer, 'indexes'):
+      cursor.executescript(APKG_INDEXES)
+
+  def _write_notes(self, cursor, timestamp: float, id_gen, html_validation, num_notes, tracer, progress):
+    batch_writer = BatchWriter(cursor, html_validation=html_validation)
+    batch_writer.time_cards = tracer is not None
+    with trace(tracer, 'notes') as notes_info:
+      for deck in self.decks:
+        with trace(tracer, 'deck', deck_id=deck.deck_id, name=deck.name) as info:
+          num_cards_before = batch_writer.num_cards
+          if progress is None:
+            for note in deck.notes:
+              batch_writer.add_note(note, timestamp, deck.deck_id, id_gen)
+          else:
+            for chunk in progress.note_chunks(deck.notes):
+              for note in chunk:
+                batch_writer.add_note(note, timestamp, deck.deck_id, id_gen)
+              progress.add_notes(len(chunk))
+          for columns in deck.note_columns:
+            model_id = columns.model.model_id
+            if progress is None:
+              batch_writer.add_rows(model_id, columns.rows(), timestamp, deck.deck_id, id_gen)
+            else:
+              rows = columns.rows()
+              while True:
+                num_added = batch_writer.add_rows(
+                  model_id, itertools.islice(rows, progress.note_interval), timestamp, deck.deck_id, id_gen)
+                if not num_added:
+                  break
+                progress.add_notes(num_added)
+          info.update(notes=deck._num_notes(), cards=batch_writer.num_cards - num_cards_before)
+      batch_writer.flush()
+      batch_writer.write_col_tags()
+      notes_info.update(notes=num_notes, cards=batch_writer.num_cards)
+    if tracer is not None:
+      tracer.end('card_generation', batch_writer.card_seconds, notes=notes_info['notes'])
 
   def write_to_collection_from_addon(self):
     """
@@ -81,5 +301,129 @@ class Package:
     from anki.importing.apkg import AnkiPackageImporter
 
     tmpfilename = tempfile.NamedTemporaryFile(delete=False).name
-    self.write_to_file(tmpfilename)
-    AnkiPackageImporter(mw.col, tmpfilename).run()
+    try:
+      self.write_to_file(tmpfilename)
+      AnkiPackageImporter(mw.col, tmpfilename).run()
+    finally:
+      os.remove(tmpfilename)
+
+
+def _write_media_files(outzip, media_files, compression=NO_COMPRESSION, tracer=None, progress=None):
+  with trace(tracer, 'media', files=len(media_files)):
+    media_file_idx_to_path = dict(enumerate(dedupe_media_files(media_files)))
+  if progress is not None:
+    progress.media_files_total = len(media_file_idx_to_path)
+  media_json = {idx: os.path.basename(path) for idx, path in media_file_idx_to_path.items()}
+  outzip.writestr('media', json.dumps(media_json), compress_type=compression.compress_type_for_collection(),
+                  compresslevel=compression.level)
+
+  with trace(tracer, 'zip_media', files=len(media_file_idx_to_path)) as info:
+    for idx, path in media_file_idx_to_path.items():
+      outzip.write(path, str(idx), compress_type=compression.compress_type_for_media(path),
+                   compresslevel=compression.level)
+      if progress is not None:
+        progress.add_media_file()
+    if tracer is not None:
+      info['bytes'] = sum(outzip.getinfo(str(idx)).file_size for idx in media_file_idx_to_path)
+
+
+class _WriteOnlyFile:
+  """
+  Adapts an object that only has write() for zipfile, which also calls tell() and flush(). It has no seek(), so zipfile
+  writes the .apkg in a single pass, putting each entry's size and CRC after its data.
+  """
+  def __init__(self, fp):
+    self._fp = fp
+    self._position = 0
+
+  def write(self, data):
+    self._fp.write(data)
+    self._position += len(data)
+    return len(data)
+
+  def tell(self):
+    return self._position
+
+  def flush(self):
+    pass
+
+
+def _zip_output(file):
+  """
+  Returns `file` (a writable file object) in a form that zipfile.ZipFile can write to. zipfile copes with file objects
+  that can't seek or tell by itself, but not with ones that lack flush().
+  """
+  if hasattr(file, 'flush'):
+    return file
+  return _WriteOnlyFile(file)
+
+
+def _serialize_db(conn):
+  """
+  Returns the contents of the database behind `conn` as bytes.
+
+  Uses Connection.serialize() (Python 3.11+). On older Pythons, falls back to copying the database into a temporary file
+  with the backup API and reading that file back.
+  """
+  if hasattr(conn, 'serialize'):
+    return conn.serialize()
+
+  dbfile, dbfilename = tempfile.mkstemp()
+  os.close(dbfile)
+  try:
+    dest = sqlite3.connect(dbfilename)
+    try:
+      conn.backup(dest)
+    finally:
+      dest.close()
+    with open(dbfilename, 'rb') as h:
+      return h.read()
+  finally:
+    os.remove(dbfilename)
+
+
+class _ColJson:
+  """
+  The decks and models written to a collection, whose JSON goes into the col table once all notes are written.
+
+  Assembling col.decks and col.models in memory and writing each of them once avoids a read-modify-write of the JSON for
+  every deck, which is quadratic when there are many decks.
+  """
+  def __init__(self):
+    self.decks = {}  # deck id -> deck
+    self.deck_id_for_model = {}  # model id -> (model, id of the last deck that uses it)
+
+  def add_deck(self, deck):
+    if self.decks.get(deck.deck_id) is deck:
+      return
+    deck._check_id_and_name()
+    self.decks[deck.deck_id] = deck
+
+  def use_model(self, model, deck_id):
+    self.deck_id_for_model[str(model.model_id)] = (model, deck_id)
+
+  def write(self, cursor, timestamp: float):
+    """
+    Writes the JSON of the decks, of the models notes were written with, and of any other models the decks know of.
+    """
+    decks_json = {}
+    for deck in self.decks.values():
+      decks_json[str(deck.deck_id)] = deck.to_json()
+      for model in deck.models.values():
+        self.deck_id_for_model.setdefault(str(model.model_id), (model, deck.deck_id))
+    # each distinct model is serialized once, no matter how many decks use it
+    models_json = {
+      model_id: model.to_json(timestamp, deck_id) for model_id, (model, deck_id) in self.deck_id_for_model.items()}
+    _update_col_json(cursor, decks_json, models_json)
+
+
+def _update_col_json(cursor, decks_json, models_json):
+  """
+  Merges `decks_json` and `models_json` (dicts keyed by str id) into the decks and models stored in the col table.
+  """
+  decks_json_str, models_json_str = cursor.execute('SELECT decks, models FROM col').fetchone()
+  decks = json.loads(decks_json_str)
+  decks.update(decks_json)
+  models = json.loads(models_json_str)
+  models.update(models_json)
+  cursor.execute('UPDATE col SET decks = ?, models = ?', (json.dumps(decks), json.dumps(models)))
@@ -0,0 +1,202 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+
+from .deck import Deck
+from .model import Model
+from .note import Note
+
+
+class ReadNote:
+  """
+  A note read from a .apkg by PackageReader. `deck_id` and `due` are those of the note's first card (None if it has no
+  cards). `suspended_ords` are the ords of its suspended cards.
+  """
+  __slots__ = ('id', 'guid', 'model', 'fields', 'tags', 'mod', 'deck_id', 'due', 'suspended_ords')
+
+  def __init__(self, id, guid, model, fields, tags, mod, deck_id, due, suspended_ords=()):
+    self.id = id
+    self.guid = guid
+    self.model = model
+    self.fields = fields
+    self.tags = tags
+    self.mod = mod
+    self.deck_id = deck_id
+    self.due = due
+    self.suspended_ords = suspended_ords
+
+  def to_note(self):
+    """
+    Returns a genanki.Note with this note's model, fields, tags, guid and due, whose cards are suspended where this
+    note's are.
+    """
+    note = Note(model=self.model, fields=list(self.fields), tags=self.tags, guid=self.guid, due=self.due or 0)
+    if self.suspended_ords:
+      for card in note.cards:
+        if card.ord in self.suspended_ords:
+          card.suspend = True
+    return note
+
+  def __repr__(self):
+    attrs = ['id', 'guid', 'fields', 'tags', 'deck_id']
+    pieces = ['{}={}'.format(attr, repr(getattr(self, attr))) for attr in attrs]
+    return '{}({})'.format(self.__class__.__name__, ', '.join(pieces))
+
+
+class ReadCard:
+  """
+  A card read from a .apkg by PackageReader.
+  """
+  __slots__ = ('id', 'note_id', 'deck_id', 'ord', 'due', 'suspended')
+
+  def __init__(self, id, note_id, deck_id, ord, due, suspended):
+    self.id = id
+    self.note_id = note_id
+    self.deck_id = deck_id
+    self.ord = ord
+    self.due = due
+    self.suspended = suspended
+
+  def __repr__(self):
+    attrs = ['id', 'note_id', 'deck_id', 'ord']
+    pieces = ['{}={}'.format(attr, repr(getattr(self, attr))) for attr in attrs]
+    return '{}({})'.format(self.__class__.__name__, ', '.join(pieces))
+
+
+class PackageReader:
+  """
+  Reads a .apkg file. Notes and cards are read lazily from the collection, and media files are streamed from the zip,
+  so large packages don't have to fit in memory.
+
+    with genanki.PackageReader('deck.apkg') as reader:
+      for note in reader.iter_notes():
+        print(note.guid, note.fields)
+
+  The collection database is extracted to a temporary file, which is removed by close().
+  """
+  _NOTES_SQL = '''
+SELECT notes.id, notes.guid, notes.mid, notes.mod, notes.tags, notes.flds, cards.did, cards.due,
+       (SELECT group_concat(ord) FROM cards WHERE nid = notes.id AND queue = -1)
+FROM notes
+LEFT JOIN cards ON cards.id = (SELECT id FROM cards WHERE nid = notes.id ORDER BY ord LIMIT 1)
+{where}
+ORDER BY notes.id
+'''
+  _CARDS_SQL = 'SELECT id, nid, did, ord, due, queue FROM cards {where} ORDER BY id'
+
+  def __init__(self, file):
+    """
+    :param file: Path (or seekable file object) of the .apkg to read.
+    """
+    self._zip = zipfile.ZipFile(file)
+    self._dbfilename = None
+    self._conn = None
+    try:
+      dbfile, self._dbfilename = tempfile.mkstemp(suffix='.anki2')
+      with os.fdopen(dbfile, 'wb') as dbh, self._zip.open('collection.anki2') as colh:
+        shutil.copyfileobj(colh, dbh, 1 << 20)
+      self._conn = sqlite3.connect(self._dbfilename)
+
+      models_json_str, decks_json_str = self._conn.execute('SELECT models, decks FROM col').fetchone()
+      self.models = {int(model_id): _model_from_json(model_json)
+                     for model_id, model_json in json.loads(models_json_str).items()}
+      self.decks = {int(deck_id): Deck(int(deck_id), deck_json['name'], deck_json.get('desc', ''))
+                    for deck_id, deck_json in json.loads(decks_json_str).items()}
+
+      # media name -> name of the zip entry holding it
+      self.media = {name: idx for idx, name in json.loads(self._zip.read('media')).items()}
+    except BaseException:
+      self.close()
+      raise
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def close(self):
+    if self._conn is not None:
+      self._conn.close()
+      self._conn = None
+    if self._dbfilename is not None and os.path.exists(self._dbfilename):
+      os.remove(self._dbfilename)
+    self._zip.close()
+
+  def num_notes(self):
+    return self._conn.execute('SELECT count(*) FROM notes').fetchone()[0]
+
+  def iter_notes(self, deck_id=None):
+    """
+    Yields a ReadNote for each note, in id order (i.e. in the order they were written). If `deck_id` is given, only
+    yields notes that have a card in that deck.
+    """
+    if deck_id is None:
+      rows = self._conn.execute(self._NOTES_SQL.format(where=''))
+    else:
+      rows = self._conn.execute(
+        self._NOTES_SQL.format(where='WHERE notes.id IN (SELECT nid FROM cards WHERE did = ?)'), (deck_id,))
+    models = self.models
+    for note_id, guid, model_id, mod, tags, flds, card_deck_id, due, suspended_ords in rows:
+      yield ReadNote(
+        note_id, guid, models.get(model_id), flds.split('\x1f'), tags.split(), mod, card_deck_id, due,
+        () if suspended_ords is None else tuple(int(ord_) for ord_ in suspended_ords.split(',')))
+
+  def iter_cards(self, note_id=None):
+    """
+    Yields a ReadCard for each card (or each card of the note with id `note_id`), in id order.
+    """
+    if note_id is None:
+      rows = self._conn.execute(self._CARDS_SQL.format(where=''))
+    else:
+      rows = self._conn.execute(self._CARDS_SQL.format(where='WHERE nid = ?'), (note_id,))
+    for card_id, nid, did, ord_, due, queue in rows:
+      yield ReadCard(card_id, nid, did, ord_, due, queue == -1)
+
+  def open_media(self, name):
+    """
+    Returns a binary file object for the media file called `name`, which streams it from the .apkg.
+    """
+    return self._zip.open(self.media[name])
+
+  def media_size(self, name):
+    return self._zip.getinfo(self.media[name]).file_size
+
+  def _media_fingerprint(self, name):
+    # size and CRC-32 from the zip directory, so that media can be compared without decompressing them
+    info = self._zip.getinfo(self.media[name])
+    return info.file_size, info.CRC
+
+  def extract_media(self, directory):
+    """
+    Writes all media files into `directory` and returns their paths.
+    """
+    paths = []
+    for name in self.media:
+      path = os.path.join(directory, os.path.basename(name))
+      with self.open_media(name) as src, open(path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+      paths.append(path)
+    return paths
+
+
+def _model_from_json(model_json):
+  model = Model(
+    int(model_json['id']),
+    model_json['name'],
+    fields=model_json['flds'],
+    templates=model_json['tmpls'],
+    css=model_json.get('css', ''),
+    model_type=model_json.get('type', Model.FRONT_BACK),
+    latex_pre=model_json.get('latexPre', Model.DEFAULT_LATEX_PRE),
+    latex_post=model_json.get('latexPost', Model.DEFAULT_LATEX_POST),
+    sort_field_index=model_json.get('sortf', 0),
+  )
+  if 'req' in model_json:
+    # the package already says which fields each template needs; no need to work it out again
+    model._record_cache_source()
+    model.__dict__['_req'] = model_json['req']
+  return model
@@ -0,0 +1,351 @@
+import itertools
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import time
+import zipfile
+
+from .batch_writer import BatchWriter
+from .card import Card
+from .compression import NO_COMPRESSION
+from .media import dedupe_media_files
+from .package import _ColJson
+from .tags import TagRegistry
+
+from typing import Optional
+
+
+class CollectionUpdater:
+  """
+  Inserts, updates and deletes notes in an existing collection database, matching notes by guid.
+
+  Updated notes keep their note id, and their cards keep their card ids (matched by ord), so the rows of untouched
+  notes are never rewritten. Call finish() when done, to flush pending inserts and write deck/model JSON.
+  """
+  _UPDATE_NOTE_SQL = 'UPDATE notes SET mid = ?, mod = ?, usn = ?, tags = ?, flds = ?, sfld = ? WHERE id = ?'
+  _UPDATE_CARD_SQL = 'UPDATE cards SET did = ?, mod = ?, usn = ?, queue = ?, due = ? WHERE id = ?'
+
+  def __init__(self, cursor, timestamp: float, html_validation: str = BatchWriter.HTML_VALIDATION_FULL):
+    self.cursor = cursor
+    self.timestamp = timestamp
+    self._note_ids_by_guid = dict(cursor.execute('SELECT guid, id FROM notes'))
+
+    # new ids must not collide with the ids already in the collection
+    max_note_id, = cursor.execute('SELECT max(id) FROM notes').fetchone()
+    max_card_id, = cursor.execute('SELECT max(id) FROM cards').fetchone()
+    self._id_gen = itertools.count(max(int(timestamp * 1000), (max_note_id or 0) + 1, (max_card_id or 0) + 1))
+
+    self._batch_writer = BatchWriter(cursor, html_validation=html_validation)
+    self._col_json = _ColJson()
+
+    self.num_inserted = 0
+    self.num_updated = 0
+    self.num_deleted = 0
+
+  def __contains__(self, guid):
+    return guid in self._note_ids_by_guid
+
+  def guids(self):
+    return self._note_ids_by_guid.keys()
+
+  def add_deck(self, deck):
+    """
+    Writes the JSON of `deck` and of the models its notes use, without writing any notes.
+    """
+    self._col_json.add_deck(deck)
+    deck._add_note_models()
+
+  def upsert_note(self, deck, note):
+    """
+    Writes `note` into `deck`: updates the existing note with the same guid, or inserts a new one.
+    """
+    self._col_json.add_deck(deck)
+    self._col_json.use_model(note.model, deck.deck_id)
+
+    self._batch_writer.prepare_note(note)
+    guid = note.guid
+    note_id = self._note_ids_by_guid.get(guid)
+    if note_id is None:
+      note_id = self._batch_writer.add_prepared_note(note, self.timestamp, deck.deck_id, self._id_gen)
+      self._note_ids_by_guid[guid] = note_id
+      self.num_inserted += 1
+      return
+
+    # the note may have been inserted earlier in this session, with its rows still buffered
+    self._batch_writer.flush()
+    row = note._to_row(self.timestamp, note_id)
+    # (mid, mod, usn, tags, flds, sfld) from the note row
+    self.cursor.execute(self._UPDATE_NOTE_SQL, row[2:8] + (note_id,))
+
+    card_ids_by_ord = dict(self.cursor.execute('SELECT ord, id FROM cards WHERE nid = ?', (note_id,)))
+    for card in note.cards:
+      card_id = card_ids_by_ord.pop(card.ord, None)
+      if card_id is None:
+        self.cursor.execute(
+          Card._INSERT_SQL, card._to_row(self.timestamp, deck.deck_id, note_id, next(self._id_gen), note.due))
+      else:
+        card_row = card._to_row(self.timestamp, deck.deck_id, note_id, card_id, note.due)
+        # (did, mod, usn, queue, due) from the card row
+        self.cursor.execute(self._UPDATE_CARD_SQL, card_row[2:3] + card_row[4:6] + card_row[7:9] + (card_id,))
+    for card_id in card_ids_by_ord.values():
+      self.cursor.execute('DELETE FROM cards WHERE id = ?', (card_id,))
+    self.num_updated += 1
+
+  def delete_note(self, guid):
+    """
+    Deletes the note with the given guid, and its cards. Returns False if there is no such note.
+    """
+    note_id = self._note_ids_by_guid.pop(guid, None)
+    if note_id is None:
+      return False
+    self._batch_writer.flush()
+    self.cursor.execute('DELETE FROM cards WHERE nid = ?', (note_id,))
+    self.cursor.execute('DELETE FROM notes WHERE id = ?', (note_id,))
+    self.num_deleted += 1
+    return True
+
+  def finish(self):
+    self._batch_writer.flush()
+
+    # col.tags lists the tags of the notes as they are now, including those kept from the original package
+    tags = TagRegistry()
+    for (formatted,) in self.cursor.execute('SELECT DISTINCT tags FROM notes').fetchall():
+      tags.add_formatted(formatted)
+    tags.write_col_tags(self.cursor)
+
+    self._col_json.write(self.cursor, self.timestamp)
+
+
+class PackageUpdater:
+  """
+  Updates an existing .apkg: inserts, updates and deletes notes by guid, and adds or removes media files.
+
+    with genanki.PackageUpdater('deck.apkg') as updater:
+      updater.upsert_note(my_deck, changed_note)
+      updater.delete_note(removed_note.guid)
+
+  Only the collection database and the media manifest are rewritten; media entries that are kept are copied into the
+  new .apkg byte for byte, without being decompressed or recompressed. If the `with` block raises, the original file
+  is left untouched.
+  """
+  def __init__(self, path, output=None, timestamp: Optional[float] = None, compression=None,
+               html_validation: str = BatchWriter.HTML_VALIDATION_FULL):
+    """
+    :param path: Path of the .apkg to update.
+    :param output: Path to write the updated .apkg to. Defaults to replacing `path`.
+    :param timestamp: Timestamp (float seconds since Unix epoch) to assign to inserted/updated notes and cards.
+        Defaults to time.time().
+    :param compression: CompressionPolicy for the collection and for newly added media. Defaults to storing them
+        uncompressed.
+    :param html_validation: How thoroughly note fields are checked for invalid HTML tags: "full", "sampled" or "off".
+    """
+    self.path = path
+    self.output = path if output is None else output
+    self.timestamp = time.time() if timestamp is None else timestamp
+    self.compression = NO_COMPRESSION if compression is None else compression
+
+    self._new_media_files = []
+    self._removed_media = set()
+
+    with zipfile.ZipFile(path) as inzip:
+      self._media = {int(idx): name for idx, name in json.loads(inzip.read('media')).items()}
+      dbfile, self._dbfilename = tempfile.mkstemp()
+      try:
+        with os.fdopen(dbfile, 'wb') as dbh, inzip.open('collection.anki2') as colh:
+          shutil.copyfileobj(colh, dbh, 1 << 20)
+      except BaseException:
+        # os.fdopen has closed dbfile, unless it failed itself
+        try:
+          os.close(dbfile)
+        except OSError:
+          pass
+        os.remove(self._dbfilename)
+        raise
+
+    self._conn = sqlite3.connect(self._dbfilename)
+    try:
+      self.collection = CollectionUpdater(self._conn.cursor(), self.timestamp, html_validation)
+    except Exception:
+      self._cleanup()
+      raise
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      self._cleanup()
+
+  def upsert_note(self, deck, note):
+    """
+    Updates the note with the same guid as `note`, or inserts `note` if there is none.
+    """
+    self.collection.upsert_note(deck, note)
+
+  def upsert_notes(self, deck, notes):
+    for note in notes:
+      self.collection.upsert_note(deck, note)
+
+  def delete_note(self, guid):
+    """
+    Deletes the note with the given guid. Returns False if there is no such note.
+    """
+    return self.collection.delete_note(guid)
+
+  def add_media_files(self, media_files):
+    """
+    Adds media files to the package. A file with the same name as an existing media file replaces it.
+    """
+    self._new_media_files.extend(media_files)
+
+  def remove_media(self, name):
+    """
+    Removes the media file called `name` (a basename, as used in note fields) from the package.
+    """
+    self._removed_media.add(name)
+
+  def close(self):
+    """
+    Writes the updated .apkg. Called automatically when used as a context manager.
+    """
+    try:
+      self.collection.finish()
+      self._conn.commit()
+      self._conn.close()
+
+      new_media_files = dedupe_media_files(self._new_media_files)
+      replaced = self._removed_media | {os.path.basename(path) for path in new_media_files}
+      kept_media = {idx: name for idx, name in self._media.items() if name not in replaced}
+      next_idx = max(self._media, default=-1) + 1
+      new_media = {next_idx + i: path for i, path in enumerate(new_media_files)}
+
+      media_json = {str(idx): name for idx, name in kept_media.items()}
+      media_json.update({str(idx): os.path.basename(path) for idx, path in new_media.items()})
+
+      outdir = os.path.dirname(os.path.abspath(self.output))
+      outfile, outfilename = tempfile.mkstemp(dir=outdir, suffix='.apkg.tmp')
+      os.close(outfile)
+      try:
+        with zipfile.ZipFile(outfilename, 'w') as outzip:
+          outzip.write(self._dbfilename, 'collection.anki2',
+                       compress_type=self.compression.compress_type_for_collection(),
+                       compresslevel=self.compression.level)
+          outzip.writestr('media', json.dumps(media_json),
+                          compress_type=self.compression.compress_type_for_collection(),
+                          compresslevel=self.compression.level)
+
+          with zipfile.ZipFile(self.path) as inzip, open(self.path, 'rb') as rawin:
+            for idx in kept_media:
+              _copy_zip_entry_raw(inzip, rawin, str(idx), outzip)
+
+          for idx, path in new_media.items():
+            outzip.write(path, str(idx), compress_type=self.compression.compress_type_for_media(path),
+                         compresslevel=self.compression.level)
+
+        _copy_file_mode(self.path, outfilename)
+        os.replace(outfilename, self.output)
+      except BaseException:
+        os.remove(outfilename)
+        raise
+    finally:
+      self._cleanup()
+
+  def _cleanup(self):
+    self._conn.close()
+    if os.path.exists(self._dbfilename):
+      os.remove(self._dbfilename)
+
+
+def _copy_file_mode(src, dst):
+  """
+  Gives `dst` (a file made by tempfile.mkstemp, which is only readable by its owner) the permissions of `src`, or the
+  permissions a newly created file gets if `src` doesn't exist.
+  """
+  try:
+    shutil.copymode(src, dst)
+  except FileNotFoundError:
+    # os.umask can only be read by setting it
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(dst, 0o666 & ~umask)
+
+
+_LOCAL_FILE_HEADER = struct.Struct('<4s5H3L2H')
+_DATA_DESCRIPTOR_FLAG = 0x08
+# the ZipFile internals _copy_zip_entry_raw relies on
+_ZIPFILE_INTERNALS = ('_lock', '_writecheck', 'start_dir', '_didModify', '_seekable', 'fp')
+
+
+def _copy_zip_entry_raw(inzip, rawin, name, outzip):
+  """
+  Copies the entry `name` of `inzip` (whose underlying file is also open as `rawin`) into `outzip` without decompressing
+  and recompressing it.
+
+  zipfile has no public API for this, so this writes the entry the same way ZipFile.writestr does. If zipfile's
+  internals aren't what we expect, falls back to a (slower) decompress/recompress copy.
+  """
+  info = inzip.getinfo(name)
+  if not all(hasattr(outzip, attr) for attr in _ZIPFILE_INTERNALS):
+    _copy_zip_entry(inzip, info, outzip)
+    return
+
+  rawin.seek(info.header_offset)
+  header = _LOCAL_FILE_HEADER.unpack(rawin.read(_LOCAL_FILE_HEADER.size))
+  if header[0] != b'PK\x03\x04':
+    raise zipfile.BadZipFile('Bad local file header for {!r}'.format(name))
+  name_len, extra_len = header[-2:]
+  rawin.seek(name_len + extra_len, os.SEEK_CUR)
+
+  out_info = zipfile.ZipInfo(info.filename, info.date_time)
+  out_info.compress_type = info.compress_type
+  out_info.CRC = info.CRC
+  out_info.compress_size = info.compress_size
+  out_info.file_size = info.file_size
+  out_info.external_attr = info.external_attr
+  # sizes and CRC go in the local header, so a data descriptor isn't needed
+  out_info.flag_bits = info.flag_bits & ~_DATA_DESCRIPTOR_FLAG
+
+  with outzip._lock:
+    try:
+      # nothing has been written yet, so if these don't work as expected the regular copy can take over
+      if outzip._seekable:
+        outzip.fp.seek(outzip.start_dir)
+      out_info.header_offset = outzip.fp.tell()
+      outzip._writecheck(out_info)
+    except (AttributeError, TypeError):
+      fallback = True
+    else:
+      fallback = False
+    if not fallback:
+      _write_raw_entry(outzip, out_info, rawin, info.compress_size, name)
+  if fallback:
+    _copy_zip_entry(inzip, info, outzip)
+
+
+def _copy_zip_entry(inzip, info, outzip):
+  with inzip.open(info) as src, outzip.open(info, 'w') as dst:
+    shutil.copyfileobj(src, dst, 1 << 20)
+
+
+def _write_raw_entry(outzip, out_info, rawin, compress_size, name):
+  """
+  Writes the local header for `out_info`, then `compress_size` bytes of entry data from `rawin`. The caller holds
+  outzip._lock.
+  """
+  outzip._didModify = True
+  outzip.fp.write(out_info.FileHeader())
+  remaining = compress_size
+  while remaining:
+    chunk = rawin.read(min(remaining, 1 << 20))
+    if not chunk:
+      raise zipfile.BadZipFile('Truncated data for {!r}'.format(name))
+    outzip.fp.write(chunk)
+    remaining -= len(chunk)
+  outzip.filelist.append(out_info)
+  outzip.NameToInfo[out_info.filename] = out_info
+  outzip.start_dir = outzip.fp.tell()
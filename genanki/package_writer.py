@@ -0,0 +1,140 @@
+import itertools
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+
+from .apkg_col import APKG_COL
+from .apkg_schema import APKG_BUILD_PRAGMAS, APKG_INDEXES, APKG_TABLES
+from .batch_writer import BatchWriter
+from .compression import NO_COMPRESSION
+from .package import _ColJson, _serialize_db, _write_media_files, _zip_output
+
+from typing import Optional
+
+
+class PackageWriter:
+  """
+  Writes a .apkg file incrementally, without keeping every Note in memory.
+
+  Notes are inserted into the collection as they are added; deck/model JSON and media files are written when the
+  writer is closed. Use it as a context manager:
+
+    with genanki.PackageWriter('output.apkg', media_files=['sound.mp3']) as writer:
+      for note in generate_notes():
+        writer.add_note(my_deck, note)
+
+  If the `with` block raises, no .apkg is written.
+  """
+  def __init__(self, file, media_files=None, timestamp: Optional[float] = None, in_memory: bool = False,
+               compression=None, html_validation: str = BatchWriter.HTML_VALIDATION_FULL):
+    """
+    :param file: File path or binary file object to write to. The file object doesn't have to be seekable; it only
+        needs write().
+    :param media_files: Paths of media files to include in the package.
+    :param timestamp: Timestamp (float seconds since Unix epoch) to assign to generated notes/cards. Defaults to
+        time.time().
+    :param in_memory: If True, build the collection database in memory rather than in a temporary file. This means
+        memory use grows with the number of notes, so it is off by default.
+    :param compression: CompressionPolicy deciding which entries of the .apkg are deflated. Defaults to storing
+        everything uncompressed.
+    :param html_validation: How thoroughly note fields are checked for invalid HTML tags: "full" (every note, the
+        default), "sampled" (one note in 100) or "off".
+    """
+    self.file = file
+    self.media_files = list(set(media_files or []))
+    self.timestamp = time.time() if timestamp is None else timestamp
+    self.in_memory = in_memory
+    self.compression = NO_COMPRESSION if compression is None else compression
+
+    self._id_gen = itertools.count(int(self.timestamp * 1000))
+    self._col_json = _ColJson()
+
+    if in_memory:
+      self._dbfilename = None
+      self._conn = sqlite3.connect(':memory:')
+    else:
+      dbfile, self._dbfilename = tempfile.mkstemp()
+      os.close(dbfile)
+      self._conn = sqlite3.connect(self._dbfilename)
+
+    self._cursor = self._conn.cursor()
+    self._cursor.executescript(APKG_BUILD_PRAGMAS)
+    self._cursor.executescript(APKG_TABLES)
+    self._cursor.executescript(APKG_COL)
+    self._batch_writer = BatchWriter(self._cursor, html_validation=html_validation)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      self._cleanup()
+
+  def add_note(self, deck, note):
+    """
+    Writes `note` into `deck`. Only the deck's id, name and description are used; notes already in `deck.notes` are
+    not written (use add_deck for that).
+    """
+    self._col_json.add_deck(deck)
+    self._col_json.use_model(note.model, deck.deck_id)
+    self._batch_writer.add_note(note, self.timestamp, deck.deck_id, self._id_gen)
+
+  def add_notes(self, deck, notes):
+    """
+    Writes each note from the iterable `notes` into `deck`. `notes` may be a generator; it is consumed lazily.
+    """
+    for note in notes:
+      self.add_note(deck, note)
+
+  def add_deck(self, deck):
+    """
+    Writes `deck` and all its notes, including those added with add_notes_from_columns.
+    """
+    self._col_json.add_deck(deck)
+    self.add_notes(deck, deck.notes)
+    for columns in deck.note_columns:
+      self.add_note_columns(deck, columns)
+
+  def add_note_columns(self, deck, columns):
+    """
+    Writes the notes in `columns` (a NoteColumns, see Deck.add_notes_from_columns) into `deck`, without creating Note
+    objects.
+    """
+    self._col_json.add_deck(deck)
+    self._col_json.use_model(columns.model, deck.deck_id)
+    self._batch_writer.add_rows(columns.model.model_id, columns.rows(), self.timestamp, deck.deck_id, self._id_gen)
+
+  def close(self):
+    """
+    Finishes the collection and writes the .apkg file. Called automatically when used as a context manager.
+    """
+    try:
+      self._batch_writer.flush()
+      self._batch_writer.write_col_tags()
+
+      self._col_json.write(self._cursor, self.timestamp)
+      self._cursor.executescript(APKG_INDEXES)
+      self._conn.commit()
+
+      file = self.file if isinstance(self.file, (str, os.PathLike)) else _zip_output(self.file)
+      with zipfile.ZipFile(file, 'w') as outzip:
+        collection_compress_type = self.compression.compress_type_for_collection()
+        if self.in_memory:
+          outzip.writestr('collection.anki2', _serialize_db(self._conn), compress_type=collection_compress_type,
+                          compresslevel=self.compression.level)
+        else:
+          self._conn.close()
+          outzip.write(self._dbfilename, 'collection.anki2', compress_type=collection_compress_type,
+                       compresslevel=self.compression.level)
+        _write_media_files(outzip, self.media_files, self.compression)
+    finally:
+      self._cleanup()
+
+  def _cleanup(self):
+    self._conn.close()
+    if self._dbfilename is not None and os.path.exists(self._dbfilename):
+      os.remove(self._dbfilename)
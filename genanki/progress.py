@@ -0,0 +1,110 @@
+"""
+Progress reporting for long builds. Pass a callback as `progress=` to Package.write_to_file:
+
+  def show_progress(event):
+    print('{} {}/{} notes, {}/{} bytes'.format(
+      event.phase, event.notes_done, event.notes_total, event.bytes_written, event.bytes_total))
+
+  my_package.write_to_file('output.apkg', progress=show_progress)
+
+To change how often the callback is called, pass a ProgressReporter instead:
+
+  my_package.write_to_file('output.apkg', progress=genanki.ProgressReporter(show_progress, note_interval=100))
+"""
+import collections
+
+ProgressEvent = collections.namedtuple('ProgressEvent', [
+  'phase',  # 'notes' while notes are written, 'zip' while the .apkg is written, 'done' at the end
+  'notes_done',
+  'notes_total',
+  'media_files_done',
+  'media_files_total',
+  'bytes_written',  # bytes written to the .apkg so far
+  'bytes_total',  # uncompressed size of the collection and media; with compression, fewer bytes are written
+])
+
+
+class ProgressReporter:
+  """
+  Calls `callback` with a ProgressEvent every `note_interval` notes, after every media file, and every `byte_interval`
+  bytes written to the .apkg.
+  """
+  DEFAULT_NOTE_INTERVAL = 1000
+  DEFAULT_BYTE_INTERVAL = 1 << 20
+
+  def __init__(self, callback, note_interval: int = DEFAULT_NOTE_INTERVAL,
+               byte_interval: int = DEFAULT_BYTE_INTERVAL):
+    self.callback = callback
+    self.note_interval = note_interval
+    self.byte_interval = byte_interval
+    self.start()
+
+  @classmethod
+  def wrap(cls, progress):
+    """
+    Returns `progress` as a ProgressReporter: a plain callback is wrapped in one with the default intervals.
+    """
+    if progress is None or isinstance(progress, cls):
+      return progress
+    return cls(progress)
+
+  def start(self, notes_total=0, media_files_total=0):
+    self.phase = 'notes'
+    self.notes_done = 0
+    self.notes_total = notes_total
+    self.media_files_done = 0
+    self.media_files_total = media_files_total
+    self.bytes_written = 0
+    self.bytes_total = 0
+    self._next_notes_report = self.note_interval
+    self._next_bytes_report = self.byte_interval
+
+  def add_notes(self, num_notes):
+    self.notes_done += num_notes
+    if self.notes_done >= self._next_notes_report or self.notes_done == self.notes_total:
+      self._next_notes_report = self.notes_done + self.note_interval
+      self._report()
+
+  def add_media_file(self):
+    self.media_files_done += 1
+    self._report()
+
+  def add_bytes(self, num_bytes):
+    self.bytes_written += num_bytes
+    if self.bytes_written >= self._next_bytes_report:
+      self._next_bytes_report = self.bytes_written + self.byte_interval
+      self._report()
+
+  def finish(self):
+    self.phase = 'done'
+    self._report()
+
+  def _report(self):
+    self.callback(ProgressEvent(
+      self.phase, self.notes_done, self.notes_total, self.media_files_done, self.media_files_total, self.bytes_written,
+      self.bytes_total))
+
+  def note_chunks(self, notes):
+    """
+    Splits the list `notes` into chunks of at most note_interval notes, so that callers can call add_notes once per
+    chunk rather than once per note.
+    """
+    for start in range(0, len(notes), self.note_interval):
+      yield notes[start:start + self.note_interval]
+
+
+class _ByteCountingFile:
+  """
+  Wraps a writable file object, reporting the bytes written through it to a ProgressReporter.
+  """
+  def __init__(self, fp, progress):
+    self._fp = fp
+    self._progress = progress
+
+  def write(self, data):
+    rv = self._fp.write(data)
+    self._progress.add_bytes(len(data))
+    return rv
+
+  def __getattr__(self, name):
+    return getattr(self._fp, name)
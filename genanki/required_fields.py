@@ -0,0 +1,201 @@
+"""
+Computes the "req" list of a Model: which fields must be non-empty for each template to produce a card.
+
+Rather than rendering each qfmt once per field with sentinel values, we parse each qfmt once and look at which fields
+are referenced and under which sections / inverted sections. The result can be cached on disk (set the
+GENANKI_CACHE_DIR environment variable), keyed by a hash of the field names and templates.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import chevron
+from chevron.tokenizer import tokenize
+
+# Bump this if the output of compute_req changes, so that stale on-disk cache entries are ignored.
+_CACHE_VERSION = 1
+
+# chevron looks keys up in every enclosing section's value (a str for sections, a bool for inverted sections) before the
+# fields dict. Keys like these could resolve to something other than a field, so we fall back to rendering for them.
+_SHADOWED_KEYS = frozenset(dir('') + dir(True))
+
+
+class _UnsupportedTemplate(Exception):
+  pass
+
+
+def _field_references(qfmt):
+  """
+  Returns a list of (field_name, sections) for each variable tag in `qfmt`, where `sections` is a tuple of
+  (is_inverted, key) for each enclosing section, outermost first.
+  """
+  refs = []
+  sections = []
+  for tag, key in tokenize(qfmt):
+    if tag in ('section', 'inverted section'):
+      if sections:
+        _check_plain_key(key)
+      sections.append((tag == 'inverted section', key))
+    elif tag == 'end':
+      sections.pop()
+    elif tag in ('variable', 'no escape'):
+      if sections:
+        _check_plain_key(key)
+      if key == '.' or '.' in key:
+        raise _UnsupportedTemplate
+      refs.append((key, tuple(sections)))
+    elif tag == 'partial':
+      raise _UnsupportedTemplate
+  return refs
+
+
+def _check_plain_key(key):
+  if key in _SHADOWED_KEYS or '.' in key:
+    raise _UnsupportedTemplate
+  try:
+    int(key)
+  except ValueError:
+    return
+  raise _UnsupportedTemplate
+
+
+def _has_content(refs, present):
+  """
+  Returns whether the rendered template would contain a field value, when exactly the fields in `present` are
+  non-empty. Keys that aren't field names render as empty.
+  """
+  for key, sections in refs:
+    if key not in present:
+      continue
+    for is_inverted, section_key in sections:
+      if (section_key in present) == is_inverted:
+        break
+    else:
+      return True
+  return False
+
+
+def compute_req(field_names, templates):
+  """
+  :param field_names: List of field names, in order.
+  :param templates: List of template dicts; only 'qfmt' is used.
+  :return: List of [template_ord, "all"|"any", [required_field_ord, ...]].
+  """
+  if len(set(field_names)) != len(field_names):
+    return _compute_req_by_rendering(field_names, templates)
+
+  all_fields = set(field_names)
+  req = []
+  for template_ord, template in enumerate(templates):
+    try:
+      refs = _field_references(template['qfmt'])
+    except _UnsupportedTemplate:
+      req.append(_compute_template_req_by_rendering(field_names, template_ord, template))
+      continue
+
+    # A field is required if the question has no content when only that field is empty.
+    required_fields = [
+      field_ord for field_ord, field in enumerate(field_names)
+      if not _has_content(refs, all_fields - {field})]
+    if required_fields:
+      req.append([template_ord, 'all', required_fields])
+      continue
+
+    # there are no required fields, so an "all" is not appropriate, switch to checking for "any"
+    required_fields = [
+      field_ord for field_ord, field in enumerate(field_names) if _has_content(refs, {field})]
+    if not required_fields:
+      raise Exception(
+        'Could not compute required fields for this template; please check the formatting of "qfmt": {}'.format(
+          template))
+    req.append([template_ord, 'any', required_fields])
+
+  return req
+
+
+def _compute_req_by_rendering(field_names, templates):
+  return [
+    _compute_template_req_by_rendering(field_names, template_ord, template)
+    for template_ord, template in enumerate(templates)]
+
+
+def _compute_template_req_by_rendering(field_names, template_ord, template):
+  """
+  Partial reimplementation of req computing logic from Anki, using chevron instead of Anki's custom mustache
+  implementation. Renders the template once per field, with sentinel values. Used for templates that
+  _field_references can't analyze.
+  """
+  sentinel = 'SeNtInEl'
+
+  required_fields = []
+  for field_ord, field in enumerate(field_names):
+    field_values = {field: sentinel for field in field_names}
+    field_values[field] = ''
+
+    rendered = chevron.render(template['qfmt'], field_values)
+
+    if sentinel not in rendered:
+      # when this field is missing, there is no meaningful content (no field values) in the question, so this field
+      # is required
+      required_fields.append(field_ord)
+
+  if required_fields:
+    return [template_ord, 'all', required_fields]
+
+  # there are no required fields, so an "all" is not appropriate, switch to checking for "any"
+  for field_ord, field in enumerate(field_names):
+    field_values = {field: '' for field in field_names}
+    field_values[field] = sentinel
+
+    rendered = chevron.render(template['qfmt'], field_values)
+
+    if sentinel in rendered:
+      # when this field is present, there is meaningful content in the question
+      required_fields.append(field_ord)
+
+  if not required_fields:
+    raise Exception(
+      'Could not compute required fields for this template; please check the formatting of "qfmt": {}'.format(
+        template))
+
+  return [template_ord, 'any', required_fields]
+
+
+def _cache_dir():
+  return os.environ.get('GENANKI_CACHE_DIR')
+
+
+def compute_req_cached(field_names, templates):
+  """
+  Like compute_req, but reads/writes the result from/to GENANKI_CACHE_DIR if that environment variable is set. Cache
+  errors (e.g. an unwritable directory) are ignored.
+  """
+  cache_dir = _cache_dir()
+  if not cache_dir:
+    return compute_req(field_names, templates)
+
+  key_json = json.dumps([_CACHE_VERSION, list(field_names), [template['qfmt'] for template in templates]])
+  key = hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+  req_dir = os.path.join(cache_dir, 'req')
+  path = os.path.join(req_dir, key + '.json')
+
+  try:
+    with open(path) as h:
+      return json.load(h)
+  except (OSError, ValueError):
+    pass
+
+  req = compute_req(field_names, templates)
+
+  try:
+    os.makedirs(req_dir, exist_ok=True)
+    # write to a temp file and rename, so that concurrent processes never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=req_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as h:
+      json.dump(req, h)
+    os.replace(tmp_path, path)
+  except OSError:
+    pass
+
+  return req
@@ -0,0 +1,189 @@
+"""
+Builds the notes and cards of a collection on several processes.
+
+The notes are split into contiguous shards. Each worker process writes its shard into its own SQLite database, numbering
+notes and cards from 0 in the same order a single-process build would. The parent then ATTACHes each shard and copies
+its rows over with INSERT ... SELECT, shifting the ids by the number of ids used by the shards before it. The result is
+identical to a single-process build.
+"""
+import collections
+import concurrent.futures
+import itertools
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+import warnings
+
+from .apkg_schema import APKG_BUILD_PRAGMAS, APKG_TABLES
+from .batch_writer import BatchWriter
+from .note import Note
+from .tags import TagRegistry
+
+# Below this many notes per shard, the cost of sending notes to other processes outweighs the gain.
+MIN_NOTES_PER_SHARD = 2000
+# More shards than workers, so that a slow shard doesn't leave the other workers idle at the end.
+SHARDS_PER_WORKER = 4
+# Shards submitted to the workers ahead of the one being merged, per worker. Only these shards' notes are copied for
+# the workers at any one time, rather than every shard's.
+SHARDS_IN_FLIGHT_PER_WORKER = 2
+
+_MERGE_NOTES_SQL = '''
+INSERT INTO notes
+SELECT id + :offset, guid, mid, mod, usn, tags, flds, sfld, csum, flags, data FROM shard.notes
+'''
+_MERGE_CARDS_SQL = '''
+INSERT INTO cards
+SELECT id + :offset, nid + :offset, did, ord, mod, usn, type, queue, due, ivl, factor, reps, lapses, left, odue, odid,
+       flags, data
+FROM shard.cards
+'''
+
+
+def plan_shards(num_notes, workers):
+  """
+  Returns the number of notes in each shard, or None if the notes should be written by a single process.
+  """
+  if workers is None or workers <= 1:
+    return None
+  num_shards = min(workers * SHARDS_PER_WORKER, num_notes // MIN_NOTES_PER_SHARD)
+  if num_shards <= 1:
+    return None
+  return math.ceil(num_notes / num_shards)
+
+
+def write_notes_sharded(cursor, decks, timestamp: float, id_gen, html_validation, workers, shard_size,
+                        on_shard_written=None):
+  """
+  Writes the notes of `decks` into the notes and cards tables of `cursor`, using `workers` processes, and lists their
+  tags in col.tags.
+
+  `id_gen` must yield consecutive integers (like the itertools.count() that Package.write_to_file uses): one id is taken
+  from it up front, and it is then advanced past every id the shards used.
+
+  Shards are handed to the workers a few at a time, and merged in order as they finish.
+
+  :param on_shard_written: Optional callback, called with the number of notes in each shard once it has been merged.
+  :return: (number of notes, number of cards) written.
+  """
+  deck_notes = (item for deck in decks for item in _pack_deck_notes(deck))
+  base_id = None
+  num_ids = 0
+  num_notes = 0
+  tags = TagRegistry()
+
+  def merge(shard_result):
+    nonlocal base_id, num_ids, num_notes
+    shard_path, shard_num_notes, shard_num_ids, shard_tags, caught_warnings = shard_result
+    tags.update(shard_tags)
+    for message, category in caught_warnings:
+      warnings.warn(message, category)
+    if base_id is None and shard_num_ids:
+      base_id = next(id_gen)
+
+    cursor.execute('ATTACH DATABASE ? AS shard', (shard_path,))
+    offset = {'offset': (base_id or 0) + num_ids}
+    cursor.execute(_MERGE_NOTES_SQL, offset)
+    cursor.execute(_MERGE_CARDS_SQL, offset)
+    cursor.connection.commit()
+    cursor.execute('DETACH DATABASE shard')
+    os.remove(shard_path)
+    num_ids += shard_num_ids
+    num_notes += shard_num_notes
+    if on_shard_written is not None:
+      on_shard_written(shard_num_notes)
+
+  shard_dir = tempfile.mkdtemp(prefix='genanki-shards-')
+  try:
+    shard_args = (
+      (os.path.join(shard_dir, '{}.anki2'.format(shard_idx)), shard, shard_idx * shard_size, timestamp,
+       html_validation)
+      for shard_idx, shard in enumerate(iter(lambda: list(itertools.islice(deck_notes, shard_size)), [])))
+
+    cursor.connection.commit()  # ATTACH is not allowed inside a transaction
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+      pending = collections.deque()
+      for args in shard_args:
+        pending.append(executor.submit(_build_shard, args))
+        if len(pending) >= workers * SHARDS_IN_FLIGHT_PER_WORKER:
+          merge(pending.popleft().result())
+      while pending:
+        merge(pending.popleft().result())
+  finally:
+    shutil.rmtree(shard_dir, ignore_errors=True)
+  tags.write_col_tags(cursor)
+
+  if num_ids > 1:
+    # consume the ids the shards used, after the one taken above
+    next(itertools.islice(id_gen, num_ids - 1, num_ids - 1), None)
+  return num_notes, num_ids - num_notes
+
+
+def _build_shard(args):
+  """
+  Worker process: writes (deck id, note) pairs into a new database at `shard_path`, with ids counting up from 0.
+
+  :return: (shard_path, number of notes, number of ids used, sorted list of the tags used, list of (message, category)
+      for each warning raised)
+  """
+  shard_path, deck_notes, first_note_index, timestamp, html_validation = args
+  conn = sqlite3.connect(shard_path)
+  try:
+    cursor = conn.cursor()
+    # shards are only read once, by the merge, so they get no indexes
+    cursor.executescript(APKG_BUILD_PRAGMAS)
+    cursor.executescript(APKG_TABLES)
+    id_gen = itertools.count(0)
+    batch_writer = BatchWriter(cursor, html_validation=html_validation)
+    # so that "sampled" HTML validation picks the same notes as a single-process build
+    batch_writer._num_notes = first_note_index
+
+    with warnings.catch_warnings(record=True) as caught:
+      warnings.simplefilter('always')
+      for deck_id, note in deck_notes:
+        if isinstance(note, tuple) and note[0] is None:
+          batch_writer.add_rows(note[1], [note[2:]], timestamp, deck_id, id_gen)
+        else:
+          batch_writer.add_note(_unpack_note(note), timestamp, deck_id, id_gen)
+    batch_writer.flush()
+    conn.commit()
+  finally:
+    conn.close()
+
+  return shard_path, len(deck_notes), next(id_gen), batch_writer.tags.names(), [(str(w.message), w.category) for w in caught]
+
+
+def _pack_deck_notes(deck):
+  """
+  Yields (deck id, packed note) for each note of `deck`, in the order a single-process build writes them. Notes added
+  with add_notes_from_columns are packed as (None, model id, *row), with row as yielded by NoteColumns.rows().
+  """
+  deck_id = deck.deck_id
+  for note in deck.notes:
+    yield deck_id, _pack_note(note)
+  for columns in deck.note_columns:
+    model_id = columns.model.model_id
+    for row in columns.rows():
+      yield deck_id, (None, model_id) + row
+
+
+def _pack_note(note):
+  """
+  Plain Notes are sent to workers as tuples, which pickle several times faster. Instances of subclasses (which may
+  override guid, cards, etc.) are sent as they are. If a Note's cards have already been generated, they are sent along,
+  since they may have been changed (e.g. `note.cards[1].suspend = True`).
+  """
+  if type(note) is not Note:
+    return note
+  return (note.model, note.fields, note._sort_field, list(note.tags), note._guid, note.due, note.__dict__.get('cards'))
+
+
+def _unpack_note(packed):
+  if not isinstance(packed, tuple):
+    return packed
+  model, fields, sort_field, tags, guid, due, cards = packed
+  note = Note(model, fields, sort_field, tags, guid, due)
+  if cards is not None:
+    note.cards = cards
+  return note
@@ -0,0 +1,302 @@
+"""
+Builds a .apkg from a CSV, TSV or JSON Lines file (see `python -m genanki build --help`).
+
+The input is read a chunk of rows at a time. Each chunk is turned into NoteColumns (optionally on worker processes) and
+written with a PackageWriter, so memory use doesn't grow with the size of the input.
+"""
+import collections
+import concurrent.futures
+import csv
+import hashlib
+import itertools
+import json
+import os
+import warnings
+
+from .deck import Deck
+from .model import Model
+from .util import guid_for_many
+
+FORMATS = ('csv', 'tsv', 'jsonl')
+DEFAULT_CHUNK_SIZE = 1000
+# Chunks submitted to the workers ahead of the one being written, per worker. Bounds memory use while keeping the
+# workers busy.
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+_MODEL_TYPES = {'front_back': Model.FRONT_BACK, 'cloze': Model.CLOZE}
+
+
+def guess_format(path):
+  """
+  Returns the format ('csv', 'tsv' or 'jsonl') of the file at `path`, going by its extension.
+  """
+  ext = os.path.splitext(path)[1].lower().lstrip('.')
+  if ext in ('jsonl', 'ndjson'):
+    return 'jsonl'
+  if ext in ('tsv', 'tab'):
+    return 'tsv'
+  if ext == 'csv':
+    return 'csv'
+  raise ValueError('Can\'t tell the format of {!r} from its extension; pass it explicitly.'.format(path))
+
+
+def iter_records(file, format):
+  """
+  Yields each record of the text file object `file` as a dict of column name -> value. CSV and TSV files must start with
+  a header row naming the columns; JSON Lines files hold one JSON object per line.
+  """
+  if format == 'jsonl':
+    for line_number, line in enumerate(file, 1):
+      if not line.strip():
+        continue
+      record = json.loads(line)
+      if not isinstance(record, dict):
+        raise ValueError('Line {} is not a JSON object.'.format(line_number))
+      yield record
+  elif format in ('csv', 'tsv'):
+    yield from csv.DictReader(file, dialect='excel-tab' if format == 'tsv' else 'excel')
+  else:
+    raise ValueError('format must be one of {}, not {!r}.'.format(', '.join(FORMATS), format))
+
+
+def load_model(spec):
+  """
+  Returns the model named by `spec`: either the name of a builtin model (e.g. "BASIC_MODEL" or "cloze_model"), or the
+  path of a YAML file like this one:
+
+    id: 1607392319
+    name: Simple Model
+    type: front_back  # or cloze
+    css: '.card { font-family: arial; }'
+    sort_field_index: 0
+    fields:
+      - name: Question
+      - name: Answer
+    templates:
+      - name: Card 1
+        qfmt: '{{Question}}'
+        afmt: '{{FrontSide}}<hr id="answer">{{Answer}}'
+
+  Raises ValueError if `spec` is neither, or if the YAML file can't be parsed.
+  """
+  from . import builtin_models
+
+  builtin = getattr(builtin_models, spec.upper(), None)
+  if spec.upper().endswith('_MODEL') and isinstance(builtin, Model):
+    return builtin
+
+  import yaml  # slow to import, and only needed here
+
+  try:
+    with open(spec, encoding='utf-8') as h:
+      doc = yaml.safe_load(h)
+  except FileNotFoundError:
+    raise ValueError('{!r} is neither a builtin model ({}) nor a YAML file.'.format(
+      spec, ', '.join(_builtin_model_names()))) from None
+  except yaml.YAMLError as e:
+    raise ValueError('{} is not valid YAML: {}'.format(spec, e)) from None
+  if not isinstance(doc, dict):
+    raise ValueError('{} should hold a YAML mapping with id, name, fields and templates.'.format(spec))
+  missing = [key for key in ('id', 'name', 'fields', 'templates') if key not in doc]
+  if missing:
+    raise ValueError('{} is missing {}.'.format(spec, ', '.join(missing)))
+  model_type = doc.get('type', 'front_back')
+  if model_type not in _MODEL_TYPES:
+    raise ValueError('{}: type must be one of {}, not {!r}.'.format(spec, ', '.join(_MODEL_TYPES), model_type))
+
+  model = Model(
+    doc['id'], doc['name'], css=doc.get('css', ''), model_type=_MODEL_TYPES[model_type],
+    sort_field_index=doc.get('sort_field_index', 0))
+  model.set_fields(doc['fields'])
+  model.set_templates(doc['templates'])
+  return model
+
+
+def _builtin_model_names():
+  """
+  Returns the names of the builtin models that load_model accepts, e.g. "BASIC_MODEL".
+  """
+  from . import builtin_models
+
+  return sorted(
+    name for name, value in vars(builtin_models).items() if name.endswith('_MODEL') and isinstance(value, Model))
+
+
+def deck_id_for_name(name):
+  """
+  Returns a deck id derived from the deck's name, so that rebuilding a package gives each deck the same id. Ids are in
+  [2**30, 2**31), like the ones the README suggests generating.
+  """
+  digest = hashlib.sha256(name.encode('utf-8')).digest()
+  return (1 << 30) + int.from_bytes(digest[:4], 'big') % (1 << 30)
+
+
+def write_table_to_package(records, output, model, deck_name, field_columns=None, deck_id=None, deck_column=None,
+                           tags_column=None, guid_column=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                           html_validation='full', timestamp=None, compression=None):
+  """
+  Writes a note of `model` for each record of `records` into a new .apkg.
+
+  :param records: Iterable of dicts of column name -> value, e.g. from iter_records. It is consumed lazily.
+  :param output: File path or binary file object to write the .apkg to.
+  :param field_columns: The column holding each of the model's fields, in order. Defaults to columns named after the
+      fields.
+  :param deck_id: Id of the deck called `deck_name`. Defaults to one derived from the name.
+  :param deck_column: Optional column naming a subdeck of `deck_name` for each note (rows where it is empty go into
+      `deck_name` itself). Subdeck ids are derived from their names.
+  :param tags_column: Optional column holding each note's tags: a string of space-separated tags, or (in JSON Lines) a
+      list of strings.
+  :param guid_column: Optional column holding each note's guid. Where it's empty, the guid is computed from the fields.
+  :param workers: Number of processes to prepare rows on (validating fields, computing guids and cards). Rows are
+      still written in input order.
+  :param html_validation: See Deck.add_notes_from_columns.
+  :param timestamp: See Package.write_to_file.
+  :param compression: See Package.write_to_file.
+  :return: The number of notes written.
+  """
+  from .package_writer import PackageWriter
+
+  if field_columns is None:
+    field_columns = [field['name'] for field in model.fields]
+  if len(field_columns) != len(model.fields):
+    raise ValueError('Expected {} field columns for {}, got {}.'.format(
+      len(model.fields), model.name, len(field_columns)))
+  reader = _RowReader(field_columns, deck_column, tags_column, guid_column)
+
+  decks = {}
+  def deck_for(subdeck_name):
+    name = deck_name if not subdeck_name else '{}::{}'.format(deck_name, subdeck_name)
+    deck = decks.get(name)
+    if deck is None:
+      deck = decks[name] = Deck(deck_id if name == deck_name and deck_id is not None else deck_id_for_name(name), name)
+    return deck
+
+  rows = (reader.row(record) for record in records)
+  chunks = iter(lambda: list(itertools.islice(rows, chunk_size)), [])
+  num_notes = 0
+  with PackageWriter(output, timestamp=timestamp, compression=compression) as writer:
+    for prepared in _prepare_chunks(chunks, model, html_validation, workers):
+      for subdeck_name, columns in prepared:
+        writer.add_note_columns(deck_for(subdeck_name), columns)
+        num_notes += len(columns)
+    if not decks:
+      writer.add_deck(deck_for(None))
+  return num_notes
+
+
+class _RowReader:
+  """
+  Turns a record into a (subdeck name, fields, tags, guid) tuple.
+  """
+  def __init__(self, field_columns, deck_column, tags_column, guid_column):
+    self.field_columns = field_columns
+    self.deck_column = deck_column
+    self.tags_column = tags_column
+    self.guid_column = guid_column
+    self._checked = False
+
+  def row(self, record):
+    if not self._checked:
+      # checked on the first record only: later CSV records have the same keys, and JSON Lines records may leave out
+      # optional values
+      columns = list(self.field_columns) + [
+        column for column in (self.deck_column, self.tags_column, self.guid_column) if column is not None]
+      missing = [column for column in columns if column not in record]
+      if missing:
+        raise ValueError('Column(s) not found in input: {}. Found: {}.'.format(
+          ', '.join(missing), ', '.join(map(str, record))))
+      self._checked = True
+
+    fields = tuple(_to_str(record.get(column)) for column in self.field_columns)
+    subdeck_name = _to_str(record.get(self.deck_column)) if self.deck_column is not None else ''
+    tags = ()
+    if self.tags_column is not None:
+      tags = record.get(self.tags_column) or ()
+      if isinstance(tags, str):
+        tags = tags.split()
+    guid = _to_str(record.get(self.guid_column)) if self.guid_column is not None else ''
+    return subdeck_name, fields, tuple(tags), guid
+
+
+def _to_str(value):
+  if value is None:
+    return ''
+  return value if isinstance(value, str) else str(value)
+
+
+def _prepare_chunks(chunks, model, html_validation, workers):
+  """
+  Yields _prepare_chunk(chunk) for each chunk, in order, computed on `workers` processes if workers > 1.
+  """
+  if workers is None or workers <= 1:
+    for chunk in chunks:
+      yield _prepare_chunk(chunk, model, html_validation)
+    return
+
+  with concurrent.futures.ProcessPoolExecutor(
+      workers, initializer=_init_worker, initargs=(model, html_validation)) as executor:
+    pending = collections.deque()
+    for chunk in chunks:
+      pending.append(executor.submit(_prepare_chunk_in_worker, chunk))
+      if len(pending) >= workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+        yield _result_with_warnings(pending.popleft(), model)
+    while pending:
+      yield _result_with_warnings(pending.popleft(), model)
+
+
+def _prepare_chunk(chunk, model, html_validation):
+  """
+  Returns a list of (subdeck name, NoteColumns), one for each run of consecutive rows in the same subdeck, so that
+  notes keep their input order.
+  """
+  from .note_columns import NoteColumns
+
+  prepared = []
+  for subdeck_name, run in itertools.groupby(chunk, key=lambda row: row[0]):
+    run = list(run)
+    fields = [row[1] for row in run]
+    columns = NoteColumns(model, list(zip(*fields)), tags=[row[2] for row in run], guids=_guids(run),
+                          html_validation=html_validation)
+    prepared.append((subdeck_name, columns))
+  return prepared
+
+
+def _guids(run):
+  """
+  Returns the guids of the rows in `run`, computing those the input leaves empty from the fields in one batch. Returns
+  None if every row needs one computed, which lets NoteColumns compute them all.
+  """
+  explicit = [row[3] for row in run]
+  missing = [i for i, guid in enumerate(explicit) if not guid]
+  if len(missing) == len(explicit):
+    return None
+  for i, guid in zip(missing, guid_for_many(run[i][1] for i in missing)):
+    explicit[i] = guid
+  return explicit
+
+
+_worker_state = {}
+
+
+def _init_worker(model, html_validation):
+  _worker_state['model'] = model
+  _worker_state['html_validation'] = html_validation
+
+
+def _prepare_chunk_in_worker(chunk):
+  with warnings.catch_warnings(record=True) as caught:
+    warnings.simplefilter('always')
+    prepared = _prepare_chunk(chunk, _worker_state['model'], _worker_state['html_validation'])
+  # the parent has the model already; don't pickle it again for every chunk
+  for _, columns in prepared:
+    columns.model = None
+  return prepared, [(str(w.message), w.category) for w in caught]
+
+
+def _result_with_warnings(future, model):
+  prepared, caught_warnings = future.result()
+  for message, category in caught_warnings:
+    warnings.warn(message, category)
+  for _, columns in prepared:
+    columns.model = model
+  return prepared
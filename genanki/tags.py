@@ -0,0 +1,108 @@
+"""
+Validating, interning and formatting note tags.
+
+Packages typically reuse a few hundred distinct tags across many notes. A TagRegistry validates each distinct tag once,
+keeps one copy of it that every note shares, formats each distinct set of tags once, and collects the tags used so that
+they can be listed in the collection's col.tags.
+
+Notes' tag lists share one registry for the whole process, which keeps up to TagRegistry.MAX_CACHED tags alive. A
+long-running process that builds many unrelated packages can call reset_interned_tags() between them to let go of
+those tags.
+"""
+import json
+
+
+def validate_tag(tag):
+  if ' ' in tag:
+    raise ValueError('Tag "{}" contains a space; this is not allowed!'.format(tag))
+
+
+class TagRegistry:
+  """
+  Validates, interns and formats tags. Each BatchWriter has one, which collects the tags of the notes it writes for
+  col.tags.
+  """
+  # Past this many distinct tag sets (or, if the registry doesn't collect, distinct tags), new ones are still
+  # validated, but not cached. Keeps a registry that sees e.g. a unique tag per note from holding on to a copy of each.
+  MAX_CACHED = 100000
+
+  def __init__(self, collect: bool = True):
+    """
+    :param collect: Whether to remember every tag for names() and write_col_tags(). A collecting registry keeps every
+        distinct tag, however many there are: col.tags has to list them all anyway, so its memory use grows with the
+        number of distinct tags (not with the number of notes).
+    """
+    self.collect = collect
+    self._tags = {}  # each validated tag -> the copy of it that is handed out
+    self._formatted = {}  # tuple of tags, or formatted string -> formatted string
+
+  def intern(self, tag):
+    """
+    Validates `tag` and returns the registry's copy of it.
+    """
+    interned = self._tags.get(tag)
+    if interned is None:
+      validate_tag(tag)
+      if not self.collect and len(self._tags) >= self.MAX_CACHED:
+        return tag
+      interned = self._tags[tag] = tag
+    return interned
+
+  def format(self, tags):
+    """
+    Returns `tags` (an iterable of tags) formatted as the notes table stores them: ' tag1 tag2 '.
+    """
+    key = tuple(tags)
+    formatted = self._formatted.get(key)
+    if formatted is None:
+      formatted = ' ' + ' '.join([self.intern(tag) for tag in key]) + ' '
+      self._cache_formatted(key, formatted)
+    return formatted
+
+  def add_formatted(self, formatted):
+    """
+    Collects the tags in `formatted`, a string as returned by format(), e.g. from a row written without a Note.
+    """
+    if formatted not in self._formatted:
+      for tag in formatted.split():
+        self.intern(tag)
+      self._cache_formatted(formatted, formatted)
+
+  def clear(self):
+    """
+    Forgets every tag and tag set seen so far.
+    """
+    self._tags.clear()
+    self._formatted.clear()
+
+  def update(self, tags):
+    for tag in tags:
+      self.intern(tag)
+
+  def _cache_formatted(self, key, formatted):
+    if len(self._formatted) < self.MAX_CACHED:
+      self._formatted[key] = formatted
+
+  def names(self):
+    """
+    Returns every tag seen so far, sorted.
+    """
+    return sorted(self._tags)
+
+  def write_col_tags(self, cursor):
+    """
+    Lists every tag seen so far in col.tags, in a single UPDATE.
+    """
+    cursor.execute('UPDATE col SET tags = ?', (json.dumps({tag: 0 for tag in self.names()}),))
+
+
+# shared by every Note's tag list, so that notes with the same tags share the tag strings
+_NOTE_TAGS = TagRegistry(collect=False)
+
+
+def reset_interned_tags():
+  """
+  Empties the registry that Notes' tags are interned in. Existing notes keep their tags; tags added afterwards are
+  validated and interned afresh.
+  """
+  _NOTE_TAGS.clear()
@@ -0,0 +1,98 @@
+"""
+Hooks for timing the phases of a build. Pass a Tracer as `tracer=` to Package.write_to_file or Package.write_to_db:
+
+  tracer = genanki.SummaryTracer()
+  my_package.write_to_file('output.apkg', tracer=tracer)
+  print(tracer.summary())
+
+Phases (with the keyword arguments they are reported with):
+
+- write_to_file: the whole of Package.write_to_file.
+- build: building the collection database (write_to_db, or the incremental build with cache_dir).
+- schema: creating the tables.
+- col_json: writing the deck and model JSON (decks, models).
+- deck: writing the notes of one deck (deck_id, name, notes, cards). Not reported when building with workers.
+- notes: writing all notes (notes, cards).
+- card_generation: time spent computing Note.cards, summed over all notes. It happens inside the notes phase, and is
+  reported with a single end() call, after the notes phase ends.
+- indexes: creating the indexes, once the notes and cards are in.
+- serialize: copying an in-memory database into bytes (bytes).
+- zip_collection: adding the collection to the .apkg (bytes).
+- media: checking media files for duplicates (files).
+- zip_media: adding media files to the .apkg (files, bytes).
+
+Without a tracer, none of this is measured.
+"""
+import contextlib
+import time
+
+
+class Tracer:
+  """
+  Base class for tracers. Override start() and/or end().
+  """
+  def start(self, phase: str, **info):
+    """
+    Called when `phase` starts. `info` holds what is known about the phase up front (e.g. deck_id).
+    """
+
+  def end(self, phase: str, duration: float, **info):
+    """
+    Called when `phase` ends, with its duration in seconds. `info` holds the start() info plus counts (notes, cards,
+    files, bytes) where they apply.
+    """
+
+
+class SummaryTracer(Tracer):
+  """
+  Adds up the durations and counts of each phase. summary() returns them as a dict:
+
+    {
+      'phases': {'notes': {'calls': 1, 'seconds': 1.2, 'notes': 10000, 'cards': 20000}, ...},
+      'decks': {1234: {'name': 'My deck', 'seconds': 1.2, 'notes': 10000, 'cards': 20000}, ...},
+    }
+  """
+  _COUNTS = ('notes', 'cards', 'files', 'bytes', 'decks', 'models')
+
+  def __init__(self):
+    self._phases = {}
+    self._decks = {}
+
+  def end(self, phase, duration, **info):
+    totals = self._phases.setdefault(phase, {'calls': 0, 'seconds': 0.0})
+    totals['calls'] += 1
+    totals['seconds'] += duration
+    self._add_counts(totals, info)
+
+    if phase == 'deck':
+      deck_totals = self._decks.setdefault(info['deck_id'], {'name': info.get('name'), 'seconds': 0.0})
+      deck_totals['seconds'] += duration
+      self._add_counts(deck_totals, info)
+
+  def _add_counts(self, totals, info):
+    for key in self._COUNTS:
+      if key in info:
+        totals[key] = totals.get(key, 0) + info[key]
+
+  def summary(self):
+    return {
+      'phases': {phase: dict(totals) for phase, totals in self._phases.items()},
+      'decks': {deck_id: dict(totals) for deck_id, totals in self._decks.items()},
+    }
+
+
+@contextlib.contextmanager
+def trace(tracer, phase, **info):
+  """
+  Reports the `with` block as `phase` to `tracer` (which may be None). Yields the `info` dict; add counts to it inside
+  the block and they are passed to tracer.end().
+  """
+  if tracer is None:
+    yield info
+    return
+  tracer.start(phase, **info)
+  start = time.perf_counter()
+  try:
+    yield info
+  finally:
+    tracer.end(phase, time.perf_counter() - start, **info)
@@ -22,11 +22,15 @@ setup(name='genanki',
       include_package_data=True,
       python_requires='>=3.8',
       install_requires=[
-        'cached-property',
         'frozendict',
         'chevron',
         'pyyaml',
       ],
+      entry_points={
+        'console_scripts': [
+          'genanki = genanki.__main__:main',
+        ],
+      },
       setup_requires=[
           'pytest-runner',
       ],
@@ -0,0 +1,57 @@
+import itertools
+import sqlite3
+
+import genanki
+from genanki.apkg_col import APKG_COL
+from genanki.apkg_schema import APKG_SCHEMA
+from genanki.batch_writer import BatchWriter
+
+
+def _make_deck():
+  deck = genanki.Deck(1347617346, 'batch deck')
+  for i in range(25):
+    deck.add_note(genanki.Note(genanki.BASIC_AND_REVERSED_CARD_MODEL, ['front {}'.format(i), 'back {}'.format(i)],
+                               tags=['tag{}'.format(i % 3)], due=i))
+  deck.add_note(genanki.Note(genanki.CLOZE_MODEL, ['{{c1::Rome}} is the capital of {{c2::Italy}}', '']))
+  return deck
+
+
+def _dump(cursor):
+  return (
+    cursor.execute('SELECT * FROM notes ORDER BY id').fetchall(),
+    cursor.execute('SELECT * FROM cards ORDER BY id').fetchall(),
+  )
+
+
+def _fresh_cursor():
+  cursor = sqlite3.connect(':memory:').cursor()
+  cursor.executescript(APKG_SCHEMA)
+  cursor.executescript(APKG_COL)
+  return cursor
+
+
+def test_batched_rows_match_per_row_inserts():
+  unbatched = _fresh_cursor()
+  _make_deck().write_to_db(unbatched, 1600000000, itertools.count(1600000000000))
+
+  batched = _fresh_cursor()
+  # use a small chunk size so that several flushes happen
+  batch_writer = BatchWriter(batched, chunk_size=7)
+  _make_deck().write_to_db(batched, 1600000000, itertools.count(1600000000000), batch_writer)
+  batch_writer.flush()
+
+  assert _dump(batched) == _dump(unbatched)
+  assert len(_dump(batched)[0]) == 26
+  assert len(_dump(batched)[1]) == 52
+
+
+def test_note_ids_come_from_id_gen():
+  cursor = _fresh_cursor()
+  batch_writer = BatchWriter(cursor)
+  _make_deck().write_to_db(cursor, 0, itertools.count(100), batch_writer)
+  batch_writer.flush()
+
+  notes, cards = _dump(cursor)
+  assert notes[0][0] == 100
+  assert [card[0] for card in cards[:2]] == [101, 102]
+  assert {card[1] for card in cards[:2]} == {100}
@@ -0,0 +1,40 @@
+import importlib.util
+import json
+import os
+
+import pytest
+
+_RUN_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks', 'run.py')
+
+
+@pytest.fixture(scope='module')
+def run():
+  spec = importlib.util.spec_from_file_location('benchmarks_run', _RUN_PY)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+
+def test_parse_size(run):
+  assert run._parse_size('10k') == 10000
+  assert run._parse_size('1M') == 1000000
+  assert run._parse_size('123') == 123
+
+
+def test_run_and_compare(run, tmp_path, capsys):
+  baseline_path = str(tmp_path / 'baseline.json')
+  args = ['--sizes', '20', '--repeat', '1', '--media-files', '2', '--media-size', '100']
+  assert run.main(args + ['--output', baseline_path]) == 0
+
+  with open(baseline_path) as h:
+    baseline = json.load(h)
+  assert set(baseline['results']) >= {
+    'import', 'note_cards/front_back/20', 'model_req', 'guid_for/front_back/20', 'html_check/cloze/20',
+    'write_to_db/many_decks/20', 'zip/front_back/20'}
+
+  # make one benchmark look much faster in the baseline, so that it's reported as a regression
+  baseline['results']['write_to_db/cloze/20']['seconds'] /= 1000
+  with open(baseline_path, 'w') as h:
+    json.dump(baseline, h)
+  assert run.main(args + ['--only', 'write_to_db', '--compare', baseline_path]) == 1
+  assert 'write_to_db/cloze/20' in capsys.readouterr().out
@@ -0,0 +1,159 @@
+import json
+import os
+from unittest import mock
+
+import pytest
+
+import genanki
+from genanki import build_cache
+from tests.test_package import _read_apkg_collection
+
+
+def _deck(fronts, deck_id=1450921570):
+  deck = genanki.Deck(deck_id, 'cached deck')
+  for front in fronts:
+    deck.add_note(genanki.Note(genanki.BASIC_MODEL, [front, 'back of ' + front], guid=front))
+  return deck
+
+
+def _build(tmp_path, deck, name, timestamp=1600000000):
+  path = str(tmp_path / name)
+  genanki.Package(deck).write_to_file(path, timestamp=timestamp, cache_dir=str(tmp_path / 'cache'))
+  return _read_apkg_collection(path)
+
+
+def test_first_build_matches_uncached(tmp_path):
+  _build(tmp_path, _deck(['a', 'b', 'c']), 'cached.apkg')
+  genanki.Package(_deck(['a', 'b', 'c'])).write_to_file(str(tmp_path / 'plain.apkg'), timestamp=1600000000)
+
+  assert _read_apkg_collection(str(tmp_path / 'cached.apkg')) == _read_apkg_collection(str(tmp_path / 'plain.apkg'))
+
+
+def test_only_changed_notes_are_written(tmp_path):
+  (notes1, cards1, _), _ = _build(tmp_path, _deck(['a', 'b', 'c']), 'first.apkg')
+
+  deck = _deck(['a', 'c', 'd'])
+  deck.notes[1].fields[1] = 'new back of c'
+  with mock.patch.object(genanki.package_updater.CollectionUpdater, 'upsert_note',
+                         autospec=True, side_effect=genanki.package_updater.CollectionUpdater.upsert_note) as upsert:
+    (notes2, cards2, _), _ = _build(tmp_path, deck, 'second.apkg', timestamp=1700000000)
+  assert sorted(call.args[2].guid for call in upsert.call_args_list) == ['c', 'd']
+
+  before = {note[1]: note for note in notes1}
+  after = {note[1]: note for note in notes2}
+  assert sorted(after) == ['a', 'c', 'd']
+  assert after['a'] == before['a']
+  assert after['c'][0] == before['c'][0]
+  assert after['c'][6] == 'c\x1fnew back of c'
+  assert after['c'][3] == 1700000000
+  assert len(cards2) == 3
+
+
+def test_unchanged_rebuild_is_identical(tmp_path):
+  _build(tmp_path, _deck(['a', 'b']), 'first.apkg')
+  _build(tmp_path, _deck(['a', 'b']), 'second.apkg')
+
+  assert _read_apkg_collection(str(tmp_path / 'first.apkg')) == _read_apkg_collection(str(tmp_path / 'second.apkg'))
+
+
+def test_model_change_rewrites_notes(tmp_path):
+  _build(tmp_path, _deck(['a']), 'first.apkg')
+
+  deck = genanki.Deck(1450921570, 'cached deck')
+  deck.add_note(genanki.Note(genanki.BASIC_AND_REVERSED_CARD_MODEL, ['a', 'back of a'], guid='a'))
+  (notes, cards, _), _ = _build(tmp_path, deck, 'second.apkg')
+
+  assert notes[0][2] == genanki.BASIC_AND_REVERSED_CARD_MODEL.model_id
+  assert sorted(card[3] for card in cards) == [0, 1]
+
+
+def test_stale_cache_version_is_ignored(tmp_path):
+  _build(tmp_path, _deck(['a', 'b']), 'first.apkg')
+
+  with mock.patch.object(build_cache, '_CACHE_VERSION', build_cache._CACHE_VERSION + 1):
+    with mock.patch.object(genanki.package_updater.CollectionUpdater, 'upsert_note',
+                           autospec=True, side_effect=genanki.package_updater.CollectionUpdater.upsert_note) as upsert:
+      _build(tmp_path, _deck(['a', 'b']), 'second.apkg')
+  assert upsert.call_count == 2
+
+
+def test_failed_build_keeps_cache(tmp_path):
+  _build(tmp_path, _deck(['a']), 'first.apkg')
+  cache = build_cache.BuildCache(str(tmp_path / 'cache'), [_deck([])])
+  fingerprints = cache.load_fingerprints()
+
+  deck = _deck(['a', 'b'])
+  deck.notes[1].fields.append('one field too many')
+  with pytest.raises(ValueError):
+    _build(tmp_path, deck, 'second.apkg')
+
+  assert cache.load_fingerprints() == fingerprints
+  assert [name for name in os.listdir(cache.dir) if name.endswith('.tmp')] == []
+
+
+def test_in_memory_not_allowed(tmp_path):
+  with pytest.raises(ValueError):
+    genanki.Package(_deck(['a'])).write_to_file(
+      str(tmp_path / 'out.apkg'), in_memory=True, cache_dir=str(tmp_path / 'cache'))
+
+
+def test_workers_not_allowed(tmp_path):
+  with pytest.raises(ValueError, match='workers and cache_dir'):
+    genanki.Package(_deck(['a'])).write_to_file(
+      str(tmp_path / 'out.apkg'), workers=2, cache_dir=str(tmp_path / 'cache'))
+  assert not os.path.exists(str(tmp_path / 'out.apkg'))
+
+  # one worker is the same as none
+  genanki.Package(_deck(['a'])).write_to_file(str(tmp_path / 'out.apkg'), workers=1, cache_dir=str(tmp_path / 'cache'))
+  assert os.path.exists(str(tmp_path / 'out.apkg'))
+
+
+def test_fingerprint_file(tmp_path):
+  _build(tmp_path, _deck(['a', 'b']), 'first.apkg')
+  cache = build_cache.BuildCache(str(tmp_path / 'cache'), [_deck([])])
+  with open(cache.fingerprints_path) as h:
+    data = json.load(h)
+  assert data['version'] == build_cache._CACHE_VERSION
+  assert sorted(data['notes']) == ['a', 'b']
+
+
+def test_suspending_cards_rewrites_notes(tmp_path):
+  def deck():
+    deck = genanki.Deck(1450921570, 'cached deck')
+    for front in ['a', 'b', 'c']:
+      deck.add_note(genanki.Note(genanki.BASIC_AND_REVERSED_CARD_MODEL, [front, 'back of ' + front], guid=front))
+    return deck
+
+  _build(tmp_path, deck(), 'first.apkg')
+  suspended = deck()
+  for note in suspended.notes[:2]:
+    note.cards[1].suspend = True
+  (_, cards, _), _ = collection = _build(tmp_path, suspended, 'second.apkg')
+  assert sum(1 for card in cards if card[7] == -1) == 2
+
+  genanki.Package(suspended).write_to_file(str(tmp_path / 'plain.apkg'), timestamp=1600000000)
+  assert collection == _read_apkg_collection(str(tmp_path / 'plain.apkg'))
+
+
+def test_wrong_number_of_fields(tmp_path):
+  deck = genanki.Deck(1450921570, 'cached deck')
+  deck.add_note(genanki.Note(genanki.BASIC_AND_REVERSED_CARD_MODEL, ['only one field']))
+  with pytest.raises(ValueError, match='Number of fields'):
+    _build(tmp_path, deck, 'out.apkg')
+
+
+def test_crash_during_commit_keeps_collection_and_fingerprints_together(tmp_path):
+  (first, _, _), _ = _build(tmp_path, _deck(['a', 'b']), 'first.apkg')
+
+  changed = _deck(['a', 'b'])
+  changed.notes[1].fields[1] = 'changed'
+  with mock.patch.object(build_cache.json, 'dump', side_effect=OSError('disk full')):
+    with pytest.raises(OSError):
+      _build(tmp_path, changed, 'second.apkg')
+
+  # b is back to what the cached fingerprints say; it must also be what the cached collection holds
+  (notes, _, _), _ = _build(tmp_path, _deck(['a', 'b']), 'third.apkg')
+  assert notes == first
+  cache_dir = build_cache.BuildCache(str(tmp_path / 'cache'), [_deck([])]).dir
+  assert [name for name in os.listdir(cache_dir) if name.endswith('.tmp')] == []
+  assert len([name for name in os.listdir(cache_dir) if name.endswith('.anki2')]) == 1
@@ -133,5 +133,41 @@ def test_cloze_newlines_in_deletion():
   assert sorted(card.ord for card in note.cards) == [0, 1]
 
 
+def test_cloze_field_indexes_cached_on_model():
+  model = Model(
+    1817438471,
+    'Cached Cloze Model',
+    fields=[{'name': 'Text1'}, {'name': 'Text2'}],
+    templates=[{'name': 'Cloze', 'qfmt': '{{cloze:Text2}}', 'afmt': '{{cloze:Text2}}'}],
+    model_type=Model.CLOZE)
+  assert model._cloze_field_indexes == [1]
+  assert model._cloze_field_indexes is model._cloze_field_indexes
+
+  note = Note(model=model, fields=['{{c1::a}}', '{{c2::b}} {{c3::c}}'])
+  assert sorted(card.ord for card in note.cards) == [1, 2]
+
+
+def test_cloze_field_indexes_invalidated():
+  model = Model(
+    1817438472,
+    'Cached Cloze Model',
+    fields=[{'name': 'Text1'}, {'name': 'Text2'}],
+    templates=[{'name': 'Cloze', 'qfmt': '{{cloze:Text2}}', 'afmt': '{{cloze:Text2}}'}],
+    model_type=Model.CLOZE)
+  assert model._cloze_field_indexes == [1]
+
+  model.templates = [{'name': 'Cloze', 'qfmt': '{{cloze:Text1}} <%cloze:Text2%>', 'afmt': ''}]
+  assert model._cloze_field_indexes == [0, 1]
+
+  model.set_fields([{'name': 'Text2'}, {'name': 'Other'}])
+  assert model._cloze_field_indexes == [0]
+
+
+def test_cloze_c0_ignored():
+  fields = ['{{c0::zero}} {{c10::ten}}', '']
+  note = Note(model=MY_CLOZE_MODEL, fields=fields)
+  assert [card.ord for card in note.cards] == [9]
+
+
 if __name__ == '__main__':
   test_cloze(len(sys.argv) != 1)
@@ -0,0 +1,84 @@
+import json
+import zipfile
+
+import pytest
+
+import genanki
+
+MP3_BYTES = b'\xff\xfb\x90\x64' + bytes(200)
+JPG_BYTES = b'\xff\xd8\xff\xdb' + bytes(200)
+HTML_BYTES = b'<div class="x">hello</div>\n' * 50
+
+
+@pytest.fixture
+def media(tmp_path):
+  paths = {}
+  for name, data in [('sound.mp3', MP3_BYTES), ('image.jpg', JPG_BYTES), ('snippet.html', HTML_BYTES),
+                     ('noext_audio', MP3_BYTES), ('noext_text', HTML_BYTES)]:
+    path = tmp_path / name
+    path.write_bytes(data)
+    paths[name] = str(path)
+  return paths
+
+
+def _compress_types(apkg_path):
+  with zipfile.ZipFile(apkg_path) as z:
+    media = z.read('media')
+    names = {str(idx): name for idx, name in json.loads(media).items()}
+    return {names.get(info.filename, info.filename): info.compress_type for info in z.infolist()}
+
+
+class TestCompressionPolicy:
+  def test_by_extension(self, media):
+    policy = genanki.CompressionPolicy()
+    assert policy.compress_type_for_media(media['sound.mp3']) == zipfile.ZIP_STORED
+    assert policy.compress_type_for_media(media['image.jpg']) == zipfile.ZIP_STORED
+    assert policy.compress_type_for_media(media['snippet.html']) == zipfile.ZIP_DEFLATED
+
+  def test_by_magic_bytes(self, media):
+    policy = genanki.CompressionPolicy()
+    assert policy.compress_type_for_media(media['noext_audio']) == zipfile.ZIP_STORED
+    assert policy.compress_type_for_media(media['noext_text']) == zipfile.ZIP_DEFLATED
+
+  def test_override(self, media):
+    policy = genanki.CompressionPolicy(overrides={'sound.mp3': zipfile.ZIP_DEFLATED,
+                                                  media['snippet.html']: zipfile.ZIP_STORED})
+    assert policy.compress_type_for_media(media['sound.mp3']) == zipfile.ZIP_DEFLATED
+    assert policy.compress_type_for_media(media['snippet.html']) == zipfile.ZIP_STORED
+
+
+def _make_deck():
+  deck = genanki.Deck(1234567890, 'compressed deck')
+  for i in range(100):
+    deck.add_note(genanki.Note(genanki.BASIC_MODEL, ['question {}'.format(i), 'answer {}'.format(i)]))
+  return deck
+
+
+@pytest.mark.parametrize('in_memory', [False, True])
+def test_package_uses_policy(tmp_path, media, in_memory):
+  out = str(tmp_path / 'out.apkg')
+  genanki.Package(_make_deck(), media_files=list(media.values())).write_to_file(
+    out, in_memory=in_memory, compression=genanki.CompressionPolicy(level=9))
+
+  types = _compress_types(out)
+  assert types['collection.anki2'] == zipfile.ZIP_DEFLATED
+  assert types['sound.mp3'] == zipfile.ZIP_STORED
+  assert types['image.jpg'] == zipfile.ZIP_STORED
+  assert types['snippet.html'] == zipfile.ZIP_DEFLATED
+
+
+def test_default_stores_everything(tmp_path, media):
+  out = str(tmp_path / 'out.apkg')
+  genanki.Package(_make_deck(), media_files=list(media.values())).write_to_file(out)
+
+  assert set(_compress_types(out).values()) == {zipfile.ZIP_STORED}
+
+
+def test_package_writer_uses_policy(tmp_path, media):
+  out = str(tmp_path / 'out.apkg')
+  with genanki.PackageWriter(out, media_files=[media['sound.mp3']], compression=genanki.CompressionPolicy()) as w:
+    w.add_deck(_make_deck())
+
+  types = _compress_types(out)
+  assert types['collection.anki2'] == zipfile.ZIP_DEFLATED
+  assert types['sound.mp3'] == zipfile.ZIP_STORED
@@ -0,0 +1,75 @@
+import json
+
+import genanki
+from genanki.__main__ import main
+
+
+def _model(css=''):
+  return genanki.Model(
+    1607392319, 'Diff Model',
+    fields=[{'name': 'Question'}, {'name': 'Answer'}],
+    templates=[{'name': 'Card 1', 'qfmt': '{{Question}}', 'afmt': '{{Answer}}'}],
+    css=css)
+
+
+def _write(tmp_path, name, notes, media, css=''):
+  model = _model(css)
+  deck = genanki.Deck(1607392320, 'diff deck')
+  for guid, fields, tags in notes:
+    deck.add_note(genanki.Note(model, fields, tags=tags, guid=guid))
+  media_paths = []
+  for media_name, data in media.items():
+    media_path = tmp_path / name / media_name
+    media_path.parent.mkdir(exist_ok=True)
+    media_path.write_bytes(data)
+    media_paths.append(str(media_path))
+  path = str(tmp_path / (name + '.apkg'))
+  genanki.Package(deck, media_files=media_paths).write_to_file(path)
+  return path
+
+
+def _write_pair(tmp_path):
+  old = _write(
+    tmp_path, 'old',
+    [('same', ['a', 'b'], []), ('fields', ['c', 'd'], []), ('tags', ['e', 'f'], ['x']), ('gone', ['g', 'h'], [])],
+    {'same.png': b'1', 'changed.png': b'2', 'gone.png': b'3'})
+  new = _write(
+    tmp_path, 'new',
+    [('same', ['a', 'b'], []), ('fields', ['c', 'D'], []), ('tags', ['e', 'f'], ['y']), ('new', ['i', 'j'], [])],
+    {'same.png': b'1', 'changed.png': b'two', 'new.png': b'4'},
+    css='.card {}')
+  return old, new
+
+
+def test_diff_packages(tmp_path):
+  old, new = _write_pair(tmp_path)
+  changes = genanki.diff_packages(old, new)
+
+  assert changes.notes == genanki.ChangeSet(added=['new'], removed=['gone'], modified=['fields', 'tags'])
+  assert changes.media == genanki.ChangeSet(added=['new.png'], removed=['gone.png'], modified=['changed.png'])
+  assert changes.models == genanki.ChangeSet(modified=[1607392319])
+  assert changes
+
+
+def test_diff_identical_packages(tmp_path):
+  old, _ = _write_pair(tmp_path)
+  changes = genanki.diff_packages(old, old)
+  assert not changes
+  assert changes.to_json() == {
+    kind: {'added': [], 'removed': [], 'modified': []} for kind in ('notes', 'media', 'models')}
+
+
+def test_diff_command(tmp_path, capsys):
+  old, new = _write_pair(tmp_path)
+
+  assert main(['diff', old, new]) == 1
+  lines = capsys.readouterr().out.splitlines()
+  assert '+ notes new' in lines
+  assert '- media gone.png' in lines
+  assert '~ models 1607392319' in lines
+
+  assert main(['diff', '--json', old, new]) == 1
+  assert json.loads(capsys.readouterr().out)['notes']['modified'] == ['fields', 'tags']
+
+  assert main(['diff', old, old]) == 0
+  assert capsys.readouterr().out == ''
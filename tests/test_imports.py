@@ -0,0 +1,55 @@
+import subprocess
+import sys
+
+import pytest
+
+import genanki
+
+# Modules that are slow to import and that `import genanki` shouldn't need.
+_LAZY_MODULES = [
+  'asyncio', 'cached_property', 'chevron', 'concurrent.futures', 'genanki.builtin_models', 'genanki.package', 'sqlite3',
+  'tempfile', 'yaml', 'zipfile']
+
+
+def test_import_is_lazy():
+  code = 'import sys, genanki; print(" ".join(m for m in {!r} if m in sys.modules))'.format(_LAZY_MODULES)
+  output = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE, universal_newlines=True)
+  assert output.stdout.split() == []
+
+
+def test_lazy_attributes():
+  assert genanki.Package is genanki.package.Package
+  assert genanki.CLOZE_MODEL is genanki.builtin_models.CLOZE_MODEL
+  assert 'PackageWriter' in dir(genanki)
+  for name in genanki.__all__:
+    assert getattr(genanki, name) is not None
+  with pytest.raises(AttributeError):
+    genanki.NoSuchThing
+
+
+def test_star_import():
+  code = (
+    'from genanki import *; '
+    'print(Package.__name__, CLOZE_MODEL.name, BASIC_MODEL.name, PackageWriter.__name__, Note.__name__)')
+  output = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE, universal_newlines=True)
+  assert output.stdout.split()[:2] == ['Package', 'Cloze']
+
+
+def test_submodules_without_importing_them():
+  code = 'import genanki; print(genanki.package.Package.__name__, genanki.builtin_models.BASIC_MODEL.model_id)'
+  output = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE, universal_newlines=True)
+  assert output.stdout.split() == ['Package', str(genanki.BASIC_MODEL.model_id)]
+  assert 'tabular' in dir(genanki)
+
+
+def test_yaml_fields_still_work():
+  model = genanki.Model(1, 'yaml model', fields='- name: Front\n- name: Back\n', templates='- qfmt: "{{Front}}"\n')
+  assert model.fields == [{'name': 'Front'}, {'name': 'Back'}]
+  assert model._req == [[0, 'all', [0]]]
+
+
+def test_deprecated_cloze_fix_still_applied():
+  note = genanki.Note(genanki.CLOZE_MODEL, ['{{c1::a}}'])
+  with pytest.warns(DeprecationWarning):
+    note._prepare_for_write()
+  assert note.fields == ['{{c1::a}}', '']
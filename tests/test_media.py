@@ -0,0 +1,55 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+import genanki
+from genanki.media import dedupe_media_files
+
+
+def _write(path, data):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, 'wb') as h:
+    h.write(data)
+  return path
+
+
+def test_same_name_same_contents_deduped(tmp_path):
+  a = _write(str(tmp_path / 'dir1' / 'image.jpg'), b'jpeg bytes')
+  b = _write(str(tmp_path / 'dir2' / 'image.jpg'), b'jpeg bytes')
+  c = _write(str(tmp_path / 'other.jpg'), b'jpeg bytes')
+
+  assert dedupe_media_files([a, b, c]) == [a, c]
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason='needs symlinks')
+def test_symlink_deduped(tmp_path):
+  a = _write(str(tmp_path / 'dir1' / 'sound.mp3'), b'mp3 bytes')
+  os.makedirs(str(tmp_path / 'dir2'))
+  b = str(tmp_path / 'dir2' / 'sound.mp3')
+  os.symlink(a, b)
+
+  assert dedupe_media_files([a, b]) == [a]
+
+
+def test_same_name_different_contents_raises(tmp_path):
+  a = _write(str(tmp_path / 'dir1' / 'image.jpg'), b'jpeg bytes')
+  b = _write(str(tmp_path / 'dir2' / 'image.jpg'), b'other jpeg bytes')
+
+  with pytest.raises(ValueError, match='image.jpg'):
+    dedupe_media_files([a, b])
+
+
+def test_package_stores_duplicate_once(tmp_path):
+  a = _write(str(tmp_path / 'dir1' / 'image.jpg'), b'jpeg bytes')
+  b = _write(str(tmp_path / 'dir2' / 'image.jpg'), b'jpeg bytes')
+  deck = genanki.Deck(1948194012, 'media deck')
+  deck.add_note(genanki.Note(genanki.BASIC_MODEL, ['<img src="image.jpg">', 'b']))
+
+  out = str(tmp_path / 'out.apkg')
+  genanki.Package(deck, media_files=[a, b]).write_to_file(out)
+
+  with zipfile.ZipFile(out) as z:
+    assert json.loads(z.read('media')) == {'0': 'image.jpg'}
+    assert z.read('0') == b'jpeg bytes'
@@ -0,0 +1,120 @@
+import copy
+import json
+from unittest import mock
+
+import genanki
+
+
+def _model():
+  return genanki.Model(
+    1450921610, 'model',
+    fields=[{'name': 'Front'}, {'name': 'Back', 'font': 'Arial'}],
+    templates=[{'name': 'Card 1', 'qfmt': '{{Front}}', 'afmt': '{{Back}}'}])
+
+
+def _old_to_json(model, timestamp, deck_id):
+  """The previous, mutating implementation of Model.to_json, run on copies."""
+  templates = copy.deepcopy(model.templates)
+  fields = copy.deepcopy(model.fields)
+  for ord_, tmpl in enumerate(templates):
+    tmpl['ord'] = ord_
+    tmpl.setdefault('bafmt', '')
+    tmpl.setdefault('bqfmt', '')
+    tmpl.setdefault('bfont', '')
+    tmpl.setdefault('bsize', 0)
+    tmpl.setdefault('did', None)
+  for ord_, field in enumerate(fields):
+    field['ord'] = ord_
+    field.setdefault('font', 'Liberation Sans')
+    field.setdefault('media', [])
+    field.setdefault('rtl', False)
+    field.setdefault('size', 20)
+    field.setdefault('sticky', False)
+  return {
+    "css": model.css, "did": deck_id, "flds": fields, "id": str(model.model_id), "latexPost": model.latex_post,
+    "latexPre": model.latex_pre, "latexsvg": False, "mod": int(timestamp), "name": model.name, "req": model._req,
+    "sortf": model.sort_field_index, "tags": [], "tmpls": templates, "type": model.model_type, "usn": -1, "vers": [],
+  }
+
+
+def test_to_json_matches_previous_output():
+  for model in [_model(), genanki.CLOZE_MODEL, genanki.BASIC_TYPE_IN_THE_ANSWER_MODEL]:
+    # compare serialized, so that key order is checked too
+    assert json.dumps(model.to_json(1600000000.5, 123)) == json.dumps(_old_to_json(model, 1600000000.5, 123))
+
+
+def test_to_json_does_not_mutate():
+  model = _model()
+  fields = copy.deepcopy(model.fields)
+  templates = copy.deepcopy(model.templates)
+  model.to_json(0, 1)
+  assert model.fields == fields
+  assert model.templates == templates
+
+
+def test_to_json_cached_and_invalidated():
+  model = _model()
+  first = model.to_json(0, 1)
+  with mock.patch.object(genanki.Model, '_with_json_defaults') as with_json_defaults:
+    assert model.to_json(5, 2)['flds'] == first['flds']
+  assert not with_json_defaults.called
+  assert model.to_json(5, 2)['did'] == 2
+  assert first['did'] == 1
+
+  model.css = '.card {}'
+  assert model.to_json(0, 1)['css'] == '.card {}'
+
+  model.sort_field_index = 1
+  assert model.to_json(0, 1)['sortf'] == 1
+
+  model.fields = model.fields + [{'name': 'Extra'}]
+  assert [f['name'] for f in model.to_json(0, 1)['flds']] == ['Front', 'Back', 'Extra']
+
+  model.set_templates([{'name': 'Other', 'qfmt': '{{Back}}', 'afmt': ''}])
+  as_json = model.to_json(0, 1)
+  assert [t['name'] for t in as_json['tmpls']] == ['Other']
+  assert as_json['req'] == [[0, 'all', [1]]]
+
+
+def test_to_json_sees_in_place_changes():
+  model = _model()
+  model.to_json(0, 1)
+  model._req
+
+  model.fields.append({'name': 'Extra'})
+  assert [f['name'] for f in model.to_json(0, 1)['flds']] == ['Front', 'Back', 'Extra']
+
+  model.fields[0]['font'] = 'Arial'
+  assert model.to_json(0, 1)['flds'][0]['font'] == 'Arial'
+
+  model.templates[0]['qfmt'] = '{{Back}}'
+  as_json = model.to_json(0, 1)
+  assert as_json['tmpls'][0]['qfmt'] == '{{Back}}'
+  assert as_json['req'] == [[0, 'all', [1]]]
+  assert model._req == [[0, 'all', [1]]]
+
+
+def test_to_json_sees_in_place_changes_made_after_req():
+  model = _model()
+  assert model._req == [[0, 'all', [0]]]
+  assert model._cloze_field_indexes == []
+
+  model.templates[0]['qfmt'] = '{{Back}}'
+  assert model.to_json(0, 1)['req'] == [[0, 'all', [1]]]
+  assert model._req == [[0, 'all', [1]]]
+
+
+def test_to_json_result_can_be_modified():
+  model = _model()
+  as_json = model.to_json(0, 1)
+  as_json['flds'][0]['name'] = 'Changed'
+  as_json['flds'][0]['media'].append('x.jpg')
+  as_json['tmpls'].clear()
+  as_json['req'][0][2].append(5)
+
+  fresh = model.to_json(0, 1)
+  assert fresh['flds'][0]['name'] == 'Front'
+  assert fresh['flds'][0]['media'] == []
+  assert len(fresh['tmpls']) == 1
+  assert 5 not in fresh['req'][0][2]
+  assert model.fields[0] == {'name': 'Front'}
@@ -1,5 +1,6 @@
 import itertools
 import pytest
+import random
 import time
 import genanki
 import os
@@ -8,6 +9,8 @@ import tempfile
 import textwrap
 import warnings
 
+from genanki.batch_writer import BatchWriter
+
 
 def test_ok():
   my_model = genanki.Model(
@@ -217,6 +220,100 @@ class TestFindInvalidHtmlTagsInField:
     assert genanki.Note._find_invalid_html_tags_in_field('<![CDATA[ here is some cdata ]]>') == []
 
 
+class TestFindInvalidHtmlTagsInFieldMatchesRegex:
+  """_find_invalid_html_tags_in_field is a linear-time implementation of Note._INVALID_HTML_TAG_RE."""
+  PIECES = ['<', '>', ' ', '\n', 'a', 'B', '1', '/', '!', '-', '[CDATA[', '!--', '@', 'br']
+
+  def test_random_fields(self):
+    rng = random.Random(1234)
+    for _ in range(20000):
+      field = ''.join(rng.choice(self.PIECES) for _ in range(rng.randint(0, 20)))
+      assert genanki.Note._find_invalid_html_tags_in_field(field) == genanki.Note._INVALID_HTML_TAG_RE.findall(field)
+
+  @pytest.mark.parametrize('field', [
+    '<a href="x"\n>',
+    '<a b>\n<c d\n>',
+    '1 < 2 and 3 > 2',
+    'x < y\n<br> y > z',
+    '<!-- <$> -->',
+  ])
+  def test_examples(self, field):
+    assert genanki.Note._find_invalid_html_tags_in_field(field) == genanki.Note._INVALID_HTML_TAG_RE.findall(field)
+
+
+class TestFindInvalidHtmlTagsInFieldPathological:
+  """
+  Inputs on which _INVALID_HTML_TAG_RE backtracks quadratically (minutes at 200k characters).
+
+  Rather than comparing against a wall-clock limit, which is flaky on shared CI runners, these check that 4x the input
+  takes roughly 4x as long; quadratic time would take 16x. benchmarks/html_check.py reports the actual timings.
+  """
+  N = 20000
+  MAX_RATIO = 10
+
+  @staticmethod
+  def _time_per_call(field):
+    # repeat the call until the total is long enough to time reliably; best of 3
+    best = float('inf')
+    for _ in range(3):
+      calls = 0
+      start = time.perf_counter()
+      while True:
+        genanki.Note._find_invalid_html_tags_in_field(field)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= 0.02:
+          break
+      best = min(best, elapsed / calls)
+    return best
+
+  def _assert_linear(self, piece, suffix=''):
+    small = self._time_per_call(piece * self.N + suffix)
+    large = self._time_per_call(piece * (4 * self.N) + suffix)
+    assert large / small < self.MAX_RATIO
+
+  @pytest.mark.parametrize('piece, suffix', [('<', ''), ('<a ', ''), ('<x y\n', '>'), ('<@>', '')])
+  def test_same_result_as_regex(self, piece, suffix):
+    field = piece * 300 + suffix
+    assert genanki.Note._find_invalid_html_tags_in_field(field) == genanki.Note._INVALID_HTML_TAG_RE.findall(field)
+
+  def test_many_lt(self):
+    self._assert_linear('<')
+
+  def test_many_unclosed_tags(self):
+    self._assert_linear('<a ')
+
+  def test_many_unclosed_tags_on_separate_lines(self):
+    self._assert_linear('<x y\n', '>')
+
+  def test_many_invalid_tags(self):
+    assert len(genanki.Note._find_invalid_html_tags_in_field('<@>' * self.N)) == self.N
+    self._assert_linear('<@>')
+
+
+class TestHtmlValidationLevels:
+  def _count_warnings(self, html_validation, num_notes=250):
+    batch_writer = BatchWriter(mock.MagicMock(), html_validation=html_validation)
+    with warnings.catch_warnings(record=True) as warning_list:
+      warnings.simplefilter('always')
+      for _ in range(num_notes):
+        batch_writer.add_note(genanki.Note(genanki.BASIC_MODEL, ['1 <$> 2', 'b']), 0, 1, itertools.count())
+    return len(warning_list)
+
+  def test_full(self):
+    assert self._count_warnings('full') == 250
+
+  def test_sampled(self):
+    assert self._count_warnings('sampled') == 3
+
+  def test_off(self):
+    assert self._count_warnings('off') == 0
+
+  def test_invalid_level(self):
+    with pytest.raises(ValueError):
+      BatchWriter(mock.MagicMock(), html_validation='some')
+
+
 def test_warns_on_invalid_html_tags():
   my_model = genanki.Model(
     1376484377,
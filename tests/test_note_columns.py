@@ -0,0 +1,110 @@
+import warnings
+from unittest import mock
+
+import pytest
+
+import genanki
+from genanki import sharded_build
+from tests.test_package import _read_apkg_collection
+
+_FRONTS = ['front {}'.format(i) for i in range(30)]
+_BACKS = ['back {}'.format(i) for i in range(30)]
+# every third note has no "Add Reverse", so it gets one card instead of two
+_ADD_REVERSE = ['y' if i % 3 else '' for i in range(30)]
+_TAGS = [['tag{}'.format(i % 4), 'common'] for i in range(30)]
+_DUE = list(range(30))
+_CLOZES = ['{{{{c1::a}}}} {{{{c{}::b {}}}}}'.format(i % 3 + 1, i) for i in range(30)]
+
+
+def _deck_from_notes():
+  deck = genanki.Deck(1450921700, 'columns deck')
+  for front, back, add_reverse, tags, due in zip(_FRONTS, _BACKS, _ADD_REVERSE, _TAGS, _DUE):
+    deck.add_note(genanki.Note(genanki.BASIC_OPTIONAL_REVERSED_CARD_MODEL, [front, back, add_reverse], tags=tags,
+                               due=due))
+  for i, cloze in enumerate(_CLOZES):
+    deck.add_note(genanki.Note(genanki.CLOZE_MODEL, [cloze, ''], guid='cloze{}'.format(i), sort_field='s' if i else None))
+  return deck
+
+
+def _deck_from_columns():
+  deck = genanki.Deck(1450921700, 'columns deck')
+  deck.add_notes_from_columns(
+    genanki.BASIC_OPTIONAL_REVERSED_CARD_MODEL, [_FRONTS, _BACKS, _ADD_REVERSE], tags=_TAGS, due=_DUE)
+  deck.add_notes_from_columns(
+    genanki.CLOZE_MODEL, [_CLOZES, [''] * 30], guids=['cloze{}'.format(i) for i in range(30)],
+    sort_fields=[None] + ['s'] * 29)
+  return deck
+
+
+def test_matches_notes(tmp_path):
+  genanki.Package(_deck_from_notes()).write_to_file(str(tmp_path / 'notes.apkg'), timestamp=1600000000)
+  with mock.patch.object(genanki.Note, '__init__', side_effect=AssertionError('created a Note')):
+    genanki.Package(_deck_from_columns()).write_to_file(str(tmp_path / 'columns.apkg'), timestamp=1600000000)
+
+  assert _read_apkg_collection(str(tmp_path / 'columns.apkg')) == _read_apkg_collection(str(tmp_path / 'notes.apkg'))
+
+
+@pytest.mark.parametrize('how', ['workers', 'package_writer', 'cache_dir'])
+def test_other_write_paths_match(tmp_path, how):
+  genanki.Package(_deck_from_notes()).write_to_file(str(tmp_path / 'notes.apkg'), timestamp=1600000000)
+
+  out = str(tmp_path / 'columns.apkg')
+  if how == 'workers':
+    with mock.patch.object(sharded_build, 'MIN_NOTES_PER_SHARD', 10):
+      genanki.Package(_deck_from_columns()).write_to_file(out, timestamp=1600000000, workers=2)
+  elif how == 'package_writer':
+    with genanki.PackageWriter(out, timestamp=1600000000) as writer:
+      writer.add_deck(_deck_from_columns())
+  else:
+    genanki.Package(_deck_from_columns()).write_to_file(out, timestamp=1600000000, cache_dir=str(tmp_path / 'cache'))
+
+  (notes, cards, col), _ = _read_apkg_collection(out)
+  (expected_notes, expected_cards, expected_col), _ = _read_apkg_collection(str(tmp_path / 'notes.apkg'))
+  assert notes == expected_notes
+  assert cards == expected_cards
+  if how == 'workers':
+    assert col == expected_col
+
+
+def test_store():
+  deck = genanki.Deck(1450921700, 'columns deck')
+  columns = deck.add_notes_from_columns(genanki.BASIC_MODEL, [['a', 'b', 'c'], ['1', '2', '3']], tags=[['x']] * 3)
+  assert len(columns) == 3
+  assert deck._num_notes() == 3
+  assert columns.guids == [genanki.guid_for('a', '1'), genanki.guid_for('b', '2'), genanki.guid_for('c', '3')]
+  # rows with the same tags share one string
+  assert columns.tags[0] is columns.tags[2]
+
+  notes = list(columns.to_notes())
+  assert [note.fields for note in notes] == [['a', '1'], ['b', '2'], ['c', '3']]
+  assert notes[0].tags == ['x']
+  assert notes[0].guid == columns.guids[0]
+
+
+def test_validation():
+  deck = genanki.Deck(1450921700, 'columns deck')
+  with pytest.raises(ValueError, match='Number of fields'):
+    deck.add_notes_from_columns(genanki.BASIC_MODEL, [['a']])
+  with pytest.raises(ValueError, match='field column'):
+    deck.add_notes_from_columns(genanki.BASIC_MODEL, [['a', 'b'], ['1']])
+  with pytest.raises(ValueError, match='tags'):
+    deck.add_notes_from_columns(genanki.BASIC_MODEL, [['a'], ['1']], tags=[['x'], ['y']])
+  with pytest.raises(ValueError, match='contains a space'):
+    deck.add_notes_from_columns(genanki.BASIC_MODEL, [['a'], ['1']], tags=[['bad tag']])
+  assert deck.note_columns == []
+
+
+def test_html_validation():
+  fronts = ['fine <b>{}</b>'.format(i) for i in range(2500)]
+  fronts[1234] = 'a <$bad> tag'
+  backs = [''] * 2500
+  deck = genanki.Deck(1450921700, 'columns deck')
+
+  with pytest.warns(UserWarning, match=r'invalid HTML tags.*<\$bad>'):
+    deck.add_notes_from_columns(genanki.BASIC_MODEL, [fronts, backs])
+
+  with warnings.catch_warnings():
+    warnings.simplefilter('error')
+    # row 1234 isn't one of the sampled rows
+    deck.add_notes_from_columns(genanki.BASIC_MODEL, [fronts, backs], html_validation='sampled')
+    deck.add_notes_from_columns(genanki.BASIC_MODEL, [fronts, backs], html_validation='off')
@@ -0,0 +1,206 @@
+import itertools
+import json
+import os
+import pytest
+import sqlite3
+import tempfile
+import zipfile
+from unittest import mock
+
+import genanki
+from genanki import package as package_module
+
+
+def _write_to_memory_db(package, timestamp=1600000000):
+  conn = sqlite3.connect(':memory:')
+  cursor = conn.cursor()
+  package.write_to_db(cursor, timestamp, itertools.count(int(timestamp * 1000)))
+  return cursor
+
+
+class TestColJson:
+  def _make_decks(self, n):
+    decks = []
+    for i in range(n):
+      deck = genanki.Deck(2000000000 + i, 'parent::child {}'.format(i))
+      deck.add_note(genanki.Note(genanki.BASIC_MODEL, ['q{}'.format(i), 'a{}'.format(i)]))
+      deck.add_note(genanki.Note(genanki.CLOZE_MODEL, ['{{{{c1::c{}}}}}'.format(i), '']))
+      decks.append(deck)
+    return decks
+
+  def test_decks_and_models_written(self):
+    cursor = _write_to_memory_db(genanki.Package(self._make_decks(20)))
+
+    decks_json_str, models_json_str = cursor.execute('SELECT decks, models FROM col').fetchone()
+    decks = json.loads(decks_json_str)
+    models = json.loads(models_json_str)
+
+    assert len(decks) == 21  # default deck and 20 subdecks
+    assert decks['2000000007']['name'] == 'parent::child 7'
+    assert set(models) == {str(genanki.BASIC_MODEL.model_id), str(genanki.CLOZE_MODEL.model_id)}
+    # model "did" is the last deck that uses the model, as before
+    assert models[str(genanki.BASIC_MODEL.model_id)]['did'] == 2000000019
+
+  def test_each_model_serialized_once(self):
+    package = genanki.Package(self._make_decks(20))
+    with mock.patch.object(genanki.Model, 'to_json', autospec=True, side_effect=lambda self, ts, did: {}) as to_json:
+      _write_to_memory_db(package)
+
+    assert to_json.call_count == 2
+
+  def test_col_json_written_once(self):
+    cursor = mock.MagicMock()
+    cursor.execute.return_value.fetchone.return_value = ('{}', '{}')
+    genanki.Package(self._make_decks(5)).write_to_db(cursor, 0, itertools.count())
+
+    updates = [c for c in cursor.execute.call_args_list if c.args[0].startswith('UPDATE col SET decks')]
+    assert len(updates) == 1
+    # col.tags is written separately, once the notes are in
+    tag_updates = [c for c in cursor.execute.call_args_list if c.args[0].startswith('UPDATE col SET tags')]
+    assert len(tag_updates) == 1
+
+
+def _read_apkg_collection(path):
+  with zipfile.ZipFile(path) as z:
+    collection_bytes = z.read('collection.anki2')
+    media = json.loads(z.read('media'))
+  dbfile, dbfilename = tempfile.mkstemp()
+  with os.fdopen(dbfile, 'wb') as h:
+    h.write(collection_bytes)
+  conn = sqlite3.connect(dbfilename)
+  try:
+    rows = (
+      conn.execute('SELECT * FROM notes ORDER BY id').fetchall(),
+      conn.execute('SELECT * FROM cards ORDER BY id').fetchall(),
+      conn.execute('SELECT * FROM col').fetchall(),
+    )
+  finally:
+    conn.close()
+    os.remove(dbfilename)
+  return rows, media
+
+
+def _make_package():
+  deck = genanki.Deck(1890353722, 'package deck')
+  deck.add_note(genanki.Note(genanki.BASIC_MODEL, ['Capital of Argentina', 'Buenos Aires']))
+  deck.add_note(genanki.Note(genanki.BASIC_AND_REVERSED_CARD_MODEL, ['Costa Rica', 'San José']))
+  return genanki.Package(deck)
+
+
+class TestInMemory:
+  def test_in_memory_matches_on_disk(self, tmp_path):
+    _make_package().write_to_file(str(tmp_path / 'disk.apkg'), timestamp=1600000000)
+    _make_package().write_to_file(str(tmp_path / 'mem.apkg'), timestamp=1600000000, in_memory=True)
+
+    assert _read_apkg_collection(str(tmp_path / 'mem.apkg')) == _read_apkg_collection(str(tmp_path / 'disk.apkg'))
+
+  def test_backup_fallback(self):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (x integer)')
+    conn.execute('INSERT INTO t VALUES (42)')
+    conn.commit()
+
+    class NoSerializeConnection:
+      def backup(self, target):
+        conn.backup(target)
+
+    data = package_module._serialize_db(NoSerializeConnection())
+    assert data.startswith(b'SQLite format 3\x00')
+
+  def test_on_disk_temp_file_removed(self, tmp_path):
+    created = []
+    real_mkstemp = tempfile.mkstemp
+
+    def recording_mkstemp(*args, **kwargs):
+      fd, name = real_mkstemp(*args, **kwargs)
+      created.append(name)
+      return fd, name
+
+    with mock.patch('tempfile.mkstemp', recording_mkstemp):
+      _make_package().write_to_file(str(tmp_path / 'out.apkg'))
+
+    assert created
+    assert not any(os.path.exists(name) for name in created)
+
+  def test_on_disk_temp_file_removed_on_error(self, tmp_path):
+    created = []
+    real_mkstemp = tempfile.mkstemp
+
+    def recording_mkstemp(*args, **kwargs):
+      fd, name = real_mkstemp(*args, **kwargs)
+      created.append(name)
+      return fd, name
+
+    deck = genanki.Deck(1890353722, 'package deck')
+    deck.add_note(genanki.Note(genanki.BASIC_MODEL, ['only one field']))
+    with mock.patch('tempfile.mkstemp', recording_mkstemp):
+      with pytest.raises(ValueError):
+        genanki.Package(deck).write_to_file(str(tmp_path / 'out.apkg'))
+
+    assert created
+    assert not any(os.path.exists(name) for name in created)
+
+
+class TestBuildProfile:
+  @pytest.mark.parametrize('in_memory', [False, True])
+  def test_indexes_created(self, tmp_path, in_memory):
+    path = str(tmp_path / 'out.apkg')
+    _make_package().write_to_file(path, in_memory=in_memory)
+    with zipfile.ZipFile(path) as z:
+      (tmp_path / 'collection.anki2').write_bytes(z.read('collection.anki2'))
+
+    conn = sqlite3.connect(str(tmp_path / 'collection.anki2'))
+    try:
+      indexes = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+      assert conn.execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    finally:
+      conn.close()
+    assert indexes == {
+      'ix_notes_usn', 'ix_cards_usn', 'ix_revlog_usn', 'ix_cards_nid', 'ix_cards_sched', 'ix_revlog_cid',
+      'ix_notes_csum'}
+
+
+class _WriteOnlyStream:
+  """Like a socket or WSGI response: no seek(), tell() or flush()."""
+  def __init__(self):
+    self.chunks = []
+
+  def write(self, data):
+    self.chunks.append(bytes(data))
+
+
+class TestStreams:
+  def test_write_to_bytes(self, tmp_path):
+    with mock.patch('tempfile.mkstemp', side_effect=AssertionError('touched the filesystem')):
+      apkg_bytes = _make_package().write_to_bytes(timestamp=1600000000)
+    (tmp_path / 'bytes.apkg').write_bytes(apkg_bytes)
+    _make_package().write_to_file(str(tmp_path / 'file.apkg'), timestamp=1600000000)
+
+    assert _read_apkg_collection(str(tmp_path / 'bytes.apkg')) == _read_apkg_collection(str(tmp_path / 'file.apkg'))
+
+  @pytest.mark.parametrize('progress', [None, lambda event: None])
+  def test_write_to_non_seekable_stream(self, tmp_path, progress):
+    media_path = tmp_path / 'sound.mp3'
+    media_path.write_bytes(b'not really an mp3')
+    package = _make_package()
+    package.media_files = [str(media_path)]
+
+    stream = _WriteOnlyStream()
+    package.write_to_file(stream, timestamp=1600000000, in_memory=True, progress=progress)
+    (tmp_path / 'stream.apkg').write_bytes(b''.join(stream.chunks))
+
+    with zipfile.ZipFile(str(tmp_path / 'stream.apkg')) as z:
+      assert z.testzip() is None
+      assert z.read('0') == b'not really an mp3'
+    package.write_to_file(str(tmp_path / 'file.apkg'), timestamp=1600000000)
+    assert _read_apkg_collection(str(tmp_path / 'stream.apkg')) == _read_apkg_collection(str(tmp_path / 'file.apkg'))
+
+  def test_package_writer_to_non_seekable_stream(self, tmp_path):
+    stream = _WriteOnlyStream()
+    with genanki.PackageWriter(stream, timestamp=1600000000, in_memory=True) as writer:
+      writer.add_deck(_make_package().decks[0])
+    (tmp_path / 'stream.apkg').write_bytes(b''.join(stream.chunks))
+
+    (notes, cards, _), _ = _read_apkg_collection(str(tmp_path / 'stream.apkg'))
+    assert len(notes) == 2
+    assert len(cards) == 3
@@ -0,0 +1,101 @@
+import io
+import os
+
+import pytest
+
+import genanki
+from tests.test_package import _read_apkg_collection
+
+
+def _write_package(tmp_path):
+  deck1 = genanki.Deck(1450921620, 'reader deck 1', description='first deck')
+  deck1.add_note(genanki.Note(genanki.BASIC_AND_REVERSED_CARD_MODEL, ['Capital of Argentina', 'Buenos Aires'],
+                              tags=['geo', 'south_america']))
+  deck1.add_note(genanki.Note(genanki.BASIC_MODEL, ['Capital of Chile', 'Santiago'], due=5))
+  deck2 = genanki.Deck(1450921621, 'reader deck 2')
+  deck2.add_note(genanki.Note(genanki.CLOZE_MODEL, ['{{c1::Lima}} is in {{c2::Peru}}', 'extra']))
+
+  (tmp_path / 'flag.svg').write_bytes(b'<svg></svg>')
+  path = str(tmp_path / 'in.apkg')
+  genanki.Package([deck1, deck2], media_files=[str(tmp_path / 'flag.svg')]).write_to_file(path, timestamp=1600000000)
+  return path
+
+
+def test_iter_notes_and_cards(tmp_path):
+  with genanki.PackageReader(_write_package(tmp_path)) as reader:
+    assert reader.num_notes() == 3
+    notes = list(reader.iter_notes())
+    assert [note.fields for note in notes] == [
+      ['Capital of Argentina', 'Buenos Aires'], ['Capital of Chile', 'Santiago'],
+      ['{{c1::Lima}} is in {{c2::Peru}}', 'extra']]
+    assert notes[0].tags == ['geo', 'south_america']
+    assert notes[0].guid == genanki.guid_for('Capital of Argentina', 'Buenos Aires')
+    assert notes[0].model.name == genanki.BASIC_AND_REVERSED_CARD_MODEL.name
+    assert notes[0].model._req == genanki.BASIC_AND_REVERSED_CARD_MODEL._req
+    assert [note.deck_id for note in notes] == [1450921620, 1450921620, 1450921621]
+    assert notes[1].due == 5
+
+    assert [note.guid for note in reader.iter_notes(deck_id=1450921621)] == [notes[2].guid]
+
+    cards = list(reader.iter_cards())
+    assert len(cards) == 5
+    assert sorted(card.ord for card in reader.iter_cards(notes[2].id)) == [0, 1]
+
+    assert reader.decks[1450921620].description == 'first deck'
+    assert set(reader.models) == {
+      genanki.BASIC_MODEL.model_id, genanki.BASIC_AND_REVERSED_CARD_MODEL.model_id, genanki.CLOZE_MODEL.model_id}
+
+
+def test_media(tmp_path):
+  with open(_write_package(tmp_path), 'rb') as h:
+    data = h.read()
+  with genanki.PackageReader(io.BytesIO(data)) as reader:
+    assert list(reader.media) == ['flag.svg']
+    assert reader.media_size('flag.svg') == 11
+    with reader.open_media('flag.svg') as media:
+      assert media.read() == b'<svg></svg>'
+    with pytest.raises(KeyError):
+      reader.open_media('missing.png')
+
+
+def test_package_read_round_trip(tmp_path):
+  path = _write_package(tmp_path)
+  (tmp_path / 'media').mkdir()
+  package = genanki.Package.read(path, media_dir=str(tmp_path / 'media'))
+
+  assert [deck.name for deck in package.decks] == ['reader deck 1', 'reader deck 2']
+  assert [len(deck.notes) for deck in package.decks] == [2, 1]
+  assert package.media_files == [str(tmp_path / 'media' / 'flag.svg')]
+
+  out_path = str(tmp_path / 'out.apkg')
+  package.write_to_file(out_path, timestamp=1600000000)
+  assert _read_apkg_collection(out_path) == _read_apkg_collection(path)
+
+
+def test_suspended_cards_round_trip(tmp_path):
+  deck = genanki.Deck(1450921622, 'suspended deck')
+  for i in range(10):
+    note = genanki.Note(genanki.BASIC_AND_REVERSED_CARD_MODEL, ['front {}'.format(i), 'back'])
+    note.cards[1].suspend = True
+    if i % 2:
+      note.cards[0].suspend = True
+    deck.add_note(note)
+  deck.add_note(genanki.Note(genanki.BASIC_AND_REVERSED_CARD_MODEL, ['not suspended', 'back']))
+  path = str(tmp_path / 'suspended.apkg')
+  genanki.Package(deck).write_to_file(path, timestamp=1600000000)
+
+  with genanki.PackageReader(path) as reader:
+    notes = list(reader.iter_notes())
+  assert [sorted(note.suspended_ords) for note in notes[:2]] == [[1], [0, 1]]
+  assert notes[-1].suspended_ords == ()
+
+  out_path = str(tmp_path / 'out.apkg')
+  genanki.Package.read(path).write_to_file(out_path, timestamp=1600000000)
+  assert _read_apkg_collection(out_path) == _read_apkg_collection(path)
+
+
+def test_temp_file_removed(tmp_path):
+  reader = genanki.PackageReader(_write_package(tmp_path))
+  dbfilename = reader._dbfilename
+  reader.close()
+  assert not os.path.exists(dbfilename)
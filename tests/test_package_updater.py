@@ -0,0 +1,222 @@
+import json
+import os
+import stat
+import zipfile
+from unittest import mock
+
+import pytest
+
+import genanki
+from genanki import package_updater
+from genanki.compression import CompressionPolicy
+from tests.test_package import _read_apkg_collection
+
+
+def _note(front, back, model=genanki.BASIC_MODEL):
+  return genanki.Note(model, [front, back], guid=front)
+
+
+def _write_base(path, media_files=()):
+  deck = genanki.Deck(1450921560, 'updated deck')
+  for i in range(5):
+    deck.add_note(_note('front {}'.format(i), 'back {}'.format(i)))
+  package = genanki.Package(deck, media_files=list(media_files))
+  package.write_to_file(str(path), timestamp=1600000000, compression=CompressionPolicy())
+  return deck
+
+
+def test_upsert_updates_in_place_and_inserts(tmp_path):
+  path = tmp_path / 'deck.apkg'
+  deck = _write_base(path)
+  (notes_before, cards_before, _), _ = _read_apkg_collection(str(path))
+
+  with genanki.PackageUpdater(str(path), timestamp=1700000000) as updater:
+    updater.upsert_note(deck, _note('front 1', 'new back 1'))
+    updater.upsert_note(deck, _note('front 9', 'back 9'))
+
+  (notes, cards, _), _ = _read_apkg_collection(str(path))
+  assert len(notes) == 6
+  assert len(cards) == 6
+
+  by_guid = {note[1]: note for note in notes}
+  before_by_guid = {note[1]: note for note in notes_before}
+  assert by_guid['front 1'][0] == before_by_guid['front 1'][0]  # same note id
+  assert by_guid['front 1'][6] == 'front 1\x1fnew back 1'
+  assert by_guid['front 1'][3] == 1700000000
+  # untouched notes are unchanged
+  assert by_guid['front 2'] == before_by_guid['front 2']
+  # new ids don't collide with existing ones
+  assert len({card[0] for card in cards}) == 6
+  assert by_guid['front 9'][0] > max(card[0] for card in cards_before)
+
+
+def test_upsert_changes_cards_by_ord(tmp_path):
+  path = tmp_path / 'deck.apkg'
+  deck = _write_base(path)
+  (_, cards_before, _), _ = _read_apkg_collection(str(path))
+
+  with genanki.PackageUpdater(str(path)) as updater:
+    updater.upsert_note(deck, _note('front 0', 'back 0', genanki.BASIC_AND_REVERSED_CARD_MODEL))
+
+  (notes, cards, _), _ = _read_apkg_collection(str(path))
+  note_id = next(note[0] for note in notes if note[1] == 'front 0')
+  note_cards = sorted((card[3], card[0]) for card in cards if card[1] == note_id)
+  assert [ord_ for ord_, _ in note_cards] == [0, 1]
+  # the existing card keeps its id
+  assert note_cards[0][1] in {card[0] for card in cards_before}
+
+  with genanki.PackageUpdater(str(path)) as updater:
+    updater.upsert_note(deck, _note('front 0', 'back 0'))
+
+  (_, cards, _), _ = _read_apkg_collection(str(path))
+  assert sorted(card[3] for card in cards if card[1] == note_id) == [0]
+
+
+def test_delete_note(tmp_path):
+  path = tmp_path / 'deck.apkg'
+  _write_base(path)
+
+  with genanki.PackageUpdater(str(path)) as updater:
+    assert updater.delete_note('front 3')
+    assert not updater.delete_note('no such guid')
+
+  (notes, cards, _), _ = _read_apkg_collection(str(path))
+  assert 'front 3' not in {note[1] for note in notes}
+  assert len(cards) == 4
+
+
+def test_matches_full_rebuild(tmp_path):
+  path = tmp_path / 'deck.apkg'
+  deck = _write_base(path)
+  with genanki.PackageUpdater(str(path), timestamp=1600000000) as updater:
+    updater.upsert_note(deck, _note('front 5', 'back 5'))
+
+  rebuilt = genanki.Deck(1450921560, 'updated deck')
+  for i in range(6):
+    rebuilt.add_note(_note('front {}'.format(i), 'back {}'.format(i)))
+  genanki.Package(rebuilt).write_to_file(str(tmp_path / 'rebuilt.apkg'), timestamp=1600000000)
+
+  (notes, cards, (col,)), _ = _read_apkg_collection(str(path))
+  (rebuilt_notes, rebuilt_cards, (rebuilt_col,)), _ = _read_apkg_collection(str(tmp_path / 'rebuilt.apkg'))
+
+  def strip_ids(rows):
+    return sorted(row[1:] for row in rows)
+  assert strip_ids(notes) == strip_ids(rebuilt_notes)
+  assert len(cards) == len(rebuilt_cards)
+  assert json.loads(col[9]) == json.loads(rebuilt_col[9])  # models
+  assert json.loads(col[10]) == json.loads(rebuilt_col[10])  # decks
+
+
+def test_media(tmp_path):
+  (tmp_path / 'a.jpg').write_bytes(b'\xff\xd8\xff' + b'a' * 1000)
+  (tmp_path / 'b.txt').write_text('b' * 1000)
+  (tmp_path / 'c.txt').write_text('c' * 1000)
+  path = tmp_path / 'deck.apkg'
+  _write_base(path, [str(tmp_path / 'a.jpg'), str(tmp_path / 'b.txt')])
+
+  with zipfile.ZipFile(str(path)) as z:
+    media = json.loads(z.read('media'))
+    kept_idx = next(idx for idx, name in media.items() if name == 'b.txt')
+    original_info = z.getinfo(kept_idx)
+
+  with genanki.PackageUpdater(str(path), compression=CompressionPolicy()) as updater:
+    updater.remove_media('a.jpg')
+    updater.add_media_files([str(tmp_path / 'c.txt')])
+
+  with zipfile.ZipFile(str(path)) as z:
+    assert z.testzip() is None
+    media = json.loads(z.read('media'))
+    assert sorted(media.values()) == ['b.txt', 'c.txt']
+    assert z.read(kept_idx) == b'b' * 1000
+    # the kept entry was copied as-is
+    info = z.getinfo(kept_idx)
+    assert (info.compress_type, info.compress_size, info.CRC) == \
+           (original_info.compress_type, original_info.compress_size, original_info.CRC)
+    new_idx = next(idx for idx, name in media.items() if name == 'c.txt')
+    assert z.read(new_idx) == b'c' * 1000
+
+
+def test_output_and_exception(tmp_path):
+  path = tmp_path / 'deck.apkg'
+  deck = _write_base(path)
+  original = path.read_bytes()
+
+  with genanki.PackageUpdater(str(path), output=str(tmp_path / 'out.apkg')) as updater:
+    updater.upsert_note(deck, _note('front 7', 'back 7'))
+  assert path.read_bytes() == original
+  assert len(_read_apkg_collection(str(tmp_path / 'out.apkg'))[0][0]) == 6
+
+  with pytest.raises(RuntimeError):
+    with genanki.PackageUpdater(str(path)) as updater:
+      updater.upsert_note(deck, _note('front 8', 'back 8'))
+      raise RuntimeError
+  assert path.read_bytes() == original
+  assert sorted(p.name for p in tmp_path.iterdir()) == ['deck.apkg', 'out.apkg']
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='POSIX permissions')
+def test_keeps_file_mode(tmp_path):
+  path = tmp_path / 'deck.apkg'
+  deck = _write_base(path)
+  os.chmod(str(path), 0o644)
+
+  with genanki.PackageUpdater(str(path)) as updater:
+    updater.upsert_note(deck, _note('front 7', 'back 7'))
+  assert stat.S_IMODE(os.stat(str(path)).st_mode) == 0o644
+
+  with genanki.PackageUpdater(str(path), output=str(tmp_path / 'out.apkg')) as updater:
+    updater.upsert_note(deck, _note('front 8', 'back 8'))
+  assert stat.S_IMODE(os.stat(str(tmp_path / 'out.apkg')).st_mode) == 0o644
+
+
+class _ZipFileProxy:
+  """
+  Forwards to a ZipFile, except for the attributes in `overrides`. An override that is an exception is raised instead.
+  """
+  def __init__(self, zf, **overrides):
+    self._zf = zf
+    self._overrides = overrides
+
+  def __getattr__(self, name):
+    if name in self._overrides:
+      value = self._overrides[name]
+      if isinstance(value, Exception):
+        raise value
+      return value
+    return getattr(self._zf, name)
+
+
+@pytest.mark.parametrize('overrides', [
+  {'_seekable': AttributeError('_seekable')},
+  {'fp': AttributeError('fp')},
+  {'_writecheck': mock.Mock(side_effect=TypeError('_writecheck() takes 1 positional argument'))},
+])
+def test_copy_zip_entry_raw_fallback(tmp_path, overrides):
+  src = str(tmp_path / 'src.zip')
+  with zipfile.ZipFile(src, 'w') as z:
+    z.writestr('0', b'x' * 1000, compress_type=zipfile.ZIP_DEFLATED)
+
+  dst = str(tmp_path / 'dst.zip')
+  with zipfile.ZipFile(src) as inzip, open(src, 'rb') as rawin, zipfile.ZipFile(dst, 'w') as outzip:
+    outzip.writestr('first', b'first')
+    proxy = _ZipFileProxy(outzip, **overrides)
+    with mock.patch.object(package_updater, '_copy_zip_entry', wraps=package_updater._copy_zip_entry) as fallback:
+      package_updater._copy_zip_entry_raw(inzip, rawin, '0', proxy)
+    assert fallback.call_count == 1
+
+  with zipfile.ZipFile(dst) as z:
+    assert z.testzip() is None
+    assert z.read('first') == b'first'
+    assert z.read('0') == b'x' * 1000
+    assert z.getinfo('0').compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_bad_package_leaves_no_temp_files(tmp_path):
+  path = str(tmp_path / 'bad.apkg')
+  with zipfile.ZipFile(path, 'w') as z:
+    z.writestr('media', '{}')  # no collection.anki2
+
+  with mock.patch('tempfile.tempdir', str(tmp_path)):
+    with pytest.raises(KeyError):
+      genanki.PackageUpdater(path)
+  assert os.listdir(str(tmp_path)) == ['bad.apkg']
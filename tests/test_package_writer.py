@@ -0,0 +1,69 @@
+import gc
+import weakref
+
+import pytest
+
+import genanki
+from tests.test_package import _read_apkg_collection
+
+
+def _notes(n):
+  for i in range(n):
+    yield genanki.Note(genanki.BASIC_AND_REVERSED_CARD_MODEL, ['front {}'.format(i), 'back {}'.format(i)])
+
+
+@pytest.mark.parametrize('in_memory', [False, True])
+def test_matches_package(tmp_path, in_memory):
+  deck = genanki.Deck(1450921547, 'streamed deck')
+  with genanki.PackageWriter(str(tmp_path / 'streamed.apkg'), timestamp=1600000000, in_memory=in_memory) as writer:
+    writer.add_notes(deck, _notes(50))
+
+  deck = genanki.Deck(1450921547, 'streamed deck')
+  for note in _notes(50):
+    deck.add_note(note)
+  genanki.Package(deck).write_to_file(str(tmp_path / 'package.apkg'), timestamp=1600000000)
+
+  assert _read_apkg_collection(str(tmp_path / 'streamed.apkg')) == \
+         _read_apkg_collection(str(tmp_path / 'package.apkg'))
+
+
+def test_add_deck_and_multiple_decks(tmp_path):
+  deck1 = genanki.Deck(1450921548, 'deck 1')
+  deck1.add_note(genanki.Note(genanki.BASIC_MODEL, ['a', 'b']))
+  deck2 = genanki.Deck(1450921549, 'deck 2')
+
+  with genanki.PackageWriter(str(tmp_path / 'out.apkg')) as writer:
+    writer.add_deck(deck1)
+    writer.add_note(deck2, genanki.Note(genanki.CLOZE_MODEL, ['{{c1::a}} {{c2::b}}', '']))
+
+  (notes, cards, col), media = _read_apkg_collection(str(tmp_path / 'out.apkg'))
+  assert len(notes) == 2
+  assert sorted(card[2] for card in cards) == [1450921548, 1450921549, 1450921549]
+  assert media == {}
+
+
+def test_notes_are_not_retained(tmp_path):
+  deck = genanki.Deck(1450921550, 'deck')
+  with genanki.PackageWriter(str(tmp_path / 'out.apkg')) as writer:
+    note = genanki.Note(genanki.BASIC_MODEL, ['a', 'b'])
+    ref = weakref.ref(note)
+    writer.add_note(deck, note)
+    del note
+    gc.collect()
+    assert ref() is None
+
+
+def test_no_file_written_on_error(tmp_path):
+  deck = genanki.Deck(1450921551, 'deck')
+  with pytest.raises(RuntimeError):
+    with genanki.PackageWriter(str(tmp_path / 'out.apkg')) as writer:
+      writer.add_note(deck, genanki.Note(genanki.BASIC_MODEL, ['a', 'b']))
+      raise RuntimeError
+
+  assert not (tmp_path / 'out.apkg').exists()
+
+
+def test_deck_without_id_fails(tmp_path):
+  with pytest.raises(TypeError):
+    with genanki.PackageWriter(str(tmp_path / 'out.apkg')) as writer:
+      writer.add_note(genanki.Deck(name='deck'), genanki.Note(genanki.BASIC_MODEL, ['a', 'b']))
@@ -0,0 +1,76 @@
+import io
+import zipfile
+from unittest import mock
+
+import pytest
+
+import genanki
+from genanki import sharded_build
+from tests.test_package import _read_apkg_collection
+
+
+def _package(tmp_path, num_notes=25, num_media=3):
+  deck = genanki.Deck(1450921600, 'progress deck')
+  for i in range(num_notes):
+    deck.add_note(genanki.Note(genanki.BASIC_MODEL, ['front {}'.format(i), 'back']))
+  media_files = []
+  for i in range(num_media):
+    path = tmp_path / 'media{}.txt'.format(i)
+    path.write_bytes(b'x' * 5000)
+    media_files.append(str(path))
+  return genanki.Package(deck, media_files=media_files)
+
+
+def test_plain_callback(tmp_path):
+  events = []
+  _package(tmp_path).write_to_file(str(tmp_path / 'out.apkg'), progress=events.append)
+
+  # 25 notes is less than the default interval, so notes are only reported once they're all written
+  note_events = [e for e in events if e.phase == 'notes']
+  assert [e.notes_done for e in note_events] == [25]
+  assert [e.media_files_done for e in events if e.phase == 'zip'] == [1, 2, 3]
+  assert events[-1].phase == 'done'
+  assert events[-1].notes_done == events[-1].notes_total == 25
+  assert events[-1].media_files_done == events[-1].media_files_total == 3
+  with zipfile.ZipFile(str(tmp_path / 'out.apkg')) as z:
+    assert events[-1].bytes_written >= sum(info.compress_size for info in z.infolist())
+  assert events[-1].bytes_total >= 15000
+
+
+def test_intervals(tmp_path):
+  events = []
+  reporter = genanki.ProgressReporter(events.append, note_interval=10, byte_interval=4096)
+  _package(tmp_path).write_to_file(str(tmp_path / 'out.apkg'), progress=reporter)
+
+  assert [e.notes_done for e in events if e.phase == 'notes'] == [10, 20, 25]
+  bytes_written = [e.bytes_written for e in events if e.phase == 'zip']
+  assert bytes_written == sorted(bytes_written)
+  # the collection alone is well over 4 KiB, so it's reported on several times
+  assert len(bytes_written) > 5
+
+
+def test_output_unchanged(tmp_path):
+  _package(tmp_path).write_to_file(str(tmp_path / 'plain.apkg'), timestamp=1600000000)
+  _package(tmp_path).write_to_file(str(tmp_path / 'progress.apkg'), timestamp=1600000000, progress=lambda e: None)
+  buf = io.BytesIO()
+  _package(tmp_path).write_to_file(buf, timestamp=1600000000, progress=lambda e: None)
+
+  with open(str(tmp_path / 'plain.apkg'), 'rb') as h:
+    plain = h.read()
+  with open(str(tmp_path / 'progress.apkg'), 'rb') as h:
+    assert h.read() == plain
+  assert buf.getvalue() == plain
+
+
+@pytest.mark.parametrize('option', ['workers', 'cache_dir'])
+def test_workers_and_cache_dir(tmp_path, option):
+  events = []
+  kwargs = {'workers': 2} if option == 'workers' else {'cache_dir': str(tmp_path / 'cache')}
+  with mock.patch.object(sharded_build, 'MIN_NOTES_PER_SHARD', 5):
+    _package(tmp_path).write_to_file(
+      str(tmp_path / 'out.apkg'), progress=genanki.ProgressReporter(events.append, note_interval=1), **kwargs)
+
+  notes_done = [e.notes_done for e in events if e.phase == 'notes']
+  assert notes_done == sorted(notes_done)
+  assert notes_done[-1] == 25
+  assert len(_read_apkg_collection(str(tmp_path / 'out.apkg'))[0][0]) == 25
@@ -0,0 +1,85 @@
+import os
+from unittest import mock
+
+import pytest
+
+import genanki
+from genanki import required_fields
+from genanki.required_fields import compute_req, compute_req_cached, _compute_req_by_rendering
+
+TEMPLATES = [
+  '{{Front}}',
+  '{{Back}}',
+  '{{#Add Reverse}}{{Back}}{{/Add Reverse}}',
+  '{{Front}}\n\n{{type:Back}}',
+  '{{cloze:Front}}',
+  '{{Front}}{{#Back}}<br>Hint: {{Back}}{{/Back}}',
+  '{{^Front}}{{Back}}{{/Front}}',
+  '{{#Front}}{{#Back}}{{Add Reverse}}{{/Back}}{{/Front}}',
+  '{{#Front}}{{/Front}}{{Back}}{{{Add Reverse}}}',
+  '{{=<% %>=}}<% Front %><%! comment %>',
+  '{{#Front}}{{.}}{{/Front}}',  # not analyzable, falls back to rendering
+  '{{#Front}}{{upper}}{{/Front}}{{Back}}',  # not analyzable, falls back to rendering
+  '{{Missing}}{{Back}}',
+]
+FIELD_NAMES = ['Front', 'Back', 'Add Reverse']
+
+
+@pytest.mark.parametrize('qfmt', TEMPLATES)
+def test_matches_rendering(qfmt):
+  templates = [{'qfmt': qfmt}]
+  assert compute_req(FIELD_NAMES, templates) == _compute_req_by_rendering(FIELD_NAMES, templates)
+
+
+def test_builtin_models():
+  assert genanki.BASIC_MODEL._req == [[0, 'all', [0]]]
+  assert genanki.BASIC_AND_REVERSED_CARD_MODEL._req == [[0, 'all', [0]], [1, 'all', [1]]]
+  assert genanki.BASIC_OPTIONAL_REVERSED_CARD_MODEL._req == [[0, 'all', [0]], [1, 'all', [1, 2]]]
+  assert genanki.BASIC_TYPE_IN_THE_ANSWER_MODEL._req == [[0, 'all', [0]]]
+
+
+def test_with_hint():
+  assert compute_req(['Question', 'Hint', 'Answer'], [{'qfmt': '{{Question}}{{#Hint}}<br>Hint: {{Hint}}{{/Hint}}'}]) \
+         == [[0, 'any', [0, 1]]]
+
+
+def test_no_content_raises():
+  with pytest.raises(Exception, match='Could not compute required fields'):
+    # any two fields produce content, but no single field does
+    compute_req(['A', 'B', 'C'], [{'qfmt': '{{#A}}{{B}}{{/A}}{{#B}}{{C}}{{/B}}{{#C}}{{A}}{{/C}}'}])
+
+
+def test_req_recomputed_when_templates_change():
+  model = genanki.Model(1736251490, 'm', fields=[{'name': 'A'}, {'name': 'B'}], templates=[{'qfmt': '{{A}}'}])
+  assert model._req == [[0, 'all', [0]]]
+  model.templates = [{'qfmt': '{{B}}'}]
+  assert model._req == [[0, 'all', [1]]]
+
+
+class TestDiskCache:
+  def test_disabled_without_env_var(self, monkeypatch):
+    monkeypatch.delenv('GENANKI_CACHE_DIR', raising=False)
+    assert compute_req_cached(FIELD_NAMES, [{'qfmt': '{{Front}}'}]) == [[0, 'all', [0]]]
+
+  def test_second_call_uses_cache(self, monkeypatch, tmp_path):
+    monkeypatch.setenv('GENANKI_CACHE_DIR', str(tmp_path))
+    templates = [{'qfmt': '{{Front}}'}, {'qfmt': '{{Back}}'}]
+
+    assert compute_req_cached(FIELD_NAMES, templates) == [[0, 'all', [0]], [1, 'all', [1]]]
+    assert len(os.listdir(str(tmp_path / 'req'))) == 1
+
+    with mock.patch.object(required_fields, 'compute_req') as compute_req_mock:
+      assert compute_req_cached(FIELD_NAMES, templates) == [[0, 'all', [0]], [1, 'all', [1]]]
+    compute_req_mock.assert_not_called()
+
+  def test_key_includes_field_names(self, monkeypatch, tmp_path):
+    monkeypatch.setenv('GENANKI_CACHE_DIR', str(tmp_path))
+    templates = [{'qfmt': '{{Front}}'}]
+    assert compute_req_cached(['Front', 'Back'], templates) == [[0, 'all', [0]]]
+    assert compute_req_cached(['Back', 'Front'], templates) == [[0, 'all', [1]]]
+
+  def test_unwritable_cache_dir_is_ignored(self, monkeypatch, tmp_path):
+    not_a_dir = tmp_path / 'file'
+    not_a_dir.write_text('')
+    monkeypatch.setenv('GENANKI_CACHE_DIR', str(not_a_dir))
+    assert compute_req_cached(FIELD_NAMES, [{'qfmt': '{{Front}}'}]) == [[0, 'all', [0]]]
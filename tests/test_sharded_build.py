@@ -0,0 +1,124 @@
+import concurrent.futures
+import itertools
+import sqlite3
+from unittest import mock
+
+import pytest
+
+import genanki
+from genanki import sharded_build
+from genanki.apkg_col import APKG_COL
+from genanki.apkg_schema import APKG_TABLES
+from tests.test_package import _read_apkg_collection
+
+
+def _decks():
+  decks = []
+  for deck_idx in range(3):
+    deck = genanki.Deck(1450921580 + deck_idx, 'sharded deck {}'.format(deck_idx))
+    for i in range(40):
+      deck.add_note(genanki.Note(genanki.BASIC_AND_REVERSED_CARD_MODEL, ['front {} {}'.format(deck_idx, i), 'back']))
+      deck.add_note(genanki.Note(genanki.CLOZE_MODEL, ['{{{{c1::a}}}} {{{{c2::{} {}}}}}'.format(deck_idx, i), '']))
+    decks.append(deck)
+  return decks
+
+
+@pytest.fixture
+def small_shards():
+  with mock.patch.object(sharded_build, 'MIN_NOTES_PER_SHARD', 10):
+    yield
+
+
+def test_plan_shards():
+  assert sharded_build.plan_shards(10 ** 6, None) is None
+  assert sharded_build.plan_shards(10 ** 6, 1) is None
+  assert sharded_build.plan_shards(100, 8) is None
+  assert sharded_build.plan_shards(10 ** 6, 8) == 10 ** 6 // 32
+
+
+def test_matches_single_process(tmp_path, small_shards):
+  genanki.Package(_decks()).write_to_file(str(tmp_path / 'single.apkg'), timestamp=1600000000)
+  genanki.Package(_decks()).write_to_file(str(tmp_path / 'sharded.apkg'), timestamp=1600000000, workers=3)
+
+  assert _read_apkg_collection(str(tmp_path / 'sharded.apkg')) == \
+         _read_apkg_collection(str(tmp_path / 'single.apkg'))
+
+
+def test_id_gen_advanced(small_shards):
+  conn = sqlite3.connect(':memory:')
+  id_gen = itertools.count(1000)
+  genanki.Package(_decks()).write_to_db(conn.cursor(), 1600000000, id_gen, workers=2)
+
+  max_id, = conn.execute('SELECT max(id) FROM (SELECT id FROM notes UNION SELECT id FROM cards)').fetchone()
+  assert next(id_gen) == max_id + 1
+
+
+def test_warnings_and_errors_propagate(tmp_path, small_shards):
+  decks = _decks()
+  decks[1].notes[5].fields[1] = 'a <$bad> tag'
+  with pytest.warns(UserWarning, match='invalid HTML tags'):
+    genanki.Package(decks).write_to_file(str(tmp_path / 'out.apkg'), workers=2)
+
+  decks[1].notes[5].fields[1] = 'back'
+  decks[2].notes[7].fields.append('extra')
+  with pytest.raises(ValueError, match='Number of fields'):
+    genanki.Package(decks).write_to_file(str(tmp_path / 'out.apkg'), workers=2)
+
+
+class _InlineExecutor:
+  """
+  Runs each submitted call right away, and records the most shards submitted but not yet merged.
+  """
+  def __init__(self, workers):
+    self.submitted = 0
+    self.merged = 0
+    self.max_in_flight = 0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    return False
+
+  def submit(self, fn, *args):
+    self.submitted += 1
+    self.max_in_flight = max(self.max_in_flight, self.submitted - self.merged)
+    future = concurrent.futures.Future()
+    future.set_result(fn(*args))
+    return future
+
+
+def test_shards_in_flight_bounded(small_shards):
+  executors = []
+  def make_executor(workers):
+    executors.append(_InlineExecutor(workers))
+    return executors[-1]
+  def on_shard_written(num_notes):
+    executors[-1].merged += 1
+
+  conn = sqlite3.connect(':memory:')
+  cursor = conn.cursor()
+  cursor.executescript(APKG_TABLES)
+  cursor.executescript(APKG_COL)
+  with mock.patch.object(concurrent.futures, 'ProcessPoolExecutor', make_executor):
+    num_notes, _ = sharded_build.write_notes_sharded(
+      cursor, _decks(), 1600000000, itertools.count(1000), 'full', 2, 10, on_shard_written)
+
+  assert num_notes == 240
+  assert executors[0].submitted == 24
+  assert executors[0].max_in_flight == 2 * sharded_build.SHARDS_IN_FLIGHT_PER_WORKER
+
+
+def test_suspended_cards(tmp_path, small_shards):
+  def decks():
+    decks = _decks()
+    for note in decks[1].notes[::2]:
+      note.cards[1].suspend = True
+    return decks
+
+  genanki.Package(decks()).write_to_file(str(tmp_path / 'single.apkg'), timestamp=1600000000)
+  genanki.Package(decks()).write_to_file(str(tmp_path / 'sharded.apkg'), timestamp=1600000000, workers=3)
+
+  sharded = _read_apkg_collection(str(tmp_path / 'sharded.apkg'))
+  assert sum(1 for card in sharded[0][1] if card[7] == -1) == 40
+  assert sharded == _read_apkg_collection(str(tmp_path / 'single.apkg'))
@@ -0,0 +1,152 @@
+import json
+import warnings
+from unittest import mock
+
+import pytest
+
+import genanki
+from genanki import tabular
+from genanki.__main__ import main
+from tests.test_package import _read_apkg_collection
+
+_ROWS = [('Capital of Argentina', 'Buenos Aires', 'geo south_america', 'americas'),
+         ('Capital of France', 'Paris', 'geo', 'europe'),
+         ('Capital of Peru', 'Lima', '', 'americas'),
+         ('Capital of Spain', 'Madrid', 'geo', '')]
+
+
+def _write_csv(tmp_path, delimiter=','):
+  path = tmp_path / ('cards.tsv' if delimiter == '\t' else 'cards.csv')
+  lines = [delimiter.join(['question', 'answer', 'tags', 'region'])]
+  lines += [delimiter.join(row) for row in _ROWS]
+  path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+  return str(path)
+
+
+def _expected_package(tmp_path):
+  """The same notes, built with Package and Note."""
+  decks = {}
+  for question, answer, tags, region in _ROWS:
+    name = 'Capitals::' + region if region else 'Capitals'
+    if name not in decks:
+      decks[name] = genanki.Deck(1234 if name == 'Capitals' else tabular.deck_id_for_name(name), name)
+    decks[name].add_note(genanki.Note(genanki.BASIC_MODEL, [question, answer], tags=tags.split()))
+  path = str(tmp_path / 'expected.apkg')
+  genanki.Package(list(decks.values())).write_to_file(path, timestamp=1600000000)
+  return path
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_write_table_to_package(tmp_path, workers):
+  out = str(tmp_path / 'out.apkg')
+  with open(_write_csv(tmp_path), newline='') as h:
+    num_notes = tabular.write_table_to_package(
+      tabular.iter_records(h, 'csv'), out, genanki.BASIC_MODEL, 'Capitals', ['question', 'answer'], deck_id=1234,
+      deck_column='region', tags_column='tags', workers=workers, chunk_size=2, timestamp=1600000000)
+  assert num_notes == 4
+
+  (notes, cards, col), _ = _read_apkg_collection(out)
+  (expected_notes, expected_cards, expected_col), _ = _read_apkg_collection(_expected_package(tmp_path))
+  # the same notes and cards, though the ids are handed out in input order rather than deck by deck
+  assert sorted(note[1:] for note in notes) == sorted(note[1:] for note in expected_notes)
+  assert len(cards) == len(expected_cards)
+  assert json.loads(col[0][10]).keys() == json.loads(expected_col[0][10]).keys()  # decks
+  # notes keep their input order
+  assert [note[6].split('\x1f')[0] for note in notes] == [row[0] for row in _ROWS]
+
+
+def test_cli_build(tmp_path, capsys):
+  model_path = tmp_path / 'model.yaml'
+  model_path.write_text('''
+id: 1607392319
+name: Capitals
+fields:
+  - name: Country
+  - name: City
+templates:
+  - name: Card 1
+    qfmt: '{{Country}}'
+    afmt: '{{City}}'
+''', encoding='utf-8')
+  input_path = tmp_path / 'cards.jsonl'
+  input_path.write_text(
+    json.dumps({'q': 'Capital of Chile', 'a': 'Santiago', 'tags': ['geo'], 'id': 'chile'}) + '\n\n' +
+    json.dumps({'q': 'Capital of Peru', 'a': 'Lima', 'tags': [], 'id': ''}) + '\n', encoding='utf-8')
+  out = str(tmp_path / 'out.apkg')
+
+  assert main(['build', str(input_path), '-o', out, '--model', str(model_path), '--deck', 'Capitals',
+               '--field', 'Country=q', '--field', 'City=a', '--tags-column', 'tags', '--guid-column', 'id']) == 0
+  assert 'Wrote 2 notes' in capsys.readouterr().err
+
+  with genanki.PackageReader(out) as reader:
+    notes = list(reader.iter_notes())
+    assert [note.fields for note in notes] == [['Capital of Chile', 'Santiago'], ['Capital of Peru', 'Lima']]
+    assert notes[0].guid == 'chile'
+    assert notes[1].guid == genanki.guid_for('Capital of Peru', 'Lima')
+    assert notes[0].tags == ['geo']
+    assert reader.models[1607392319].name == 'Capitals'
+    assert 'Capitals' in [deck.name for deck in reader.decks.values()]
+
+
+def test_cli_build_tsv_builtin_model(tmp_path):
+  out = str(tmp_path / 'out.apkg')
+  assert main(['build', _write_csv(tmp_path, '\t'), '-o', out, '--model', 'basic_model', '--deck', 'Capitals',
+               '--field', 'Front=question', '--field', 'Back=answer']) == 0
+  with genanki.PackageReader(out) as reader:
+    assert reader.num_notes() == 4
+    assert set(reader.models) == {genanki.BASIC_MODEL.model_id}
+
+
+def test_errors(tmp_path):
+  with pytest.raises(ValueError, match='Column'):
+    with open(_write_csv(tmp_path), newline='') as h:
+      tabular.write_table_to_package(tabular.iter_records(h, 'csv'), str(tmp_path / 'out.apkg'), genanki.BASIC_MODEL,
+                                     'Capitals')
+  assert not (tmp_path / 'out.apkg').exists()
+
+  with pytest.raises(ValueError, match='extension'):
+    tabular.guess_format('cards.txt')
+  with pytest.raises(SystemExit):
+    main(['build', _write_csv(tmp_path), '-o', str(tmp_path / 'out.apkg'), '--model', 'BASIC_MODEL', '--deck', 'x',
+          '--field', 'Nope=question'])
+
+
+@pytest.mark.parametrize('args, message', [
+  (['--model', 'NO_SUCH_MODEL'], "'NO_SUCH_MODEL' is neither a builtin model (BASIC_AND_REVERSED_CARD_MODEL, BASIC_MODEL, "),
+  (['--model', 'BASIC_MODEL', '--field', 'Front=nope', '--field', 'Back=answer'], 'Column'),
+])
+def test_cli_build_errors(tmp_path, args, message):
+  with pytest.raises(SystemExit) as excinfo:
+    main(['build', _write_csv(tmp_path), '-o', str(tmp_path / 'out.apkg'), '--deck', 'x'] + args)
+  assert str(excinfo.value).startswith('genanki build: error: ')
+  assert message in str(excinfo.value)
+  assert not (tmp_path / 'out.apkg').exists()
+
+
+def test_cli_build_unknown_extension(tmp_path):
+  with pytest.raises(SystemExit, match='extension'):
+    main(['build', str(tmp_path / 'cards.txt'), '-o', str(tmp_path / 'out.apkg'), '--model', 'BASIC_MODEL',
+          '--deck', 'x'])
+  with pytest.raises(SystemExit, match='No such file'):
+    main(['build', str(tmp_path / 'missing.csv'), '-o', str(tmp_path / 'out.apkg'), '--model', 'BASIC_MODEL',
+          '--deck', 'x'])
+
+
+def test_html_warnings_from_workers(tmp_path):
+  records = [{'Front': 'a <$bad> tag' if i == 5 else 'ok', 'Back': str(i)} for i in range(10)]
+  with pytest.warns(UserWarning, match='invalid HTML'):
+    tabular.write_table_to_package(records, str(tmp_path / 'out.apkg'), genanki.BASIC_MODEL, 'deck', workers=2,
+                                   chunk_size=3)
+  with warnings.catch_warnings():
+    warnings.simplefilter('error')
+    tabular.write_table_to_package(records, str(tmp_path / 'out.apkg'), genanki.BASIC_MODEL, 'deck', workers=2,
+                                   chunk_size=3, html_validation='off')
+
+
+def test_guids_computed_in_one_batch():
+  run = [('', ('a', 'b'), (), ''), ('', ('c', 'd'), (), 'explicit'), ('', ('e', 'f'), (), '')]
+  with mock.patch.object(tabular, 'guid_for_many', wraps=tabular.guid_for_many) as guid_for_many:
+    assert tabular._guids(run) == [genanki.guid_for('a', 'b'), 'explicit', genanki.guid_for('e', 'f')]
+    assert guid_for_many.call_count == 1
+    # NoteColumns computes them when none are given
+    assert tabular._guids([run[0], run[2]]) is None
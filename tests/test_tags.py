@@ -0,0 +1,116 @@
+import io
+import json
+import sqlite3
+import zipfile
+from unittest import mock
+
+import pytest
+
+import genanki
+from genanki import sharded_build, tags
+from genanki.tags import TagRegistry
+
+
+def _col_tags(apkg_bytes, tmp_path):
+  path = tmp_path / 'collection.anki2'
+  with zipfile.ZipFile(io.BytesIO(apkg_bytes)) as z:
+    path.write_bytes(z.read('collection.anki2'))
+  conn = sqlite3.connect(str(path))
+  try:
+    return json.loads(conn.execute('SELECT tags FROM col').fetchone()[0])
+  finally:
+    conn.close()
+
+
+def _deck():
+  deck = genanki.Deck(1450921900, 'tags deck')
+  for i in range(40):
+    deck.add_note(genanki.Note(genanki.BASIC_MODEL, ['front {}'.format(i), 'back'], tags=['t{}'.format(i % 3), 'all']))
+  deck.add_note(genanki.Note(genanki.BASIC_MODEL, ['untagged', 'back']))
+  return deck
+
+
+def test_registry_formats_and_collects():
+  registry = TagRegistry()
+  assert registry.format(['b', 'a']) == ' b a '
+  assert registry.format(('b', 'a')) is registry.format(['b', 'a'])
+  assert registry.format([]) == '  '
+  registry.add_formatted(' c a ')
+  assert registry.names() == ['a', 'b', 'c']
+
+  with pytest.raises(ValueError, match='contains a space'):
+    registry.format(['a b'])
+
+
+def test_registry_past_max_cached():
+  collecting = TagRegistry()
+  not_collecting = TagRegistry(collect=False)
+  with mock.patch.object(TagRegistry, 'MAX_CACHED', 2):
+    for tag in ['a', 'b', 'c', 'd', 'a']:
+      collecting.intern(tag)
+      not_collecting.intern(tag)
+    for tags_ in [['a'], ['b'], ['c'], ['a']]:
+      collecting.format(tags_)
+  # col.tags needs every tag, so only tag sets are capped in a collecting registry
+  assert collecting.names() == ['a', 'b', 'c', 'd']
+  assert len(collecting._formatted) == 2
+  assert len(not_collecting._tags) == 2
+  with pytest.raises(ValueError, match='contains a space'):
+    not_collecting.intern('still validated')
+
+
+def test_notes_share_tag_strings():
+  first = genanki.Note(genanki.BASIC_MODEL, ['1', '2'], tags=[''.join(['sha', 'red'])])
+  second = genanki.Note(genanki.BASIC_MODEL, ['3', '4'], tags=[''.join(['sha', 'red'])])
+  assert first.tags[0] is second.tags[0]
+
+  with pytest.raises(ValueError, match='contains a space'):
+    first.tags.append('not valid')
+  with pytest.raises(ValueError, match='contains a space'):
+    first.tags[0:1] = ['ok', 'not valid']
+  assert first.tags == ['shared']
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_package_col_tags(tmp_path, workers):
+  with mock.patch.object(sharded_build, 'MIN_NOTES_PER_SHARD', 10):
+    apkg = genanki.Package(_deck()).write_to_bytes(timestamp=1600000000, workers=workers)
+  assert _col_tags(apkg, tmp_path) == {'all': 0, 't0': 0, 't1': 0, 't2': 0}
+
+
+def test_note_columns_col_tags(tmp_path):
+  deck = genanki.Deck(1450921900, 'tags deck')
+  deck.add_notes_from_columns(genanki.BASIC_MODEL, [['a', 'b'], ['c', 'd']], tags=[['x'], ['y', 'x']])
+  apkg = genanki.Package(deck).write_to_bytes(timestamp=1600000000)
+  assert _col_tags(apkg, tmp_path) == {'x': 0, 'y': 0}
+
+
+def test_package_writer_col_tags(tmp_path):
+  output = io.BytesIO()
+  with genanki.PackageWriter(output, timestamp=1600000000) as writer:
+    writer.add_deck(_deck())
+  assert _col_tags(output.getvalue(), tmp_path) == {'all': 0, 't0': 0, 't1': 0, 't2': 0}
+
+
+def test_package_updater_col_tags(tmp_path):
+  path = str(tmp_path / 'deck.apkg')
+  deck = _deck()
+  genanki.Package(deck).write_to_file(path, timestamp=1600000000)
+
+  with genanki.PackageUpdater(path, timestamp=1600000001) as updater:
+    updater.upsert_note(deck, genanki.Note(genanki.BASIC_MODEL, ['new', 'back'], tags=['fresh']))
+    updater.upsert_note(deck, genanki.Note(genanki.BASIC_MODEL, ['front 0', 'back'], tags=['all']))
+
+  with open(path, 'rb') as h:
+    # t0 is still used by other notes
+    assert _col_tags(h.read(), tmp_path) == {'all': 0, 'fresh': 0, 't0': 0, 't1': 0, 't2': 0}
+
+
+def test_reset_interned_tags():
+  note = genanki.Note(genanki.BASIC_MODEL, ['1', '2'], tags=[''.join(['res', 'et'])])
+  assert tags._NOTE_TAGS.intern('reset') is note.tags[0]
+
+  genanki.reset_interned_tags()
+  assert 'reset' not in tags._NOTE_TAGS._tags
+  assert note.tags == ['reset']
+  assert genanki.Note(genanki.BASIC_MODEL, ['3', '4'], tags=['reset']).tags[0] is tags._NOTE_TAGS.intern('reset')
@@ -0,0 +1,103 @@
+import os
+from unittest import mock
+
+import pytest
+
+import genanki
+from genanki import sharded_build
+
+
+class _RecordingTracer(genanki.Tracer):
+  def __init__(self):
+    self.events = []
+
+  def start(self, phase, **info):
+    self.events.append(('start', phase, info))
+
+  def end(self, phase, duration, **info):
+    assert duration >= 0
+    self.events.append(('end', phase, info))
+
+
+def _package(tmp_path):
+  deck1 = genanki.Deck(1450921590, 'deck 1')
+  deck1.add_note(genanki.Note(genanki.BASIC_AND_REVERSED_CARD_MODEL, ['a', 'b']))
+  deck1.add_note(genanki.Note(genanki.BASIC_MODEL, ['c', 'd']))
+  deck2 = genanki.Deck(1450921591, 'deck 2')
+  deck2.add_note(genanki.Note(genanki.CLOZE_MODEL, ['{{c1::e}} {{c2::f}}', '']))
+
+  media_path = str(tmp_path / 'sound.mp3')
+  with open(media_path, 'wb') as h:
+    h.write(b'x' * 100)
+  return genanki.Package([deck1, deck2], media_files=[media_path])
+
+
+@pytest.mark.parametrize('in_memory', [False, True])
+def test_events(tmp_path, in_memory):
+  tracer = _RecordingTracer()
+  _package(tmp_path).write_to_file(str(tmp_path / 'out.apkg'), in_memory=in_memory, tracer=tracer)
+
+  ends = {}
+  for kind, phase, info in tracer.events:
+    if kind == 'end':
+      ends.setdefault(phase, []).append(info)
+
+  expected = {
+    'write_to_file', 'build', 'schema', 'col_json', 'notes', 'deck', 'card_generation', 'indexes', 'zip_collection',
+    'media', 'zip_media'}
+  if in_memory:
+    expected.add('serialize')
+  assert set(ends) == expected
+
+  assert ends['deck'] == [
+    {'deck_id': 1450921590, 'name': 'deck 1', 'notes': 2, 'cards': 3},
+    {'deck_id': 1450921591, 'name': 'deck 2', 'notes': 1, 'cards': 2},
+  ]
+  assert ends['notes'] == [{'notes': 3, 'cards': 5}]
+  assert ends['col_json'] == [{'decks': 2, 'models': 3}]
+  assert ends['zip_media'] == [{'files': 1, 'bytes': 100}]
+  assert ends['zip_collection'][0]['bytes'] > 0
+
+  # start/end pairs are properly nested, except card_generation, which only has an end
+  stack = []
+  for kind, phase, _ in tracer.events:
+    if kind == 'start':
+      stack.append(phase)
+    elif phase != 'card_generation':
+      assert stack.pop() == phase
+  assert stack == []
+  assert tracer.events[0][:2] == ('start', 'write_to_file')
+  assert tracer.events[-1][:2] == ('end', 'write_to_file')
+
+
+def test_summary_tracer(tmp_path):
+  tracer = genanki.SummaryTracer()
+  _package(tmp_path).write_to_file(str(tmp_path / 'out.apkg'), tracer=tracer)
+  summary = tracer.summary()
+
+  assert summary['phases']['deck']['calls'] == 2
+  assert summary['phases']['deck']['notes'] == 3
+  assert summary['phases']['notes']['cards'] == 5
+  assert summary['phases']['write_to_file']['seconds'] >= summary['phases']['build']['seconds']
+  assert summary['decks'][1450921591]['name'] == 'deck 2'
+  assert summary['decks'][1450921591]['cards'] == 2
+
+
+def test_workers_and_cache_dir(tmp_path):
+  tracer = genanki.SummaryTracer()
+  with mock.patch.object(sharded_build, 'MIN_NOTES_PER_SHARD', 1):
+    _package(tmp_path).write_to_file(str(tmp_path / 'out.apkg'), workers=2, tracer=tracer)
+  phases = tracer.summary()['phases']
+  assert 'deck' not in phases
+  assert (phases['notes']['notes'], phases['notes']['cards']) == (3, 5)
+
+  tracer = genanki.SummaryTracer()
+  _package(tmp_path).write_to_file(str(tmp_path / 'out.apkg'), cache_dir=str(tmp_path / 'cache'), tracer=tracer)
+  assert {'build', 'zip_collection', 'zip_media'} <= set(tracer.summary()['phases'])
+
+
+def test_no_tracer_does_not_time_cards(tmp_path):
+  with mock.patch('time.perf_counter') as perf_counter:
+    _package(tmp_path).write_to_file(str(tmp_path / 'out.apkg'))
+  perf_counter.assert_not_called()
+  assert os.path.exists(str(tmp_path / 'out.apkg'))
@@ -0,0 +1,54 @@
+from unittest import mock
+
+import genanki
+from genanki import note as note_module
+from genanki.util import BASE91_TABLE, _base91, guid_for, guid_for_many
+
+
+def test_guid_for_known_values():
+  # values produced by earlier versions of genanki; these must never change
+  assert guid_for('a', 'b') == 'q/([o$8RAO'
+  assert guid_for('Capital of Argentina', 'Buenos Aires') == 'HSnG{z%dU<'
+  assert guid_for() == guid_for('')
+
+
+def test_base91_matches_digit_by_digit_encoding():
+  def reference(hash_int):
+    rv_reversed = []
+    while hash_int > 0:
+      rv_reversed.append(BASE91_TABLE[hash_int % len(BASE91_TABLE)])
+      hash_int //= len(BASE91_TABLE)
+    return ''.join(reversed(rv_reversed))
+
+  for hash_int in [0, 1, 90, 91, 92, 8280, 8281, 8282, 91 ** 3, 91 ** 3 + 5, 91 ** 9, 2 ** 64 - 1]:
+    assert _base91(hash_int) == reference(hash_int)
+
+
+def test_guid_for_many_matches_guid_for():
+  rows = [['a', 'b'], [], [''], ['中国', 'China', 3], ['x' * 1000]]
+  assert guid_for_many(rows) == [guid_for(*row) for row in rows]
+
+
+def test_guid_for_many_accepts_generator():
+  assert guid_for_many(iter([('a',), ('b',)])) == [guid_for('a'), guid_for('b')]
+
+
+class TestNoteGuidMemo:
+  def test_memoized(self):
+    note = genanki.Note(genanki.BASIC_MODEL, ['a', 'b'])
+    with mock.patch.object(note_module, 'guid_for', wraps=guid_for) as guid_for_mock:
+      assert note.guid == guid_for('a', 'b')
+      assert note.guid == guid_for('a', 'b')
+    assert guid_for_mock.call_count == 1
+
+  def test_recomputed_when_fields_change(self):
+    note = genanki.Note(genanki.BASIC_MODEL, ['a', 'b'])
+    assert note.guid == guid_for('a', 'b')
+    note.fields[1] = 'c'
+    assert note.guid == guid_for('a', 'c')
+    note.fields = ['d', 'e']
+    assert note.guid == guid_for('d', 'e')
+
+  def test_explicit_guid(self):
+    note = genanki.Note(genanki.BASIC_MODEL, ['a', 'b'], guid='explicit')
+    assert note.guid == 'explicit'